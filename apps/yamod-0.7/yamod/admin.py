@@ -1,34 +1,152 @@
+from django.conf import settings
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db.models import Count
 from yamod import models
+from yamod import search
+from yamod.cache import get_or_compute
+from yamod.conditional import table_name, table_versions
+from yamod.pagination import EstimatedCountPaginator
 
-class MovieAdmin(admin.ModelAdmin):
+
+def performance_mode():
+    return getattr(settings, "YAMOD_ADMIN_PERFORMANCE_MODE", True)
+
+
+class PerformanceModeAdmin(admin.ModelAdmin):
+    '''
+    Change lists for large tables. In performance mode
+    (YAMOD_ADMIN_PERFORMANCE_MODE, on by default) the unfiltered list
+    is not counted (pagination.EstimatedCountPaginator), a filtered
+    list does not count the whole table again for its "... total"
+    link, and subclasses may override search_queryset to search
+    through an index instead of LIKE '%...%' on every search field.
+    '''
+
+    # the change lists show no related objects, never join any
+    list_select_related = ()
+
+    @property
+    def show_full_result_count(self):
+        return not performance_mode()
+
+    def known_count(self, request):
+        '''
+        The number of rows of the change list if known without
+        counting them, None otherwise.
+        '''
+        return None
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        if not performance_mode():
+            return Paginator(queryset, per_page, orphans, allow_empty_first_page)
+        return EstimatedCountPaginator(queryset, per_page, orphans, allow_empty_first_page,
+                                       count=self.known_count(request))
+
+    def search_queryset(self, request, queryset, search_term):
+        '''
+        The rows matching search_term without duplicates, by default
+        the search of ModelAdmin.
+        '''
+        queryset, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        return queryset.distinct() if may_have_duplicates else queryset
+
+    def get_search_results(self, request, queryset, search_term):
+        if not performance_mode() or not search_term.strip():
+            return super().get_search_results(request, queryset, search_term)
+        return self.search_queryset(request, queryset, search_term), False
+
+
+class MovieAdmin(PerformanceModeAdmin):
     '''
     Update this class. The change list 
     should display movie_title, released data and run time. 
     Moreover, the change list should be searchable by movie and 
     original title.
     '''
-    list_display = ("movie_title","released","runtime")
-    
+    list_display = ("movie_title","released","runtime","cast_count")
+    search_fields = ("movie_title","original_title")
+
+    def search_queryset(self, request, queryset, search_term):
+        # the full text index of search.py, words match as prefixes
+        return search.filter_matches(queryset, "movie", search_term)
+
 
-class GenreAdmin(admin.ModelAdmin): 
+class GenreAdmin(PerformanceModeAdmin):
     '''
     Update this class. The change list should be searchable by genre name, 
     the list itself should show the name of the genre
     '''
     
     search_fields = ("name",)
-    list_display  = ("name",)
+    list_display  = ("name","movie_count")
 
+    def search_queryset(self, request, queryset, search_term):
+        # genres starting with the term: a range of the unique name_key index
+        key = models.Genre.normalize(search_term)
+        return queryset.filter(name_key__gte=key, name_key__lt=key + "\U0010ffff")
 
-class PersonAdmin(admin.ModelAdmin):
+
+def gender_counts():
+    '''
+    {gender: number of people}, cached until the person table changes
+    (see conditional.py).
+    '''
+    table = table_name(models.Person)
+    version, updated_at = table_versions([table])[table]
+    return get_or_compute(
+        "yamod:admin:genders:%d" % version,
+        lambda: dict(models.Person.objects.order_by().values_list("gender").annotate(count=Count("pk"))),
+        name="admin"
+    )
+
+
+class GenderFilter(admin.SimpleListFilter):
+    '''
+    The gender filter with the number of people per gender (cached,
+    see gender_counts). Same parameter as list_filter = ("gender",).
+    '''
+
+    title = "gender"
+    parameter_name = "gender__exact"
+
+    def lookups(self, request, model_admin):
+        counts = gender_counts()
+        return [
+            (gender, "%s (%d)" % (label, counts.get(gender, 0)))
+            for gender, label in models.Person.GENDER_CHOICES
+        ]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(gender=self.value())
+        return queryset
+
+
+class PersonAdmin(PerformanceModeAdmin):
     '''
     Update this class. The change list, shoule show credited_name,
     year_of_birth, year_of_death and gender. 
     Add a filter in the change list to add gender
     '''
     
+    list_display = ("credited_name","year_of_birth","year_of_death","gender")
     list_filter = ("gender",)
+    search_fields = ("credited_name",)
+
+    def get_list_filter(self, request):
+        return (GenderFilter,) if performance_mode() else self.list_filter
+
+    def known_count(self, request):
+        # filtered by gender only: the count of the filter
+        gender = request.GET.get(GenderFilter.parameter_name)
+        if set(request.GET) - {"p", "o"} == {GenderFilter.parameter_name} and \
+                gender in dict(models.Person.GENDER_CHOICES):
+            return gender_counts().get(gender, 0)
+        return None
+
+    def search_queryset(self, request, queryset, search_term):
+        return search.filter_matches(queryset, "person", search_term)
 
 # Now register the your admin classes with Django - otherwise 
 # you want see them in your admin application:
@@ -36,4 +154,3 @@ class PersonAdmin(admin.ModelAdmin):
 admin.site.register(models.Movie,MovieAdmin)
 admin.site.register(models.Genre,GenreAdmin)
 admin.site.register(models.Person,PersonAdmin)
-
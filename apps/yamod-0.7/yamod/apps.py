@@ -1,6 +1,18 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate, pre_migrate
 
 
 class YamodConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'yamod'
+
+    def ready(self):
+        # connect the cache invalidation receivers
+        from . import signals
+        # the SQLite counter triggers must not exist while tables are rebuilt
+        from . import counters
+        pre_migrate.connect(counters.drop_before_migrate, sender=self)
+        post_migrate.connect(counters.create_after_migrate, sender=self)
+        # table rebuilds drop the search triggers
+        from . import search
+        post_migrate.connect(search.create_after_migrate, sender=self)
@@ -0,0 +1,135 @@
+'''
+Async (ASGI native) versions of the read endpoints:
+
+    GET /async/genres/                  like GET /genres/ (?name=, ?order_by=)
+    GET /async/genres/<pk>/             like GET /genres/<pk>/
+
+Under ASGI a sync view holds a thread of the sync_to_async pool for
+the whole request; these views only leave the event loop for the
+database. They share the cache entries, validators (ETag) and JSON
+output of views.GenreViewSet, authenticate with a JWT and do not
+support pagination, streaming or the browsable API.
+
+Django 3.2 has no async ORM: aget and aiterator below use the
+QuerySet methods where Django provides them (4.1+) and otherwise run
+the query in the sync thread, one hop per call (aiterator: per chunk).
+New async endpoints (movies, people) subclass AsyncListRetrieveView.
+'''
+import itertools
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, JsonResponse
+from rest_framework.exceptions import AuthenticationFailed
+
+from . import cache
+from .authentication import CachedJSONWebTokenAuthentication
+from . import models
+from .conditional import aconditional
+
+
+async def aget(queryset, **kwargs):
+    if hasattr(queryset, "aget"):
+        return await queryset.aget(**kwargs)
+    return await sync_to_async(queryset.get)(**kwargs)
+
+
+async def aiterator(queryset, chunk_size=2000):
+    if hasattr(queryset, "aiterator"):
+        async for row in queryset.aiterator(chunk_size=chunk_size):
+            yield row
+        return
+    # the cursor lives in the sync thread, every chunk is fetched there
+    rows = queryset.iterator(chunk_size=chunk_size)
+    fetch = sync_to_async(lambda: list(itertools.islice(rows, chunk_size)))
+    while True:
+        chunk = await fetch()
+        if not chunk:
+            return
+        for row in chunk:
+            yield row
+
+
+def json_response(data, status=200):
+    return JsonResponse(data, status=status, safe=False, encoder=DjangoJSONEncoder,
+                        json_dumps_params={"separators": (",", ":")})
+
+
+async def authenticate(request):
+    '''
+    Sets request.user from the JWT of the request (like the viewsets,
+    see authentication.py), returns an error
+    response if there is none or it is invalid.
+    '''
+    try:
+        result = await sync_to_async(CachedJSONWebTokenAuthentication().authenticate)(request)
+    except AuthenticationFailed as e:
+        return json_response({"detail": str(e.detail)}, status=401)
+    if result is None:
+        return json_response({"detail": "Authentication credentials were not provided."}, status=401)
+    request.user = result[0]
+    return None
+
+
+class AsyncListRetrieveView:
+    '''
+    Base of the async read endpoints: subclasses implement list and/or
+    retrieve as coroutines returning responses, authentication is
+    checked first. A missing one is answered with a 405.
+    '''
+
+    @classmethod
+    def as_view(cls, detail=False):
+        action = "retrieve" if detail else "list"
+
+        async def view(request, *args, **kwargs):
+            if request.method not in ("GET", "HEAD") or not hasattr(cls, action):
+                return json_response({"detail": "Method \"%s\" not allowed." % request.method}, status=405)
+            error = await authenticate(request)
+            if error is not None:
+                return error
+            instance = cls()
+            # like DRF's ViewSet.action, e.g. for query_error
+            instance.action = action
+            handler = getattr(instance, action)
+            return await (handler(request, **kwargs) if detail else handler(request))
+        # e.g. "AsyncGenreView.list" in the request metrics (instrumentation.py)
+        view.__qualname__ = "%s.%s" % (cls.__name__, action)
+        return view
+
+
+class AsyncGenreView(AsyncListRetrieveView):
+
+    ordering_fields = ("pk", "id", "name", "-pk", "-id", "-name")
+
+    def query_error(self, request):
+        order_by = request.GET.get("order_by")
+        if self.action == "list" and order_by is not None and order_by not in self.ordering_fields:
+            return json_response({"error": "Invalid order_by."}, status=400)
+        return None
+
+    @aconditional(models.Genre)
+    async def list(self, request):
+        error = self.query_error(request)
+        if error is not None:
+            return error
+        order_by = request.GET.get("order_by")
+        name = request.GET.get("name")
+        queryset = models.Genre.objects.all() if name is None else models.Genre.objects.named(name)
+        if order_by is not None:
+            queryset = queryset.order_by(order_by)
+
+        async def load():
+            return [row async for row in aiterator(queryset.values_list("pk", "name"))]
+
+        return json_response(await cache.aget_or_compute(cache.genre_list_key(name, order_by), load))
+
+    @aconditional(models.Genre)
+    async def retrieve(self, request, pk):
+        async def load():
+            genre = await aget(models.Genre.objects.all(), pk=pk)
+            return {"name": genre.name, "pk": genre.pk}
+        try:
+            return json_response(await cache.aget_or_compute(cache.genre_detail_key(int(pk)), load))
+        except (models.Genre.DoesNotExist, ValueError):
+            return HttpResponse(status=404)
@@ -0,0 +1,133 @@
+'''
+JWT authentication with an in-process cache of verified tokens.
+
+JSONWebTokenAuthentication verifies the signature and loads the user
+from the database on every request. CachedJSONWebTokenAuthentication
+keeps token -> user in a bounded LRU (YAMOD_JWT_CACHE_SIZE entries,
+default 10000), so a token seen before costs one dict lookup. An entry
+expires with its token, but after YAMOD_JWT_CACHE_TTL seconds (default
+60) at the latest, and is dropped as soon as the user is saved or
+deleted in this process (signals.py) - a deactivated user or a changed
+is_superuser flag takes effect with the next request. Changes made by
+other processes or by queryset updates take effect after the TTL.
+
+The cache keeps the primary key, the username and the flags of the
+user, every request gets a user instance of its own built from them
+(the other fields are loaded on access).
+'''
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
+from django.conf import settings
+from rest_framework import exceptions
+from rest_framework_jwt.authentication import JSONWebTokenAuthentication, jwt_decode_handler
+
+
+def cached_fields(model):
+    # in the order of the model's fields, as from_db expects them
+    wanted = {model._meta.pk.attname, model.USERNAME_FIELD, "is_active", "is_staff", "is_superuser"}
+    return [field.attname for field in model._meta.concrete_fields if field.attname in wanted]
+
+
+class CachedUser:
+    '''
+    What the cache keeps of a user, instead of the instance shared by
+    all requests.
+    '''
+
+    def __init__(self, user):
+        self.model = type(user)
+        self.db = user._state.db
+        self.pk = user.pk
+        self.values = [getattr(user, name) for name in cached_fields(self.model)]
+
+    def user(self):
+        return self.model.from_db(self.db, cached_fields(self.model), self.values)
+
+
+class TokenCache:
+    '''
+    Thread safe LRU of verified tokens: token -> (expires, CachedUser),
+    get returns a new user instance.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._user_tokens = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, token):
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            expires, cached = entry
+            if time.time() >= expires:
+                self._remove(token)
+                return None
+            self._entries.move_to_end(token)
+        return cached.user()
+
+    def set(self, token, user, expires):
+        maxsize = getattr(settings, "YAMOD_JWT_CACHE_SIZE", 10000)
+        with self._lock:
+            if token in self._entries:
+                self._remove(token)
+            self._entries[token] = (expires, CachedUser(user))
+            self._user_tokens.setdefault(user.pk, set()).add(token)
+            while len(self._entries) > maxsize:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, token):
+        expires, user = self._entries.pop(token)
+        tokens = self._user_tokens.get(user.pk)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._user_tokens[user.pk]
+
+    def invalidate_user(self, pk):
+        with self._lock:
+            for token in list(self._user_tokens.get(pk, ())):
+                self._remove(token)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._user_tokens.clear()
+
+
+tokens = TokenCache()
+
+
+class CachedJSONWebTokenAuthentication(JSONWebTokenAuthentication):
+
+    def authenticate(self, request):
+        jwt_value = self.get_jwt_value(request)
+        if jwt_value is None:
+            return None
+        user = tokens.get(jwt_value)
+        if user is None:
+            payload = self.decode(jwt_value)
+            user = self.authenticate_credentials(payload)
+            expires = time.time() + getattr(settings, "YAMOD_JWT_CACHE_TTL", 60)
+            if "exp" in payload:
+                expires = min(expires, payload["exp"])
+            tokens.set(jwt_value, user, expires)
+        return (user, jwt_value)
+
+    def decode(self, jwt_value):
+        # same errors as JSONWebTokenAuthentication.authenticate
+        try:
+            return jwt_decode_handler(jwt_value)
+        except jwt.ExpiredSignature:
+            raise exceptions.AuthenticationFailed("Signature has expired.")
+        except jwt.DecodeError:
+            raise exceptions.AuthenticationFailed("Error decoding signature.")
+        except jwt.InvalidTokenError:
+            raise exceptions.AuthenticationFailed()
@@ -0,0 +1,234 @@
+'''
+In-memory prefix index for type-ahead over movie titles, TV show
+names and credited names (see views.AutocompleteViewSet).
+
+Every kind has its own index of three parallel sequences sorted by the
+casefolded title: the keys, the primary keys (an array of 64 bit
+integers, not int objects) and the titles as entered, about 164 MiB per
+1M entries of the 'autocomplete' benchmark, 218 MiB while loading.
+A query is one binary search per kind plus a merge of at most limit
+entries each, so it never touches the database. Servers load the index
+at startup (Autocomplete.warm, called by movie_site/wsgi.py and asgi.py),
+other processes on their first query, and it is kept current by the
+model signals in signals.py (after commit).
+Signals only reach the index of the process that wrote, so every index
+is also reloaded after YAMOD_AUTOCOMPLETE_MAX_AGE seconds (default 300),
+which also picks up writes that bypass signals (bulk_create, update()).
+The reload runs on a background thread (see Autocomplete).
+'''
+import bisect
+import heapq
+import itertools
+import threading
+import time
+from array import array
+
+from django.conf import settings
+from django.db import connections
+
+from . import models
+
+# kind: (model, field)
+SOURCES = {
+    "movie": (models.Movie, "movie_title"),
+    "tvshow": (models.TVShow, "name"),
+    "person": (models.Person, "credited_name"),
+}
+MODEL_KINDS = {model: kind for kind, (model, field) in SOURCES.items()}
+
+
+def normalize(title):
+    return title.casefold()
+
+
+class PrefixIndex:
+    '''
+    Sorted titles of one kind: parallel sequences of casefolded keys,
+    primary keys and titles as entered.
+    '''
+
+    def __init__(self, model, field):
+        self.model = model
+        self.field = field
+        self.keys = None
+        self.pks = None
+        self.titles = None
+
+    def load(self):
+        pks, titles = array("q"), []
+        for pk, title in self.model.objects.order_by("pk").values_list(
+                "pk", self.field).iterator(chunk_size=10000):
+            pks.append(pk)
+            titles.append(title)
+        keys = [normalize(title) for title in titles]
+        # sorted positions instead of a (key, pk, title) tuple per entry,
+        # equal keys stay in pk order
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        self.keys = [keys[position] for position in order]
+        del keys
+        self.pks = array("q", (pks[position] for position in order))
+        self.titles = [titles[position] for position in order]
+
+    def add(self, pk, title):
+        key = normalize(title)
+        position = bisect.bisect_right(self.keys, key)
+        self.keys.insert(position, key)
+        self.pks.insert(position, pk)
+        self.titles.insert(position, title)
+
+    def remove(self, pk, title):
+        key = normalize(title)
+        position = bisect.bisect_left(self.keys, key)
+        while position < len(self.keys) and self.keys[position] == key:
+            if self.pks[position] == pk:
+                del self.keys[position], self.pks[position], self.titles[position]
+                return
+            position += 1
+
+    def complete(self, prefix, limit):
+        start = end = bisect.bisect_left(self.keys, prefix)
+        stop = min(start + limit, len(self.keys))
+        while end < stop and self.keys[end].startswith(prefix):
+            end += 1
+        return zip(self.keys[start:end], self.pks[start:end], self.titles[start:end])
+
+
+class Autocomplete:
+    '''
+    The prefix indexes of all kinds, loaded by warm() or on first use,
+    never while holding the lock: queries arriving during the load wait
+    for it. An index older than YAMOD_AUTOCOMPLETE_MAX_AGE is reloaded
+    on a background thread and swapped in when complete, queries are
+    answered from the old one meanwhile. Changes made during a load are
+    replayed on the new index before the swap.
+    '''
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # notified when a load ends
+        self._swapped = threading.Condition(self._lock)
+        self._indexes = None
+        self._loaded_at = None
+        # changes during a load, None without one
+        self._changes = None
+        # a reload started before the last reset is dropped
+        self._generation = 0
+
+    def reset(self):
+        with self._lock:
+            self._indexes = None
+            self._changes = None
+            self._generation += 1
+            self._swapped.notify_all()
+
+    @property
+    def is_loaded(self):
+        return self._indexes is not None
+
+    def _load(self):
+        indexes = {kind: PrefixIndex(model, field) for kind, (model, field) in SOURCES.items()}
+        for prefix_index in indexes.values():
+            prefix_index.load()
+        return indexes
+
+    def warm(self):
+        '''
+        Starts loading the indexes on a background thread, the first
+        queries wait for it instead of loading them themselves.
+        '''
+        with self._lock:
+            if self._indexes is None and self._changes is None:
+                self._changes = []
+                self._start_reload(self._generation)
+
+    def _loaded(self):
+        max_age = getattr(settings, "YAMOD_AUTOCOMPLETE_MAX_AGE", 300)
+        loaded = False
+        while True:
+            with self._lock:
+                while self._indexes is None and self._changes is not None:
+                    # loading on another thread
+                    self._swapped.wait()
+                if self._indexes is not None:
+                    if not loaded and self._changes is None and time.monotonic() - self._loaded_at > max_age:
+                        self._changes = []
+                        self._start_reload(self._generation)
+                    return self._indexes
+                # nothing to answer from before: loaded here, outside the lock
+                self._changes = []
+                generation = self._generation
+            self._reload(generation)
+            loaded = True
+
+    def _start_reload(self, generation):
+        def run():
+            try:
+                self._reload(generation)
+            finally:
+                # the connections of this thread
+                connections.close_all()
+        threading.Thread(target=run, daemon=True).start()
+
+    def _reload(self, generation):
+        try:
+            indexes = self._load()
+        except Exception:
+            # the next query after max age tries again
+            with self._lock:
+                if generation == self._generation:
+                    self._changes = None
+                    self._swapped.notify_all()
+            raise
+        with self._lock:
+            if generation != self._generation:
+                return
+            # a change may or may not be in the loaded rows already
+            for kind, pk, title, added in self._changes:
+                indexes[kind].remove(pk, title)
+                if added:
+                    indexes[kind].add(pk, title)
+            self._indexes = indexes
+            self._loaded_at = time.monotonic()
+            self._changes = None
+            self._swapped.notify_all()
+
+    def __len__(self):
+        indexes = self._loaded()
+        with self._lock:
+            return sum(len(prefix_index.keys) for prefix_index in indexes.values())
+
+    def add(self, kind, pk, title):
+        with self._lock:
+            # not loaded yet: the load reads the current data
+            if self._indexes is not None:
+                self._indexes[kind].add(pk, title)
+            if self._changes is not None:
+                self._changes.append((kind, pk, title, True))
+
+    def remove(self, kind, pk, title):
+        with self._lock:
+            if self._indexes is not None:
+                self._indexes[kind].remove(pk, title)
+            if self._changes is not None:
+                self._changes.append((kind, pk, title, False))
+
+    def complete(self, prefix, kinds=None, limit=10):
+        '''
+        Returns up to limit entries starting with prefix (case
+        insensitive) in alphabetical order.
+        '''
+        prefix = normalize(prefix)
+        indexes = self._loaded()
+        with self._lock:
+            # lists: a generator would read kind after the loop ended
+            matches = heapq.merge(*(
+                [(key, kind, pk, title) for key, pk, title in indexes[kind].complete(prefix, limit)]
+                for kind in (kinds or SOURCES)
+            ))
+            return [
+                {"kind": kind, "id": pk, "title": title}
+                for key, kind, pk, title in itertools.islice(matches, limit)
+            ]
+
+
+index = Autocomplete()
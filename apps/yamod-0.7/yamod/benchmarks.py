@@ -0,0 +1,857 @@
+'''
+Performance benchmarks for yamod. Run them with
+
+    python manage.py benchmark pagination --rows 1000000
+
+The benchmarks create their data in a throw-away test database
+(see management/commands/benchmark.py), they never touch the
+configured database.
+
+The suite (api, login, orm, admin) measures the hot paths on a
+deterministic catalogue (create_catalogue) at the SCALES, and can
+be compared between commits:
+
+    python manage.py benchmark --suite --scale 100k --json base.json
+    python manage.py benchmark --suite --scale 100k --compare base.json
+'''
+import datetime
+import os
+import random
+import re
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import (
+    Case, CharField, Count, ExpressionWrapper, F, IntegerField, Max, Q, Value, When,
+)
+from django.db.models.functions import ExtractYear
+from django.test import Client
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+
+from . import cache
+from . import catalogue
+from . import facets
+from . import models
+from . import autocomplete
+from . import search
+from . import seeding
+from .pagination import KeysetPaginator, encode_cursor
+
+BENCHMARKS = {}
+# the benchmarks run by --suite, on create_catalogue's data
+SUITE = ("api", "login", "orm", "admin")
+SCALES = {"10k": 10000, "100k": 100000, "1m": 1000000}
+
+
+def benchmark(name):
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+    return decorator
+
+
+def timeit(func, repeat=5):
+    '''
+    Returns the median run time of func in seconds.
+    '''
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def peak_memory(func):
+    '''
+    Returns the peak memory in KiB allocated while running func.
+    '''
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] // 1024
+    finally:
+        tracemalloc.stop()
+
+
+def api_client(is_superuser=False):
+    # Benchmarks measure the endpoints, not the JWT handshake
+    user, created = get_user_model().objects.get_or_create(
+        username="benchmark_user",
+        is_active=True,
+        is_superuser=is_superuser
+    )
+    client = APIClient()
+    client.force_authenticate(user=user)
+    return client
+
+
+def jwt_client(is_superuser=False):
+    # Authenticates every request with a JWT, like real API clients do
+    from rest_framework_jwt.settings import api_settings
+    user, created = get_user_model().objects.get_or_create(
+        username="benchmark_user",
+        is_active=True,
+        is_superuser=is_superuser
+    )
+    token = api_settings.JWT_ENCODE_HANDLER(api_settings.JWT_PAYLOAD_HANDLER(user))
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION="JWT %s" % token)
+    return client
+
+
+def create_genres(rows, seed=0, batch_size=10000):
+    # names are not in pk order, so ordering by name is a real sort
+    # (names are unique, see models.Genre.name_key: benchmarks of one
+    # run create the same names, they exist only once)
+    rng = random.Random(seed)
+    words = ["Action", "Horror", "Scifi", "Drama", "Comedy", "Noir", "Western", "Musical"]
+    numbers = list(range(rows))
+    rng.shuffle(numbers)
+    for start in range(0, rows, batch_size):
+        names = ["%s %08d" % (rng.choice(words), number) for number in numbers[start:start + batch_size]]
+        models.Genre.objects.bulk_create(
+            (models.Genre(name=name, name_key=models.Genre.normalize(name)) for name in names),
+            ignore_conflicts=True
+        )
+
+
+WORDS = [
+    "blade", "runner", "night", "city", "dream", "river", "king", "ghost", "summer",
+    "winter", "lost", "return", "secret", "house", "last", "journey", "star", "shadow",
+    "dispatch", "land", "french", "story", "love", "war", "empire", "golden", "silent",
+]
+GENRES = ["Action", "Horror", "Scifi", "Drama", "Comedy", "Noir", "Western", "Musical"]
+ROLE_TYPES = ("Actor", "Director", "Producer")
+
+
+def create_movies(rows, seed=0, title_length=None, batch_size=10000):
+    '''
+    Creates movies with random three word titles, padded to
+    title_length characters if given.
+    '''
+    rng = random.Random(seed)
+    for start in range(0, rows, batch_size):
+        movies = []
+        for i in range(start, min(start + batch_size, rows)):
+            title = " ".join(rng.choice(WORDS) for _ in range(3)).title() + " %d" % i
+            if title_length:
+                title = title.ljust(title_length, ".")
+            movies.append(models.Movie(
+                movie_title=title, original_title=title,
+                released=datetime.date(1950, 1, 1) + datetime.timedelta(days=rng.randrange(27000)),
+                runtime=rng.randrange(60, 200),
+            ))
+        models.Movie.objects.bulk_create(movies)
+
+
+def create_catalogue(rows, seed=0, batch_size=10000):
+    '''
+    Creates the same catalogue for the same rows and seed: rows genres
+    (see create_genres), rows people, rows movies with 1-3 of the
+    GENRES and three roles each, and a TV show per 100 movies with 1-4
+    seasons (cast of 5) of up to 10 episodes. Returns the number of
+    objects per model.
+    '''
+    rng = random.Random(seed)
+    create_genres(rows, seed)
+    genre_ids = [models.Genre.objects.get_or_create_named(name)[0].pk for name in GENRES]
+    role_type_ids = [models.RoleType.objects.get_or_create(name=name)[0].pk for name in ROLE_TYPES]
+    # explicit primary keys: the roles and seasons reference them
+    first_person = (models.Person.objects.aggregate(pk=Max("pk"))["pk"] or 0) + 1
+    first_movie = (models.Movie.objects.aggregate(pk=Max("pk"))["pk"] or 0) + 1
+    first_season = (models.Season.objects.aggregate(pk=Max("pk"))["pk"] or 0) + 1
+    person_ids = range(first_person, first_person + rows)
+    MovieGenre = models.Movie.genre.through
+    SeasonCast = models.Season.cast.through
+    counts = dict.fromkeys(("person", "movie", "role", "tvshow", "season", "episode"), 0)
+    for start in range(0, rows, batch_size):
+        with transaction.atomic():
+            models.Person.objects.bulk_create(
+                models.Person(
+                    pk=first_person + i,
+                    credited_name="%s %s %d" % (rng.choice(WORDS).title(), rng.choice(WORDS).title(), i),
+                    year_of_birth=rng.randrange(1900, 2010),
+                    year_of_death=rng.choice((None, None, None, rng.randrange(1950, 2024))),
+                    gender=rng.choice("mfx"),
+                )
+                for i in range(start, min(start + batch_size, rows))
+            )
+    for start in range(0, rows, batch_size):
+        movies, links, roles = [], [], []
+        for i in range(start, min(start + batch_size, rows)):
+            pk = first_movie + i
+            title = " ".join(rng.choice(WORDS) for _ in range(3)).title() + " %d" % i
+            movies.append(models.Movie(
+                pk=pk, movie_title=title, original_title=title,
+                released=datetime.date(1950, 1, 1) + datetime.timedelta(days=rng.randrange(27000)),
+                runtime=rng.randrange(60, 200),
+            ))
+            links.extend(MovieGenre(movie_id=pk, genre_id=genre_id)
+                         for genre_id in rng.sample(genre_ids, rng.randrange(1, 4)))
+            roles.extend(models.Role(movie_id=pk, person_id=person_id, role_id=role_type_id)
+                         for person_id, role_type_id in zip(rng.sample(person_ids, 3), role_type_ids))
+        with transaction.atomic():
+            models.Movie.objects.bulk_create(movies)
+            MovieGenre.objects.bulk_create(links)
+            models.Role.objects.bulk_create(roles)
+        counts["movie"] += len(movies)
+        counts["role"] += len(roles)
+    counts["person"] = rows
+    shows, seasons, cast, episodes = [], [], [], []
+    for i in range(max(rows // 100, 1)):
+        name = " ".join(rng.choice(WORDS) for _ in range(2)).title() + " %d" % i
+        shows.append(models.TVShow(name=name, original_title=name, released_year=rng.randrange(1950, 2024),
+                                   created_by_id=rng.choice(person_ids)))
+    with transaction.atomic():
+        models.TVShow.objects.bulk_create(shows)
+        show_ids = models.TVShow.objects.order_by("-pk").values_list("pk", flat=True)[:len(shows)]
+        season_pk = first_season
+        for show_id in sorted(show_ids):
+            for season_no in range(1, rng.randrange(2, 6)):
+                seasons.append(models.Season(pk=season_pk, season_no=season_no, tv_show_id=show_id))
+                cast.extend(SeasonCast(season_id=season_pk, person_id=person_id)
+                            for person_id in rng.sample(person_ids, min(5, rows)))
+                episodes.extend(models.Episode(name="Episode %d" % number, season_id=season_pk)
+                                for number in range(1, rng.randrange(2, 12)))
+                season_pk += 1
+        models.Season.objects.bulk_create(seasons, batch_size=batch_size)
+        SeasonCast.objects.bulk_create(cast, batch_size=batch_size)
+        models.Episode.objects.bulk_create(episodes, batch_size=batch_size)
+    counts.update(tvshow=len(shows), season=len(seasons), episode=len(episodes))
+    return counts
+
+
+_catalogues = {}
+
+
+def suite_catalogue(rows, seed=0):
+    # the suite benchmarks of one run share the catalogue
+    if (rows, seed) not in _catalogues:
+        _catalogues[(rows, seed)] = create_catalogue(rows, seed)
+    return _catalogues[(rows, seed)]
+
+
+def staff_user():
+    user, created = get_user_model().objects.get_or_create(
+        username="benchmark_admin",
+        defaults={"is_active": True, "is_staff": True, "is_superuser": True},
+    )
+    if created:
+        user.set_password("benchmark_admin")
+        user.save()
+    return user
+
+
+def server_queries(response):
+    # the queries of the request, from the Server-Timing header (instrumentation.py)
+    match = re.search(r'desc="(\d+) queries"', response.get("Server-Timing", ""))
+    return int(match.group(1)) if match else None
+
+
+@benchmark("pagination")
+def pagination(report, rows=1000000, repeat=5, page_size=100, **options):
+    '''
+    Latency of GET /genres/?order_by=name at increasing page depth,
+    keyset cursor compared to the equivalent OFFSET query.
+    '''
+    create_genres(rows)
+    client = api_client()
+    ordered = models.Genre.objects.order_by("name", "pk")
+    for page in (1, 10, 100, 1000, 10000):
+        offset = (page - 1) * page_size
+        if offset >= rows:
+            break
+        url = "/genres/?order_by=name&page_size=%d" % page_size
+        cursor = None
+        if offset:
+            name, pk = ordered.values_list("name", "pk")[offset - 1]
+            cursor = encode_cursor("name", name, pk)
+            url += "&cursor=" + cursor
+        paginator = KeysetPaginator(models.Genre.objects.all(), "name", page_size)
+        report(
+            "pagination", page=page,
+            api=timeit(lambda: client.get(url), repeat),
+            keyset_query=timeit(lambda: paginator.page(cursor), repeat),
+            offset_query=timeit(lambda: list(ordered[offset:offset + page_size]), repeat),
+        )
+
+
+@benchmark("streaming")
+def streaming(report, rows=1000000, repeat=5, **options):
+    '''
+    Peak memory and run time of a full GET /genres/ compared to
+    the streamed ?stream=1 and NDJSON variants.
+    '''
+    create_genres(rows)
+    client = api_client()
+
+    def consume(url, **headers):
+        response = client.get(url, **headers)
+        for chunk in (response.streaming_content if response.streaming else [response.content]):
+            pass
+
+    for name, url, headers in (
+        ("list", "/genres/", {}),
+        ("stream_json", "/genres/?stream=1", {}),
+        ("stream_ndjson", "/genres/", {"HTTP_ACCEPT": "application/x-ndjson"}),
+    ):
+        report(
+            "streaming", mode=name,
+            time=timeit(lambda: consume(url, **headers), repeat),
+            peak_kb=peak_memory(lambda: consume(url, **headers)),
+        )
+
+
+@benchmark("bulk")
+def bulk(report, items=10000, **options):
+    '''
+    Creating genres with one POST /genres/ per genre compared
+    to a single POST /genres/bulk/.
+    '''
+    client = jwt_client()
+    names = ["Genre %d" % i for i in range(items)]
+    start = time.perf_counter()
+    for name in names:
+        client.post("/genres/", {"name": name}, format="json")
+    single = time.perf_counter() - start
+    start = time.perf_counter()
+    client.post("/genres/bulk/", [{"name": "Batch " + name} for name in names], format="json")
+    batched = time.perf_counter() - start
+    report("bulk", items=items, single_posts=single, bulk_post=batched)
+
+
+@benchmark("fields")
+def fields(report, rows=100000, repeat=5, **options):
+    '''
+    GET /movies/ with full rows (1 KiB titles) compared to
+    ?fields=movie_title,released and ?fields=released.
+    '''
+    create_movies(rows, title_length=1000)
+    client = api_client()
+    for fieldset in (None, "movie_title,released", "released"):
+        url = "/movies/" + ("?fields=%s" % fieldset if fieldset else "")
+        response = client.get(url)
+        report(
+            "fields", fields=fieldset or "all", bytes=len(response.content),
+            time=timeit(lambda: client.get(url), repeat),
+        )
+
+
+@benchmark("search")
+def search_titles(report, rows=1000000, repeat=5, **options):
+    '''
+    Top 20 title matches: FTS5 prefix search compared to the
+    LIKE queries (contains/startswith) it replaces.
+    '''
+    create_movies(rows)
+    # common words (LIKE can stop after 20 rows, FTS ranks all matches),
+    # a unique title and a miss (LIKE has to scan the whole table)
+    for q in ("blade", "blade run", "dispatch sil", str(rows - 1), "zeppelin"):
+        report(
+            "search", q=q,
+            fts=timeit(lambda: search.search(q, ["movie"]), repeat),
+            contains=timeit(lambda: list(models.Movie.objects.filter(
+                movie_title__icontains=q)[:20]), repeat),
+            startswith=timeit(lambda: list(models.Movie.objects.filter(
+                movie_title__istartswith=q)[:20]), repeat),
+        )
+
+
+@benchmark("autocomplete")
+def autocomplete_titles(report, rows=1000000, repeat=5, **options):
+    '''
+    Memory of the in-memory prefix index per 1M titles, once loaded
+    and at the peak of the load, and the latency of top 10 completions,
+    compared to the startswith query.
+    '''
+    create_movies(rows)
+    index = autocomplete.Autocomplete()
+    tracemalloc.start()
+    len(index)
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    report(
+        "autocomplete", entries=len(index),
+        mib_per_1m_entries=size * 1000000 // len(index) // 2 ** 20,
+        peak_mib_per_1m_entries=peak * 1000000 // len(index) // 2 ** 20,
+    )
+    for q in ("b", "blade run", "zeppelin"):
+        report(
+            "autocomplete", q=q,
+            index=timeit(lambda: index.complete(q), repeat),
+            startswith=timeit(lambda: list(models.Movie.objects.filter(
+                movie_title__istartswith=q).order_by("movie_title")[:10]), repeat),
+        )
+
+
+@benchmark("seeding")
+def seeding_rows(report, rows=300000, **options):
+    '''
+    Seeding reference data (role types) with seeding.seed, once into
+    an empty table and once again when every row exists, compared to
+    one get_or_create per row for a tenth of the rows.
+    '''
+    names = ["Role type %d" % i for i in range(rows)]
+    seed_rows = lambda: ({"name": name} for name in names)
+    start = time.perf_counter()
+    seeding.seed(models.RoleType, seed_rows(), key=("name",))
+    first = time.perf_counter() - start
+    start = time.perf_counter()
+    seeding.seed(models.RoleType, seed_rows(), key=("name",))
+    again = time.perf_counter() - start
+    sample = names[:rows // 10]
+    models.RoleType.objects.filter(name__in=sample).delete()
+    start = time.perf_counter()
+    for name in sample:
+        models.RoleType.objects.get_or_create(name=name)
+    per_row = time.perf_counter() - start
+    report("seeding", rows=rows, seed=first, seed_again=again,
+           get_or_create_tenth=per_row)
+
+
+def write_catalogue(directory, rows, seed=0):
+    '''
+    Writes an IMDb style catalogue (TSV) of rows movies, rows people
+    and three roles per movie to directory, returns the file paths.
+    '''
+    rng = random.Random(seed)
+    genres = GENRES
+    paths = {kind: os.path.join(directory, kind + ".tsv") for kind in ("people", "movies", "roles")}
+    with open(paths["people"], "w") as file:
+        file.write("id\tcredited_name\tyear_of_birth\tyear_of_death\tgender\n")
+        for i in range(1, rows + 1):
+            file.write("nm%07d\t%s %d\t%d\t\\N\t%s\n" % (
+                i, rng.choice(WORDS).title(), i, rng.randrange(1900, 2010), rng.choice("mfx")))
+    with open(paths["movies"], "w") as file:
+        file.write("id\tmovie_title\toriginal_title\treleased\truntime\tgenres\n")
+        for i in range(1, rows + 1):
+            title = " ".join(rng.choice(WORDS) for _ in range(3)).title() + " %d" % i
+            file.write("tt%07d\t%s\t%s\t%d\t%d\t%s\n" % (
+                i, title, title, rng.randrange(1920, 2024), rng.randrange(60, 200),
+                ",".join(rng.sample(genres, rng.randrange(1, 4)))))
+    with open(paths["roles"], "w") as file:
+        file.write("movie\tperson\trole\n")
+        for i in range(1, rows + 1):
+            for person, role in zip(rng.sample(range(1, rows + 1), 3), ("Actor", "Director", "Producer")):
+                file.write("tt%07d\tnm%07d\t%s\n" % (i, person, role))
+    return paths
+
+
+@benchmark("import")
+def import_catalogue(report, rows=100000, **options):
+    '''
+    Importing a catalogue of rows movies, rows people and 3 * rows
+    roles with catalogue.CatalogueImporter, then importing it again
+    (resume: every row exists already).
+    '''
+    with tempfile.TemporaryDirectory() as directory:
+        paths = write_catalogue(directory, rows)
+        importer = catalogue.CatalogueImporter()
+
+        def run():
+            for kind in ("people", "movies", "roles"):
+                getattr(importer, "import_" + kind)(catalogue.read_rows(paths[kind]))
+
+        start = time.perf_counter()
+        memory = peak_memory(run)
+        first = time.perf_counter() - start
+        start = time.perf_counter()
+        run()
+        again = time.perf_counter() - start
+        importer.finish()
+    total = rows * 5
+    report("import", rows=total, first=first, rows_per_hour=int(total / first * 3600),
+           peak_kib=memory, again=again)
+
+
+@benchmark("export")
+def export_movies(report, rows=1000000, **options):
+    '''
+    Exporting the movie table with catalogue.export_catalogue at a
+    tenth of rows and at rows: the peak memory stays the same.
+    '''
+    created = 0
+    for size in (rows // 10, rows):
+        create_movies(size - created, seed=size)
+        created = size
+        with tempfile.TemporaryDirectory() as directory:
+            start = time.perf_counter()
+            memory = peak_memory(lambda: catalogue.export_catalogue(directory, ["movie"]))
+            elapsed = time.perf_counter() - start
+            size_kib = os.path.getsize(os.path.join(directory, "movie.jsonl")) // 1024
+        report("export", rows=size, export=elapsed, peak_kib=memory, file_kib=size_kib)
+
+
+def _concurrency_worker(path, settings_dict, role, duration, results):
+    # Runs in a forked process, like a gunicorn worker: own connection
+    # to the database file, a request loop ending like Django's handler
+    # does (close_old_connections honours CONN_MAX_AGE)
+    from django.db import OperationalError, close_old_connections, connection
+    connection.settings_dict.update(settings_dict, NAME=path)
+    connection.close()
+    client = api_client()
+    requests = errors = 0
+    latencies = []
+    stop = time.perf_counter() + duration
+    while time.perf_counter() < stop:
+        start = time.perf_counter()
+        try:
+            if role == "reader":
+                response = client.get("/genres/?page_size=20&order_by=name")
+            else:
+                response = client.post("/genres/", {"name": "Concurrent %d %d" % (os.getpid(), requests)}, format="json")
+            if response.status_code >= 500:
+                errors += 1
+        except OperationalError:
+            # "database is locked"
+            errors += 1
+        latencies.append(time.perf_counter() - start)
+        requests += 1
+        close_old_connections()
+    results.put((role, requests, errors, statistics.median(latencies)))
+
+
+@benchmark("concurrency")
+def concurrency(report, rows=10000, readers=4, writers=2, duration=5.0, **options):
+    '''
+    readers + writers processes against the genres API on a SQLite
+    file, once with plain connections (rollback journal, connection
+    per request) and once with the configured OPTIONS/CONN_MAX_AGE of
+    the default database (see movie_site/db/base.py).
+    '''
+    import multiprocessing
+    import sqlite3
+
+    from django.conf import settings
+    from django.db import connection
+
+    create_genres(rows)
+    api_client()
+    configured = settings.DATABASES["default"]
+    profiles = {
+        "plain": {"OPTIONS": {}, "CONN_MAX_AGE": 0},
+        "configured": {"OPTIONS": configured.get("OPTIONS", {}), "CONN_MAX_AGE": configured.get("CONN_MAX_AGE", 0)},
+    }
+    context = multiprocessing.get_context("fork")
+    connection.ensure_connection()
+    for profile, settings_dict in profiles.items():
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "db.sqlite3")
+            target = sqlite3.connect(path)
+            connection.connection.backup(target)
+            target.close()
+            results = context.Queue()
+            processes = [
+                context.Process(target=_concurrency_worker, args=(path, settings_dict, role, duration, results))
+                for role in ["reader"] * readers + ["writer"] * writers
+            ]
+            for process in processes:
+                process.start()
+            totals = {"reader": [0, 0, []], "writer": [0, 0, []]}
+            for _ in processes:
+                role, requests, errors, latency = results.get()
+                totals[role][0] += requests
+                totals[role][1] += errors
+                totals[role][2].append(latency)
+            for process in processes:
+                process.join()
+        report("concurrency", profile=profile,
+               reads_per_s=int(totals["reader"][0] / duration),
+               writes_per_s=int(totals["writer"][0] / duration),
+               errors=totals["reader"][1] + totals["writer"][1],
+               read_median=statistics.median(totals["reader"][2]),
+               write_median=statistics.median(totals["writer"][2]))
+
+
+def _latency_report(latencies, elapsed):
+    latencies = sorted(latencies)
+    return {
+        "requests_per_s": int(len(latencies) / elapsed),
+        "p50": statistics.median(latencies),
+        "p99": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+    }
+
+
+@benchmark("asgi")
+def asgi(report, rows=10000, requests=2000, clients=50, threads=8, **options):
+    '''
+    Load test of GET /genres/<pk>/ (random pks, so a mix of cache hits
+    and misses) with clients concurrent clients: through the WSGI
+    handler with a pool of threads (like gunicorn --threads), through
+    the ASGI handler (one event loop) with the sync viewset, and
+    through the ASGI handler with the async view (async_views.py).
+
+    The handlers run in process (django.test.Client/AsyncClient), so
+    this compares the request handling, not a network with slow clients.
+    '''
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+
+    from django.test import AsyncClient, Client
+    from rest_framework_jwt.settings import api_settings
+
+    create_genres(rows)
+    user, created = get_user_model().objects.get_or_create(username="benchmark_user", is_active=True)
+    token = "JWT %s" % api_settings.JWT_ENCODE_HANDLER(api_settings.JWT_PAYLOAD_HANDLER(user))
+    rng = random.Random(0)
+    pks = list(models.Genre.objects.values_list("pk", flat=True))
+    paths = ["genres/%d/" % rng.choice(pks) for _ in range(requests)]
+
+    def wsgi_get(path, client=Client()):
+        start = time.perf_counter()
+        client.get("/" + path, HTTP_AUTHORIZATION=token)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        latencies = list(pool.map(wsgi_get, paths))
+    report("asgi", server="wsgi", threads=threads, **_latency_report(latencies, time.perf_counter() - start))
+
+    async def run(prefix):
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(clients)
+
+        async def get(path):
+            async with semaphore:
+                start = time.perf_counter()
+                await client.get(prefix + path, AUTHORIZATION=token)
+                return time.perf_counter() - start
+
+        return await asyncio.gather(*(get(path) for path in paths))
+
+    for view, prefix in (("sync", "/"), ("async", "/async/")):
+        start = time.perf_counter()
+        latencies = asyncio.run(run(prefix))
+        report("asgi", server="asgi", view=view, clients=clients,
+               **_latency_report(latencies, time.perf_counter() - start))
+
+
+@benchmark("auth")
+def auth(report, rows=10000, repeat=5, **options):
+    '''
+    Authentication cost per request: rows authenticate() calls with
+    the same JWT through JSONWebTokenAuthentication (verify + user
+    query every time) and CachedJSONWebTokenAuthentication.
+    '''
+    from django.db import connection
+    from django.test import RequestFactory
+    from django.test.utils import CaptureQueriesContext
+    from rest_framework_jwt.authentication import JSONWebTokenAuthentication
+    from rest_framework_jwt.settings import api_settings
+
+    from .authentication import CachedJSONWebTokenAuthentication, tokens
+
+    user, created = get_user_model().objects.get_or_create(username="benchmark_user", is_active=True)
+    token = api_settings.JWT_ENCODE_HANDLER(api_settings.JWT_PAYLOAD_HANDLER(user))
+    request = RequestFactory().get("/genres/", HTTP_AUTHORIZATION="JWT %s" % token)
+    for name, authentication in (("jwt", JSONWebTokenAuthentication()),
+                                 ("cached_jwt", CachedJSONWebTokenAuthentication())):
+        tokens.clear()
+
+        def run():
+            for _ in range(rows):
+                authentication.authenticate(request)
+
+        authentication.authenticate(request)
+        with CaptureQueriesContext(connection) as queries:
+            authentication.authenticate(request)
+        elapsed = timeit(run, repeat)
+        report("auth", authentication=name, requests=rows, per_request="%.1fus" % (elapsed / rows * 1e6),
+               queries_per_request=len(queries))
+
+
+@benchmark("api")
+def api(report, rows=10000, repeat=5, **options):
+    '''
+    The GenreViewSet endpoints with JWT authentication (cached, see
+    authentication.py), reads with an empty ("miss") and a warm
+    ("hit") response cache.
+    '''
+    from rest_framework_jwt.settings import api_settings
+
+    suite_catalogue(rows)
+    user = staff_user()
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION="JWT %s" % api_settings.JWT_ENCODE_HANDLER(
+        api_settings.JWT_PAYLOAD_HANDLER(user)))
+    pk = models.Genre.objects.named("Drama").values_list("pk", flat=True).get()
+    for path in ("/genres/?order_by=name&page_size=100", "/genres/?name=Drama", "/genres/%d/" % pk):
+        response = client.get(path)
+        queries = server_queries(client.get(path))
+        report("api", endpoint="GET " + path.replace(str(pk), "<pk>"), cache="hit", queries=queries,
+               bytes=len(response.content), time=timeit(lambda: client.get(path), repeat))
+
+        def miss():
+            cache.get_cache().clear()
+            return client.get(path)
+
+        report("api", endpoint="GET " + path.replace(str(pk), "<pk>"), cache="miss",
+               queries=server_queries(miss()), bytes=len(response.content), time=timeit(miss, repeat))
+
+    names = ("Benchmark genre %d" % i for i in range(10 ** 9))
+    response = client.post("/genres/", {"name": next(names)}, format="json")
+    report("api", endpoint="POST /genres/", queries=server_queries(response),
+           time=timeit(lambda: client.post("/genres/", {"name": next(names)}, format="json"), repeat))
+    path = "/genres/%d/" % response.json()["id"]
+    response = client.put(path, {"name": next(names)}, format="json")
+    report("api", endpoint="PUT /genres/<pk>/", queries=server_queries(response),
+           time=timeit(lambda: client.put(path, {"name": next(names)}, format="json"), repeat))
+    created = [models.Genre.objects.create(name=next(names)).pk for _ in range(repeat + 1)]
+    pks = iter(created)
+    response = client.delete("/genres/%d/" % next(pks))
+    report("api", endpoint="DELETE /genres/<pk>/", queries=server_queries(response),
+           time=timeit(lambda: client.delete("/genres/%d/" % next(pks)), repeat))
+
+
+@benchmark("login")
+def login(report, rows=10000, repeat=5, **options):
+    '''
+    POST /api-token-auth/: dominated by the password hasher
+    (PASSWORD_HASHERS), one query for the user.
+    '''
+    staff_user()
+    client = Client()
+    credentials = {"username": "benchmark_admin", "password": "benchmark_admin"}
+    response = client.post("/api-token-auth/", credentials)
+    report("login", endpoint="POST /api-token-auth/", status=response.status_code,
+           queries=server_queries(response),
+           time=timeit(lambda: client.post("/api-token-auth/", credentials), repeat))
+
+
+# the queries of YamodModelTest and ExtendedQueryTests
+FILTERS = {
+    "released__year__gte": lambda: models.Movie.objects.filter(released__year__gte=2000),
+    "runtime__lte": lambda: models.Movie.objects.filter(runtime__lte=100),
+    "movie_title__startswith": lambda: models.Movie.objects.filter(movie_title__startswith="B"),
+    "movie_title__contains": lambda: models.Movie.objects.filter(movie_title__contains="Blade"),
+    "startswith_and_year": lambda: models.Movie.objects.filter(
+        movie_title__startswith="B", released__year__gt=1980),
+    "year_or_genre": lambda: models.Movie.objects.filter(
+        Q(released__year__gt=2020) | Q(genre__name="Comedy")),
+    "genre__name__endswith": lambda: models.Movie.objects.filter(genre__name__endswith="y"),
+    "participates_in": lambda: models.Movie.objects.filter(
+        role__person__credited_name__startswith="Blade"),
+}
+
+
+@benchmark("orm")
+def orm(report, rows=10000, repeat=5, **options):
+    '''
+    The filters of the model tests on the catalogue: count() and the
+    first 100 rows.
+    '''
+    suite_catalogue(rows)
+    for name, queryset in FILTERS.items():
+        report("orm", filter=name, rows=queryset().count(),
+               count=timeit(lambda: queryset().count(), repeat),
+               first_100=timeit(lambda: list(queryset()[:100]), repeat))
+
+
+@benchmark("admin")
+def admin_changelists(report, rows=10000, repeat=5, **options):
+    '''
+    The admin change lists of movies, genres and people: first and
+    a deep page, the searches and the gender filter, with and without
+    the performance mode (see admin.py).
+    '''
+    suite_catalogue(rows)
+    client = Client()
+    client.force_login(staff_user())
+    for path in (
+        "/admin/yamod/movie/",
+        "/admin/yamod/movie/?p=%d" % (rows // 200),
+        "/admin/yamod/movie/?q=blade",
+        "/admin/yamod/genre/",
+        "/admin/yamod/genre/?q=drama",
+        "/admin/yamod/person/",
+        "/admin/yamod/person/?q=blade",
+        "/admin/yamod/person/?gender__exact=f",
+    ):
+        for mode in (False, True):
+            with override_settings(YAMOD_ADMIN_PERFORMANCE_MODE=mode):
+                response = client.get(path)
+                report("admin", url=path, mode="performance" if mode else "default",
+                       status=response.status_code, queries=server_queries(response),
+                       time=timeit(lambda: client.get(path), repeat))
+
+
+def sidebar_facets():
+    # the browse sidebar before /facets/: a grouped query per facet
+    decade = ExpressionWrapper(F("year") / 10 * 10, output_field=IntegerField())
+    runtime = Case(*(When(facets.runtime_q(*bucket), then=Value(label))
+                     for label, bucket in facets.RUNTIME_BUCKETS.items()), output_field=CharField())
+    return [
+        list(models.Movie.genre.through.objects.values("genre").annotate(count=Count("pk"))),
+        list(models.Movie.objects.annotate(year=ExtractYear("released")).values(
+            decade=decade).annotate(count=Count("pk"))),
+        list(models.Movie.objects.values(bucket=runtime).annotate(count=Count("pk"))),
+        list(models.Person.objects.values("gender").annotate(count=Count("pk"))),
+        list(models.Person.objects.annotate(year=F("year_of_birth")).values(
+            decade=decade).annotate(count=Count("pk"))),
+    ]
+
+
+@benchmark("facets")
+def facet_counts(report, rows=1000000, repeat=5, **options):
+    '''
+    GET /facets/ on the catalogue, unfiltered and filtered, with an
+    empty ("miss") and a warm ("hit") cache, compared to a grouped
+    query per facet.
+    '''
+    suite_catalogue(rows)
+    client = api_client()
+    drama = models.Genre.objects.named("Drama").values_list("pk", flat=True).get()
+    report("facets", filters="per facet query", queries=5, time=timeit(sidebar_facets, repeat))
+    for query in ("", "?decade=1990", "?genre=%d&runtime=90-120" % drama, "?gender=f&birth_decade=1970"):
+        path = "/facets/" + query
+
+        def miss():
+            cache.get_cache().clear()
+            return client.get(path)
+
+        report("facets", filters=query.replace(str(drama), "<drama>") or "none", cache="miss",
+               queries=server_queries(miss()), time=timeit(miss, repeat))
+        report("facets", filters=query.replace(str(drama), "<drama>") or "none", cache="hit",
+               queries=server_queries(client.get(path)), time=timeit(lambda: client.get(path), repeat))
+
+
+def compare(baseline, results, threshold=0.2, floor=0.0005):
+    '''
+    Compares two result lists of the benchmark command (--json): the
+    n-th report of a benchmark with the n-th of the baseline, if their
+    labels (the str values) match. Returns (benchmark, labels, metric,
+    baseline, current) for every timing more than threshold slower
+    and every increased query count; timings below floor seconds in
+    both are noise.
+    '''
+    def keyed(records):
+        seen, result = {}, {}
+        for record in records:
+            index = seen[record["benchmark"]] = seen.get(record["benchmark"], -1) + 1
+            result[(record["benchmark"], index)] = record["metrics"]
+        return result
+
+    def labels(metrics):
+        return {key: value for key, value in metrics.items() if isinstance(value, str)}
+
+    baseline = keyed(baseline)
+    regressions = []
+    for (name, index), metrics in keyed(results).items():
+        old = baseline.get((name, index))
+        if old is None or labels(old) != labels(metrics):
+            continue
+        for key, value in metrics.items():
+            before = old.get(key)
+            if key == "queries" and isinstance(value, int) and isinstance(before, int):
+                if value > before:
+                    regressions.append((name, labels(metrics), key, before, value))
+            elif isinstance(value, float) and isinstance(before, float):
+                if max(value, before) >= floor and value > before * (1 + threshold):
+                    regressions.append((name, labels(metrics), key, before, value))
+    return regressions
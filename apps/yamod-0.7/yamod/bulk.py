@@ -0,0 +1,162 @@
+'''
+Batch writes for the genre API (see views.GenreViewSet.bulk).
+
+Every item is validated before anything is written; a batch is
+written with bulk_create/bulk_update/a filtered delete inside one
+transaction. bulk_create and bulk_update do not send model signals,
+so the cache entries and the table version are invalidated here.
+'''
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import transaction
+
+from . import cache
+from . import instrumentation
+from . import models
+from . import routers
+from .conditional import bump_version
+from .signals import batched_invalidation
+
+
+class BulkError(Exception):
+    '''
+    Raised with the list of per item errors if a batch is invalid.
+    '''
+
+    def __init__(self, errors):
+        super().__init__(errors)
+        self.errors = errors
+
+
+def batch_size():
+    return getattr(settings, "YAMOD_BULK_BATCH_SIZE", 500)
+
+
+def _count_batches(items):
+    # the queries of a request grow with its batches (query budget)
+    instrumentation.count_batches(-(-len(items) // batch_size()))
+
+
+@contextmanager
+def _primary_transaction():
+    # validated and written on the primary, not against a lagging replica
+    with transaction.atomic(using=routers.primary()), routers.reading_primary():
+        yield
+
+
+def _check(errors):
+    if errors:
+        raise BulkError(errors)
+
+
+def _validate_ids(ids, unique=False):
+    errors = [
+        {"index": index, "error": "Invalid id."}
+        for index, pk in enumerate(ids)
+        if isinstance(pk, bool) or not isinstance(pk, int)
+    ]
+    _check(errors)
+    if unique:
+        # an item per genre, a later one would overwrite an earlier one
+        seen = set()
+        for index, pk in enumerate(ids):
+            if pk in seen:
+                errors.append({"index": index, "error": "Duplicate id."})
+            seen.add(pk)
+        _check(errors)
+    existing = models.Genre.objects.in_bulk(ids)
+    _check([
+        {"index": index, "error": "Not found."}
+        for index, pk in enumerate(ids) if pk not in existing
+    ])
+    return existing
+
+
+def _created_pks(genres):
+    '''
+    Primary keys of freshly bulk created genres. Backends that cannot
+    return them from the INSERT (SQLite on Django < 4) leave them unset,
+    they are looked up on the unique name_key then.
+    '''
+    if all(genre.pk is not None for genre in genres):
+        return [genre.pk for genre in genres]
+    keys = [genre.name_key for genre in genres]
+    pks = {}
+    for start in range(0, len(keys), batch_size()):
+        pks.update(models.Genre.objects.filter(
+            name_key__in=keys[start:start + batch_size()]).values_list("name_key", "pk"))
+    return [pks[key] for key in keys]
+
+
+def _validate_names(names, pks=None):
+    '''
+    Genre names are unique (models.Genre.name_key): reports the names
+    given twice in the batch or taken by another genre than the item's
+    own (pks, for updates), looked up on the name_key index.
+    '''
+    keys = [models.Genre.normalize(name) for name in names]
+    unique_keys = list(set(keys))
+    taken = {}
+    for start in range(0, len(unique_keys), batch_size()):
+        taken.update(models.Genre.objects.filter(
+            name_key__in=unique_keys[start:start + batch_size()]).values_list("name_key", "pk"))
+    errors, seen = [], set()
+    for index, key in enumerate(keys):
+        own_pk = pks[index] if pks else None
+        if key in seen or taken.get(key, own_pk) != own_pk:
+            errors.append({"index": index, "error": "Genre already exists."})
+        seen.add(key)
+    _check(errors)
+
+
+def create_genres(items):
+    _count_batches(items)
+    _check([
+        {"index": index, "error": "No name given."}
+        for index, item in enumerate(items)
+        if not (isinstance(item, dict) and isinstance(item.get("name"), str))
+    ])
+    with _primary_transaction():
+        _validate_names([item["name"] for item in items])
+        genres = models.Genre.objects.bulk_create(
+            [
+                models.Genre(name=item["name"], name_key=models.Genre.normalize(item["name"]))
+                for item in items
+            ],
+            batch_size=batch_size()
+        )
+        pks = _created_pks(genres)
+        cache.invalidate_genres(pks, {genre.name for genre in genres})
+        bump_version(models.Genre)
+    return [{"name": genre.name, "id": pk} for genre, pk in zip(genres, pks)]
+
+
+def update_genres(items):
+    _count_batches(items)
+    _check([
+        {"index": index, "error": "No id or name given."}
+        for index, item in enumerate(items)
+        if not (isinstance(item, dict) and "id" in item and isinstance(item.get("name"), str))
+    ])
+    with _primary_transaction():
+        genres = _validate_ids([item["id"] for item in items], unique=True)
+        _validate_names([item["name"] for item in items], [item["id"] for item in items])
+        old_names = {genre.name for genre in genres.values()}
+        for item in items:
+            genre = genres[item["id"]]
+            genre.name = item["name"]
+            genre.name_key = models.Genre.normalize(item["name"])
+        models.Genre.objects.bulk_update(genres.values(), ["name", "name_key"], batch_size=batch_size())
+        cache.invalidate_genres(genres, old_names | {item["name"] for item in items})
+        bump_version(models.Genre)
+    return [{"name": genre.name, "pk": genre.pk} for genre in genres.values()]
+
+
+def delete_genres(ids):
+    _count_batches(ids)
+    with _primary_transaction():
+        _validate_ids(ids)
+        # post_delete is sent per genre, see signals.py
+        with batched_invalidation():
+            models.Genre.objects.filter(pk__in=ids).delete()
@@ -0,0 +1,137 @@
+'''
+Read-through cache for the genre API responses.
+
+Entries are stored in the Django cache configured by YAMOD_CACHE
+(default: "default", LocMem unless the project configures another
+backend) and are dropped precisely by the model signals in signals.py:
+a changed genre only invalidates its own detail entry and the list
+entries that can contain it (the unfiltered lists and the lists
+filtered by its old and new name). They are dropped again after the
+commit of the change (delete_after_commit).
+'''
+import hashlib
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from . import models
+from . import routers
+
+MISSING = object()
+
+# order_by values a cached list can be stored under (see normalize_order_by)
+GENRE_ORDERINGS = (None, "pk", "-pk", "name", "-name")
+
+
+class CacheStats:
+    '''
+    In-process hit/miss counters, exposed by views.MetricsViewSet.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def incr(self, name, what):
+        with self._lock:
+            counts = self._counts.setdefault(name, {"hits": 0, "misses": 0, "invalidations": 0})
+            counts[what] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {name: dict(counts) for name, counts in self._counts.items()}
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+
+
+stats = CacheStats()
+
+
+def get_cache():
+    return caches[getattr(settings, "YAMOD_CACHE", "default")]
+
+
+def get_or_compute(key, compute, name="genres"):
+    cache = get_cache()
+    value = cache.get(key, MISSING)
+    if value is MISSING:
+        stats.incr(name, "misses")
+        # other requests get the value, it must not lag behind the primary
+        with routers.reading_primary():
+            value = compute()
+        cache.set(key, value, getattr(settings, "YAMOD_CACHE_TIMEOUT", 3600))
+    else:
+        stats.incr(name, "hits")
+    return value
+
+
+async def aget_or_compute(key, compute, name="genres"):
+    '''
+    get_or_compute for async views, compute is a coroutine function.
+    '''
+    cache = get_cache()
+    # the cache API is sync only before Django 4.0
+    aget = getattr(cache, "aget", None) or sync_to_async(cache.get)
+    aset = getattr(cache, "aset", None) or sync_to_async(cache.set)
+    value = await aget(key, MISSING)
+    if value is MISSING:
+        stats.incr(name, "misses")
+        with routers.reading_primary():
+            value = await compute()
+        await aset(key, value, getattr(settings, "YAMOD_CACHE_TIMEOUT", 3600))
+    else:
+        stats.incr(name, "hits")
+    return value
+
+
+def normalize_order_by(order_by):
+    if order_by is None:
+        return None
+    return order_by.replace("id", "pk") if order_by.lstrip("-") == "id" else order_by
+
+
+def genre_list_key(name, order_by):
+    # ?name= matches the normalized name (models.Genre.name_key). It is
+    # hashed so arbitrary user input yields a valid key for every cache
+    # backend (e.g. memcached)
+    name_part = "-" if name is None else hashlib.md5(
+        models.Genre.normalize(name).encode("utf-8")).hexdigest()
+    return "yamod:genres:list:%s:%s" % (name_part, normalize_order_by(order_by) or "-")
+
+
+def genre_detail_key(pk):
+    return "yamod:genres:detail:%s" % pk
+
+
+def delete_after_commit(keys, using=None):
+    '''
+    Deletes the cache keys now and once more after the commit of the
+    current transaction on using (at once without one): a read in
+    between still sees the old rows and may have cached them again.
+    '''
+    get_cache().delete_many(keys)
+    transaction.on_commit(lambda: get_cache().delete_many(keys), using=using)
+
+
+def invalidate_genre(pk, *names):
+    '''
+    Drops the cache entries a change of the genre with the given primary
+    key and (old and new) names can affect.
+    '''
+    invalidate_genres([pk], names)
+
+
+def invalidate_genres(pks, names):
+    '''
+    Same as invalidate_genre for a batch of genres, in one round trip.
+    '''
+    keys = [genre_detail_key(pk) for pk in pks]
+    for name in {None, *names}:
+        keys += [genre_list_key(name, order_by) for order_by in GENRE_ORDERINGS]
+    delete_after_commit(keys, routers.primary())
+    stats.incr("genres", "invalidations")
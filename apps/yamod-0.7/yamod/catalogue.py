@@ -0,0 +1,361 @@
+'''
+Catalogue files: the import (management/commands/import_catalogue.py)
+reads movies, people and roles from CSV, TSV or JSON lines files
+(optionally gzipped), with one object per line/row:
+
+    movies: id, movie_title, original_title, released, runtime, genres
+    people: id, credited_name, year_of_birth, year_of_death, gender
+    roles:  movie, person, role
+
+Ids may be numbers or IMDb style ("tt0000001", "nm0000001") and
+become the primary keys, so roles can reference movies and people
+of earlier imports. released is a date (YYYY-MM-DD) or a year, genres
+a comma separated string (or a list in JSON lines). Empty values and
+"\\N" (IMDb dumps) are null; original_title, runtime (default 90),
+genres and year_of_death are optional.
+
+Files are read as streams and written with bulk_create in batches,
+committing every chunk. Rows whose primary key (or role) already
+exists are skipped (ignore_conflicts), so an interrupted import is
+resumed by running it again. Only the genre and role type lookup
+maps are kept in memory; the movies and people referenced by a batch
+of roles are checked with one query each. Model signals are not sent:
+the caches, table versions and the autocomplete index are invalidated
+once at the end, the search index is kept current by its triggers.
+
+The export (management/commands/export_catalogue.py) writes one file
+per table, the m2m tables Movie.genre and Season.cast as edge lists,
+see export_catalogue below.
+'''
+import csv
+import datetime
+import gzip
+import json
+import os
+import re
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+from . import autocomplete
+from . import cache
+from . import filmography
+from . import models
+from . import signals
+from .conditional import bump_version, table_name
+from .seeding import batches
+
+NULLS = ("", "\\N")
+
+
+def open_text(path, mode="rt"):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode, encoding="utf-8", newline="")
+    return open(path, mode[0], encoding="utf-8", newline="")
+
+
+def file_format(path):
+    name = path[:-3] if path.endswith(".gz") else path
+    for suffix, format in ((".csv", "csv"), (".tsv", "tsv"), (".jsonl", "jsonl"), (".ndjson", "jsonl")):
+        if name.endswith(suffix):
+            return format
+    raise ValueError("Unknown file format: %s (expected .csv, .tsv or .jsonl)" % path)
+
+
+def read_rows(path):
+    '''
+    Yields the rows of a catalogue file as dicts.
+    '''
+    format = file_format(path)
+    with open_text(path) as file:
+        if format == "jsonl":
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+        elif format == "tsv":
+            # IMDb dumps are not quoted
+            yield from csv.DictReader(file, delimiter="\t", quoting=csv.QUOTE_NONE)
+        else:
+            yield from csv.DictReader(file)
+
+
+def value(row, field):
+    value = row.get(field)
+    return None if value in NULLS else value
+
+
+def required(row, field):
+    result = value(row, field)
+    if result is None:
+        raise ValueError("No %s given: %r" % (field, row))
+    return result
+
+
+def parse_id(value):
+    if isinstance(value, int):
+        return value
+    digits = re.sub(r"\D", "", value or "")
+    if not digits:
+        raise ValueError("Invalid id: %r" % value)
+    return int(digits)
+
+
+def parse_int(value, default=None):
+    return default if value in NULLS or value is None else int(value)
+
+
+def parse_date(value):
+    value = str(value)
+    if len(value) == 4:
+        return datetime.date(int(value), 1, 1)
+    return datetime.date.fromisoformat(value)
+
+
+def parse_names(value):
+    if not value:
+        return []
+    names = value if isinstance(value, list) else value.split(",")
+    return [name.strip() for name in names if name and name.strip()]
+
+
+class CatalogueImporter:
+    '''
+    Imports movies, people and roles: rows are written in batches of
+    batch_size objects, committed every chunk_size rows. progress is
+    called with the kind and the number of rows committed so far.
+    '''
+
+    def __init__(self, batch_size=1000, chunk_size=50000, using="default", progress=None):
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.using = using
+        self.progress = progress or (lambda kind, rows: None)
+        self.genres = None
+        self.role_types = None
+        self.new_genres = {}
+        self.changed = set()
+
+    def _objects(self, model):
+        return model.objects.db_manager(self.using)
+
+    def _write(self, kind, rows, write_batch):
+        count = 0
+        for chunk in batches(rows, self.chunk_size):
+            try:
+                with transaction.atomic(using=self.using):
+                    for batch in batches(chunk, self.batch_size):
+                        write_batch(batch)
+            except Exception:
+                # genres and role types created in the chunk were rolled back
+                self.genres = self.role_types = None
+                raise
+            count += len(chunk)
+            self.progress(kind, count)
+        return count
+
+    def genre_ids(self, names):
+        '''
+        Primary keys of the genres with the given names, missing
+        genres are created.
+        '''
+        if self.genres is None:
+            self.genres = dict(self._objects(models.Genre).values_list("name_key", "pk"))
+        missing = {}
+        for name in names:
+            key = models.Genre.normalize(name)
+            if key not in self.genres:
+                missing.setdefault(key, name)
+        if missing:
+            self._objects(models.Genre).bulk_create(
+                [models.Genre(name=name, name_key=key) for key, name in missing.items()],
+                ignore_conflicts=True
+            )
+            created = dict(self._objects(models.Genre).filter(
+                name_key__in=missing).values_list("name_key", "pk"))
+            self.genres.update(created)
+            self.new_genres.update({created[key]: name for key, name in missing.items()})
+        return [self.genres[models.Genre.normalize(name)] for name in names]
+
+    def role_type_ids(self, names):
+        if self.role_types is None:
+            self.role_types = dict(self._objects(models.RoleType).values_list("name", "pk"))
+        missing = set(names) - set(self.role_types)
+        if missing:
+            self._objects(models.RoleType).bulk_create(
+                [models.RoleType(name=name) for name in missing], ignore_conflicts=True
+            )
+            self.role_types.update(self._objects(models.RoleType).filter(
+                name__in=missing).values_list("name", "pk"))
+            self.changed.add(models.RoleType)
+        return [self.role_types[name] for name in names]
+
+    def import_people(self, rows):
+        def write_batch(batch):
+            self._objects(models.Person).bulk_create([
+                models.Person(
+                    pk=parse_id(required(row, "id")),
+                    credited_name=required(row, "credited_name"),
+                    year_of_birth=parse_int(required(row, "year_of_birth")),
+                    year_of_death=parse_int(value(row, "year_of_death")),
+                    gender=required(row, "gender"),
+                )
+                for row in batch
+            ], ignore_conflicts=True)
+        self.changed.add(models.Person)
+        return self._write("people", rows, write_batch)
+
+    def import_movies(self, rows):
+        MovieGenre = models.Movie.genre.through
+
+        def write_batch(batch):
+            movies, links = [], []
+            for row in batch:
+                pk = parse_id(required(row, "id"))
+                movies.append(models.Movie(
+                    pk=pk,
+                    movie_title=required(row, "movie_title"),
+                    original_title=value(row, "original_title"),
+                    released=parse_date(required(row, "released")),
+                    runtime=parse_int(value(row, "runtime"), 90),
+                ))
+                links.extend(
+                    MovieGenre(movie_id=pk, genre_id=genre_id)
+                    for genre_id in self.genre_ids(parse_names(value(row, "genres")))
+                )
+            self._objects(models.Movie).bulk_create(movies, ignore_conflicts=True)
+            MovieGenre.objects.db_manager(self.using).bulk_create(links, ignore_conflicts=True)
+        self.changed.update((models.Movie, MovieGenre))
+        return self._write("movies", rows, write_batch)
+
+    def import_roles(self, rows):
+        def write_batch(batch):
+            movie_ids = {parse_id(row["movie"]) for row in batch}
+            person_ids = {parse_id(row["person"]) for row in batch}
+            # foreign key checks are deferred on SQLite: a dangling
+            # reference would only fail (the whole chunk) on commit
+            missing_movies = movie_ids - set(self._objects(models.Movie).filter(
+                pk__in=movie_ids).values_list("pk", flat=True))
+            missing_people = person_ids - set(self._objects(models.Person).filter(
+                pk__in=person_ids).values_list("pk", flat=True))
+            if missing_movies or missing_people:
+                raise ValueError("Roles reference unknown movies %s / people %s" % (
+                    sorted(missing_movies)[:10], sorted(missing_people)[:10]))
+            role_type_ids = self.role_type_ids([required(row, "role") for row in batch])
+            self._objects(models.Role).bulk_create([
+                models.Role(
+                    movie_id=parse_id(row["movie"]),
+                    person_id=parse_id(row["person"]),
+                    role_id=role_type_id,
+                )
+                for row, role_type_id in zip(batch, role_type_ids)
+            ], ignore_conflicts=True)
+        self.changed.add(models.Role)
+        return self._write("roles", rows, write_batch)
+
+    def finish(self):
+        '''
+        Invalidates what the model signals would have: the genre
+        cache, the versions of the changed tables, the stored
+        filmography aggregates and the autocomplete index of this
+        process.
+        '''
+        if self.new_genres:
+            cache.invalidate_genres(self.new_genres, set(self.new_genres.values()))
+            self.changed.add(models.Genre)
+        for model in self.changed:
+            bump_version(model)
+        if models.Role in self.changed or models.Movie in self.changed:
+            filmography.mark_stale()
+        autocomplete.index.reset()
+
+
+# name: model, in export order. Edge lists are the auto created through
+# tables (id, movie_id, genre_id) and (id, season_id, person_id).
+EXPORTS = {
+    "genre": models.Genre,
+    "roletype": models.RoleType,
+    "person": models.Person,
+    "movie": models.Movie,
+    "movie_genre": models.Movie.genre.through,
+    "role": models.Role,
+    "tvshow": models.TVShow,
+    "season": models.Season,
+    "season_cast": models.Season.cast.through,
+    "episode": models.Episode,
+}
+# Tables whose changes bump their models.TableVersion (see signals.py);
+# the others cannot be skipped by export_catalogue(changed_since=...)
+VERSIONED = {models.Genre, models.Movie.genre.through, models.Season.cast.through,
+             *signals.VERSIONED_MODELS}
+
+
+def export_fields(model):
+    return [field.attname for field in model._meta.concrete_fields]
+
+
+def export_rows(model, since_pk=None, chunk_size=2000, using="default"):
+    '''
+    Streams the rows of model as tuples of export_fields in pk order,
+    chunk_size rows at a time.
+    '''
+    queryset = model._base_manager.db_manager(using).order_by("pk")
+    if since_pk is not None:
+        queryset = queryset.filter(pk__gt=since_pk)
+    return queryset.values_list(*export_fields(model)).iterator(chunk_size=chunk_size)
+
+
+def write_rows(path, fields, rows, format):
+    '''
+    Writes rows to path as JSON lines or CSV (with a header, nulls as
+    empty values). Returns the number of rows and the largest pk.
+    '''
+    count, max_pk = 0, None
+    with open_text(path, "wt") as file:
+        if format == "csv":
+            writer = csv.writer(file)
+            writer.writerow(fields)
+            write = writer.writerow
+        else:
+            encoder = DjangoJSONEncoder()
+            write = lambda row: file.write(encoder.encode(dict(zip(fields, row))) + "\n")
+        for row in rows:
+            write(row)
+            count += 1
+            max_pk = row[0]
+    return count, max_pk
+
+
+def export_catalogue(directory, names=None, format="jsonl", compress=False,
+                     since_pks=None, changed_since=None, chunk_size=2000, using="default"):
+    '''
+    Exports the tables in names (default: all EXPORTS) to directory, one
+    file each, and returns the manifest: {"exported_at": ..., "tables":
+    {name: {"file", "rows", "max_pk"}}}.
+
+    since_pks ({name: pk}, e.g. the max_pk of an earlier manifest) only
+    exports rows with a larger pk (appended rows, not changes).
+    changed_since skips versioned tables unchanged since that datetime.
+    All tables are read in one transaction, so the files are consistent.
+    '''
+    names = names or list(EXPORTS)
+    since_pks = since_pks or {}
+    manifest = {"exported_at": timezone.now().isoformat(), "tables": {}}
+    with transaction.atomic(using=using):
+        if changed_since is not None:
+            updated = dict(models.TableVersion.objects.using(using).values_list("table", "updated_at"))
+        for name in names:
+            model = EXPORTS[name]
+            if changed_since is not None and model in VERSIONED:
+                updated_at = updated.get(table_name(model))
+                if updated_at is None or updated_at <= changed_since:
+                    continue
+            file_name = "%s.%s%s" % (name, format, ".gz" if compress else "")
+            fields = export_fields(model)
+            rows = export_rows(model, since_pks.get(name), chunk_size, using)
+            count, max_pk = write_rows(os.path.join(directory, file_name), fields, rows, format)
+            manifest["tables"][name] = {
+                "file": file_name, "rows": count,
+                "max_pk": max_pk if max_pk is not None else since_pks.get(name),
+            }
+    return manifest
@@ -0,0 +1,151 @@
+'''
+Conditional GET support (ETag / Last-Modified) for the yamod viewsets.
+
+Validators are derived from the per table change counters in
+models.TableVersion (cached next to the responses, see cache.py)
+rather than from the response body, so a request with a matching
+If-None-Match is answered with a 304 without running the list query
+or any serialisation.
+'''
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+
+from . import models
+from . import routers
+from .cache import delete_after_commit, get_cache
+
+
+def table_name(model):
+    return model._meta.label_lower
+
+
+def version_key(table):
+    return "yamod:version:%s" % table
+
+
+def bump_version(model):
+    '''
+    Marks the table of the given model as changed.
+    '''
+    table = table_name(model)
+    now = timezone.now()
+    updated = models.TableVersion.objects.filter(table=table).update(
+        version=F("version") + 1, updated_at=now
+    )
+    if not updated:
+        version, created = models.TableVersion.objects.get_or_create(
+            table=table, defaults={"version": 1}
+        )
+        if not created:
+            return bump_version(model)
+    # again after the commit: a read in between caches the old version
+    delete_after_commit([version_key(table)], routers.primary())
+
+
+def table_versions(tables):
+    '''
+    Returns {table: (version, updated_at)}, read from the cache and for
+    the remaining tables from the database in one query.
+    '''
+    cache = get_cache()
+    keys = {version_key(table): table for table in tables}
+    versions = {keys[key]: value for key, value in cache.get_many(keys).items()}
+    missing = [table for table in tables if table not in versions]
+    if missing:
+        rows = {
+            table: (version, updated_at)
+            # from the primary: cached for everyone (see routers.reading_primary)
+            for table, version, updated_at in models.TableVersion.objects.using(routers.primary()).filter(
+                table__in=missing).values_list("table", "version", "updated_at")
+        }
+        for table in missing:
+            versions[table] = rows.get(table, (0, None))
+        cache.set_many(
+            {version_key(table): versions[table] for table in missing},
+            getattr(settings, "YAMOD_CACHE_TIMEOUT", 3600)
+        )
+    return versions
+
+
+def validators(*tracked):
+    '''
+    Returns the ETag and the Last-Modified timestamp for the given models.
+    '''
+    tables = [table_name(model) for model in tracked]
+    versions = table_versions(tables)
+    etag = 'W/"%s"' % ";".join("%s:%d" % (table, versions[table][0]) for table in tables)
+    timestamps = [updated_at for version, updated_at in versions.values() if updated_at]
+    return etag, max(timestamps) if timestamps else None
+
+
+def not_modified(request, etag, last_modified):
+    '''
+    Returns the 304 (or 412) response for a request whose preconditions
+    match the validators, None otherwise.
+    '''
+    return get_conditional_response(
+        request, etag=etag, last_modified=int(last_modified.timestamp()) if last_modified else None
+    )
+
+
+def checked(view, request, response):
+    '''
+    The 400 of view.query_error(request) in place of a 304 (or 412),
+    the query string is not validated otherwise before the view runs.
+    '''
+    if response is not None and hasattr(view, "query_error"):
+        error = view.query_error(request)
+        if error is not None:
+            return error
+    return response
+
+
+def set_validators(request, response, etag, last_modified):
+    if request.method in ("GET", "HEAD") and response.status_code in (200, 304):
+        response.headers.setdefault("ETag", etag)
+        if last_modified:
+            response.headers.setdefault("Last-Modified", http_date(int(last_modified.timestamp())))
+    # json, NDJSON and the browsable API share the same validators
+    patch_vary_headers(response, ("Accept",))
+    return response
+
+
+def conditional(*tracked):
+    '''
+    Decorator for viewset methods: answers If-None-Match and
+    If-Modified-Since with a 304 as long as none of the tracked
+    models changed, and sets ETag and Last-Modified otherwise.
+    A request the view rejects (its query_error) gets that 400 instead.
+    '''
+    def decorator(method):
+        @wraps(method)
+        def inner(self, request, *args, **kwargs):
+            etag, last_modified = validators(*tracked)
+            response = checked(self, request, not_modified(request, etag, last_modified))
+            if response is None:
+                response = method(self, request, *args, **kwargs)
+            return set_validators(request, response, etag, last_modified)
+        return inner
+    return decorator
+
+
+def aconditional(*tracked):
+    '''
+    conditional for the coroutine methods of the async views (see async_views.py).
+    '''
+    def decorator(method):
+        @wraps(method)
+        async def inner(self, request, *args, **kwargs):
+            etag, last_modified = await sync_to_async(validators)(*tracked)
+            response = checked(self, request, not_modified(request, etag, last_modified))
+            if response is None:
+                response = await method(self, request, *args, **kwargs)
+            return set_validators(request, response, etag, last_modified)
+        return inner
+    return decorator
@@ -0,0 +1,216 @@
+'''
+Denormalised counters:
+
+    Genre.movie_count       movies of the genre (Movie.genre)
+    Movie.cast_count        people with a role in the movie
+    Season.episode_count    episodes of the season
+    TVShow.season_count     seasons of the show
+    TVShow.episode_count    episodes of all seasons of the show
+
+On SQLite they are kept exact by triggers on the counted tables, so
+bulk_create, queryset updates and deletes, the catalogue import and
+raw SQL are covered like in the search index (search.py). Other
+databases recount the affected rows from the model signals
+(signals.py, recount_rows), which bulk_create and queryset updates do
+not send: run recount after those there. Saving an instance leaves
+the counter columns alone (models.CounterMixin), its values may be
+outdated - refresh_from_db(fields=[...]) reads them.
+
+recount() recomputes all counters and inconsistencies() lists the
+wrong ones (manage.py recount).
+
+Django rebuilds a SQLite table for most schema changes, which drops
+its triggers, and fails to rebuild a table the triggers update while
+they exist (the renamed table is referenced in their body). So the
+triggers are dropped before migrations run (drop_before_migrate) and
+created again afterwards, followed by a recount (create_after_migrate).
+'''
+from django.apps import apps as global_apps
+from django.db import connections
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+# table: [(trigger suffix, when, statements)], "new" and "old" as in SQLite triggers
+TRIGGERS = {
+    "yamod_movie_genre": [
+        ("insert", None, "UPDATE yamod_genre SET movie_count = movie_count + 1 WHERE id = new.genre_id;"),
+        ("delete", None, "UPDATE yamod_genre SET movie_count = movie_count - 1 WHERE id = old.genre_id;"),
+        ("update", "old.genre_id IS NOT new.genre_id",
+         "UPDATE yamod_genre SET movie_count = movie_count - 1 WHERE id = old.genre_id; "
+         "UPDATE yamod_genre SET movie_count = movie_count + 1 WHERE id = new.genre_id;"),
+    ],
+    # a person counts once, whatever the number of their roles in the movie
+    "yamod_role": [
+        ("insert", None,
+         "UPDATE yamod_movie SET cast_count = cast_count + 1 WHERE id = new.movie_id AND NOT EXISTS ("
+         "SELECT 1 FROM yamod_role WHERE movie_id = new.movie_id AND person_id = new.person_id AND id <> new.id);"),
+        ("delete", None,
+         "UPDATE yamod_movie SET cast_count = cast_count - 1 WHERE id = old.movie_id AND NOT EXISTS ("
+         "SELECT 1 FROM yamod_role WHERE movie_id = old.movie_id AND person_id = old.person_id);"),
+        ("update", "old.movie_id IS NOT new.movie_id OR old.person_id IS NOT new.person_id",
+         "UPDATE yamod_movie SET cast_count = cast_count - 1 WHERE id = old.movie_id AND NOT EXISTS ("
+         "SELECT 1 FROM yamod_role WHERE movie_id = old.movie_id AND person_id = old.person_id); "
+         "UPDATE yamod_movie SET cast_count = cast_count + 1 WHERE id = new.movie_id AND NOT EXISTS ("
+         "SELECT 1 FROM yamod_role WHERE movie_id = new.movie_id AND person_id = new.person_id AND id <> new.id);"),
+    ],
+    "yamod_episode": [
+        ("insert", None,
+         "UPDATE yamod_season SET episode_count = episode_count + 1 WHERE id = new.season_id; "
+         "UPDATE yamod_tvshow SET episode_count = episode_count + 1 "
+         "WHERE id = (SELECT tv_show_id FROM yamod_season WHERE id = new.season_id);"),
+        ("delete", None,
+         "UPDATE yamod_season SET episode_count = episode_count - 1 WHERE id = old.season_id; "
+         "UPDATE yamod_tvshow SET episode_count = episode_count - 1 "
+         "WHERE id = (SELECT tv_show_id FROM yamod_season WHERE id = old.season_id);"),
+        ("update", "old.season_id IS NOT new.season_id",
+         "UPDATE yamod_season SET episode_count = episode_count - 1 WHERE id = old.season_id; "
+         "UPDATE yamod_tvshow SET episode_count = episode_count - 1 "
+         "WHERE id = (SELECT tv_show_id FROM yamod_season WHERE id = old.season_id); "
+         "UPDATE yamod_season SET episode_count = episode_count + 1 WHERE id = new.season_id; "
+         "UPDATE yamod_tvshow SET episode_count = episode_count + 1 "
+         "WHERE id = (SELECT tv_show_id FROM yamod_season WHERE id = new.season_id);"),
+    ],
+    # a season brings its episodes along
+    "yamod_season": [
+        ("insert", None,
+         "UPDATE yamod_tvshow SET season_count = season_count + 1, "
+         "episode_count = episode_count + new.episode_count WHERE id = new.tv_show_id;"),
+        ("delete", None,
+         "UPDATE yamod_tvshow SET season_count = season_count - 1, "
+         "episode_count = episode_count - old.episode_count WHERE id = old.tv_show_id;"),
+        ("update", "old.tv_show_id IS NOT new.tv_show_id",
+         "UPDATE yamod_tvshow SET season_count = season_count - 1, "
+         "episode_count = episode_count - old.episode_count WHERE id = old.tv_show_id; "
+         "UPDATE yamod_tvshow SET season_count = season_count + 1, "
+         "episode_count = episode_count + new.episode_count WHERE id = new.tv_show_id;"),
+    ],
+}
+# the columns whose update moves a row to another counter
+UPDATE_COLUMNS = {
+    "yamod_movie_genre": "genre_id",
+    "yamod_role": "movie_id, person_id",
+    "yamod_episode": "season_id",
+    "yamod_season": "tv_show_id",
+}
+
+
+def create_triggers(cursor):
+    for table, triggers in TRIGGERS.items():
+        for action, when, statements in triggers:
+            event = "UPDATE OF %s" % UPDATE_COLUMNS[table] if action == "update" else action.upper()
+            cursor.execute("CREATE TRIGGER IF NOT EXISTS %s_count_%s AFTER %s ON %s %s BEGIN %s END" % (
+                table, action, event, table, "FOR EACH ROW WHEN %s" % when if when else "", statements))
+
+
+def drop_triggers(cursor):
+    for table, triggers in TRIGGERS.items():
+        for action, when, statements in triggers:
+            cursor.execute("DROP TRIGGER IF EXISTS %s_count_%s" % (table, action))
+
+
+def has_counters(apps):
+    # migrated to 0022_counters or later
+    return any(field.name == "movie_count" for field in apps.get_model("yamod", "Genre")._meta.get_fields())
+
+
+def _ran_migrations(plan):
+    return any(migration.app_label == "yamod" for migration, backwards in plan or ())
+
+
+def drop_before_migrate(sender, using, plan, **kwargs):
+    '''
+    pre_migrate receiver: drops the triggers if yamod migrations are
+    about to run.
+    '''
+    connection = connections[using]
+    if connection.vendor == "sqlite" and _ran_migrations(plan):
+        with connection.cursor() as cursor:
+            drop_triggers(cursor)
+
+
+def create_after_migrate(sender, using, apps=global_apps, plan=None, **kwargs):
+    '''
+    post_migrate receiver (also sent by flush, without apps and plan): creates
+    the triggers of the migrated schema and recounts if yamod
+    migrations ran without them.
+    '''
+    connection = connections[using]
+    if connection.vendor != "sqlite" or not has_counters(apps):
+        return
+    with connection.cursor() as cursor:
+        create_triggers(cursor)
+    if _ran_migrations(plan):
+        recount(using, apps)
+
+
+def _count(queryset, group_by, count=Count("*")):
+    return Coalesce(Subquery(
+        queryset.order_by().values(group_by).annotate(n=count).values("n")
+    ), Value(0))
+
+
+def counts(apps=global_apps):
+    '''
+    {(model name, counter field): the expression computing it}
+    '''
+    get = lambda name: apps.get_model("yamod", name)
+    Movie, Season = get("Movie"), get("Season")
+    return {
+        ("Genre", "movie_count"): _count(
+            Movie.genre.through.objects.filter(genre=OuterRef("pk")), "genre"),
+        ("Movie", "cast_count"): _count(
+            get("Role").objects.filter(movie=OuterRef("pk")), "movie", Count("person", distinct=True)),
+        ("Season", "episode_count"): _count(
+            get("Episode").objects.filter(season=OuterRef("pk")), "season"),
+        ("TVShow", "season_count"): _count(
+            Season.objects.filter(tv_show=OuterRef("pk")), "tv_show"),
+        ("TVShow", "episode_count"): _count(
+            get("Episode").objects.filter(season__tv_show=OuterRef("pk")), "season__tv_show"),
+    }
+
+
+def recount(using="default", apps=global_apps):
+    '''
+    Recomputes all counters, returns {(model name, field): rows}.
+    '''
+    return {
+        (model, field): apps.get_model("yamod", model)._base_manager.using(using).update(
+            **{field: expression})
+        for (model, field), expression in counts(apps).items()
+    }
+
+
+# counting model: [(counted model, its rows by the counting foreign key)]
+COUNTED_BY = {
+    "Movie_genre": ("genre_id", [("Genre", "pk__in")]),
+    "Role": ("movie_id", [("Movie", "pk__in")]),
+    "Episode": ("season_id", [("Season", "pk__in"), ("TVShow", "season__pk__in")]),
+    "Season": ("tv_show_id", [("TVShow", "pk__in")]),
+}
+
+
+def recount_rows(model, values, using="default", apps=global_apps):
+    '''
+    Recomputes the counters depending on the rows of model (a key of
+    COUNTED_BY) with the given foreign key values.
+    '''
+    values = {value for value in values if value is not None}
+    if not values:
+        return
+    expressions = counts(apps)
+    for counted, lookup in COUNTED_BY[model][1]:
+        apps.get_model("yamod", counted)._base_manager.using(using).filter(**{lookup: values}).update(**{
+            field: expression for (name, field), expression in expressions.items() if name == counted
+        })
+
+
+def inconsistencies(using="default", limit=None, apps=global_apps):
+    '''
+    The wrong counters: [(model name, pk, field, stored, actual)].
+    '''
+    result = []
+    for (model, field), expression in counts(apps).items():
+        rows = apps.get_model("yamod", model)._base_manager.using(using).annotate(
+            actual=expression).exclude(**{field: F("actual")}).values_list("pk", field, "actual")
+        result += [(model, pk, field, stored, actual) for pk, stored, actual in rows[:limit]]
+    return result
@@ -0,0 +1,236 @@
+'''
+Facet counts of the browse sidebar, GET /facets/ (views.FacetViewSet):
+
+    {"movies": {"count": 120,
+                "genre": [{"value": 3, "name": "Drama", "count": 40}, ...],
+                "decade": [{"value": 1990, "count": 12}, ...],
+                "runtime": [{"value": "90-120", "count": 30}, ...]},
+     "people": {"count": 80,
+                "gender": [{"value": "f", "count": 41}, ...],
+                "birth_decade": [{"value": 1970, "count": 9}, ...]}}
+
+for the movies and people matching the filters
+
+    ?genre=3,5          movies of any of the genres
+    ?decade=1990        movies released 1990-1999
+    ?runtime=90-120     movies of a RUNTIMES bucket
+    ?gender=f           people of the gender
+    ?birth_decade=1970  people born 1970-1979
+
+Movie filters restrict the people to those with a role in a matching
+movie and the other way round. A facet counts within the filtered set
+(its own filter included), values without matches are left out.
+
+The decades and runtime buckets of the movies are counted by a single
+query with one conditional aggregate (COUNT(...) FILTER (WHERE ...))
+per bucket, so the table is scanned once for all of them, the gender
+and birth decade of the people likewise. The decade buckets span the
+oldest to the newest row of the table, read from the released and
+year_of_birth indexes. Genres are grouped in one query on
+Movie.genre.through, read from Genre.movie_count (counters.py)
+without filters.
+
+Results are cached per filter signature and versions of TABLES
+(conditional.py): a write to one of them makes the next request
+compute new counts.
+'''
+import datetime
+import hashlib
+import json
+
+from django.db.models import Count, Q
+
+from . import models
+from .cache import get_or_compute
+from .conditional import validators
+
+# [low, high) in minutes, None is open
+RUNTIMES = ((None, 60), (60, 90), (90, 120), (120, 150), (150, None))
+TABLES = (models.Movie, models.Genre, models.Movie.genre.through, models.Person, models.Role)
+MOVIE_FILTERS = ("genre", "decade", "runtime")
+PERSON_FILTERS = ("gender", "birth_decade")
+
+MovieGenre = models.Movie.genre.through
+
+
+def runtime_label(low, high):
+    return "%s-%s" % ("" if low is None else low, "" if high is None else high)
+
+
+# ?runtime= value: bucket
+RUNTIME_BUCKETS = {runtime_label(*bucket): bucket for bucket in RUNTIMES}
+
+
+def runtime_q(low, high, prefix=""):
+    q = Q()
+    if low is not None:
+        q &= Q(**{prefix + "runtime__gte": low})
+    if high is not None:
+        q &= Q(**{prefix + "runtime__lt": high})
+    return q
+
+
+def released_q(decade, prefix=""):
+    q = Q(**{prefix + "released__gte": datetime.date(max(decade, datetime.MINYEAR), 1, 1)})
+    if decade + 10 <= datetime.MAXYEAR:
+        q &= Q(**{prefix + "released__lt": datetime.date(decade + 10, 1, 1)})
+    return q
+
+
+def born_q(decade, prefix=""):
+    return Q(**{prefix + "year_of_birth__gte": decade, prefix + "year_of_birth__lt": decade + 10})
+
+
+def parse_decade(name, value):
+    try:
+        decade = int(value)
+    except ValueError:
+        raise ValueError("Invalid %s: %s" % (name, value))
+    if decade % 10 or not 0 <= decade <= datetime.MAXYEAR:
+        raise ValueError("Invalid %s: %s" % (name, value))
+    return decade
+
+
+def parse_filters(params):
+    '''
+    The filters of a query string as a dict of normalised values,
+    raises ValueError for an invalid one.
+    '''
+    filters = {}
+    if params.get("genre"):
+        try:
+            filters["genre"] = sorted({int(pk) for pk in params["genre"].split(",")})
+        except ValueError:
+            raise ValueError("Invalid genre: %s" % params["genre"])
+    for name in ("decade", "birth_decade"):
+        if params.get(name):
+            filters[name] = parse_decade(name, params[name])
+    if params.get("runtime"):
+        if params["runtime"] not in RUNTIME_BUCKETS:
+            raise ValueError("Invalid runtime, one of: %s" % ", ".join(RUNTIME_BUCKETS))
+        filters["runtime"] = params["runtime"]
+    if params.get("gender"):
+        if params["gender"] not in dict(models.Person.GENDER_CHOICES):
+            raise ValueError("Invalid gender: %s" % params["gender"])
+        filters["gender"] = params["gender"]
+    return filters
+
+
+def movie_q(filters, prefix=""):
+    q = Q()
+    if "genre" in filters:
+        # a subquery, joining the genres would count a movie per genre
+        q &= Q(**{prefix + "pk__in": MovieGenre.objects.filter(
+            genre__in=filters["genre"]).values("movie")})
+    if "decade" in filters:
+        q &= released_q(filters["decade"], prefix)
+    if "runtime" in filters:
+        q &= runtime_q(*RUNTIME_BUCKETS[filters["runtime"]], prefix=prefix)
+    return q
+
+
+def person_q(filters, prefix=""):
+    q = Q()
+    if "gender" in filters:
+        q &= Q(**{prefix + "gender": filters["gender"]})
+    if "birth_decade" in filters:
+        q &= born_q(filters["birth_decade"], prefix)
+    return q
+
+
+def movies(filters):
+    queryset = models.Movie.objects.filter(movie_q(filters))
+    if any(name in filters for name in PERSON_FILTERS):
+        # IN rather than a correlated EXISTS: SQLite builds the set once
+        queryset = queryset.filter(pk__in=models.Role.objects.filter(
+            person_q(filters, "person__")).values("movie"))
+    return queryset
+
+
+def people(filters):
+    queryset = models.Person.objects.filter(person_q(filters))
+    if any(name in filters for name in MOVIE_FILTERS):
+        queryset = queryset.filter(pk__in=models.Role.objects.filter(
+            movie_q(filters, "movie__")).values("person"))
+    return queryset
+
+
+def decades(model, field, year=lambda value: value):
+    '''
+    The decades from the first to the last value of the indexed field.
+    '''
+    values = model.objects.exclude(**{field: None}).values_list(field, flat=True)
+    first, last = values.order_by(field).first(), values.order_by("-" + field).first()
+    if first is None:
+        return []
+    return list(range(year(first) // 10 * 10, year(last) // 10 * 10 + 1, 10))
+
+
+def buckets(counts, values, prefix):
+    return [{"value": value, "count": counts["%s_%s" % (prefix, index)]}
+            for index, value in enumerate(values) if counts["%s_%s" % (prefix, index)]]
+
+
+def genre_facet(filters, queryset):
+    if filters:
+        rows = MovieGenre.objects.filter(movie__in=queryset.values("pk")).values(
+            "genre", "genre__name").annotate(count=Count("pk")).values_list("genre", "genre__name", "count")
+    else:
+        rows = models.Genre.objects.filter(movie_count__gt=0).values_list("pk", "name", "movie_count")
+    return [{"value": pk, "name": name, "count": count}
+            for pk, name, count in sorted(rows, key=lambda row: (-row[2], row[1], row[0]))]
+
+
+def movie_facets(filters):
+    queryset = movies(filters)
+    movie_decades = decades(models.Movie, "released", lambda date: date.year)
+    counts = queryset.aggregate(
+        count=Count("pk"),
+        **{"decade_%d" % index: Count("pk", filter=released_q(decade))
+           for index, decade in enumerate(movie_decades)},
+        **{"runtime_%d" % index: Count("pk", filter=runtime_q(*bucket))
+           for index, bucket in enumerate(RUNTIMES)},
+    )
+    return {
+        "count": counts["count"],
+        "genre": genre_facet(filters, queryset),
+        "decade": buckets(counts, movie_decades, "decade"),
+        "runtime": buckets(counts, list(RUNTIME_BUCKETS), "runtime"),
+    }
+
+
+def person_facets(filters):
+    birth_decades = decades(models.Person, "year_of_birth")
+    genders = [gender for gender, label in models.Person.GENDER_CHOICES]
+    counts = people(filters).aggregate(
+        count=Count("pk"),
+        **{"gender_%d" % index: Count("pk", filter=Q(gender=gender))
+           for index, gender in enumerate(genders)},
+        **{"decade_%d" % index: Count("pk", filter=born_q(decade))
+           for index, decade in enumerate(birth_decades)},
+    )
+    return {
+        "count": counts["count"],
+        "gender": buckets(counts, genders, "gender"),
+        "birth_decade": buckets(counts, birth_decades, "decade"),
+    }
+
+
+def facets_key(filters):
+    # the ETag changes with every write to TABLES (it is cached, read
+    # by the conditional decorator of the view before)
+    etag, last_modified = validators(*TABLES)
+    signature = json.dumps([sorted(filters.items()), etag])
+    return "yamod:facets:%s" % hashlib.md5(signature.encode("utf-8")).hexdigest()
+
+
+def facets(filters):
+    '''
+    The facet counts of the movies and people matching filters
+    (see parse_filters), cached.
+    '''
+    return get_or_compute(
+        facets_key(filters),
+        lambda: {"movies": movie_facets(filters), "people": person_facets(filters)},
+        name="facets"
+    )
@@ -0,0 +1,26 @@
+class SparseFieldsMixin:
+    '''
+    Adds sparse fieldsets to a viewset:
+
+    GET /movies/?fields=movie_title,released
+
+    limits every item to the given fields (plus "id"). Views push the
+    selection down to the query with .only()/.values(), so the other
+    columns are neither fetched nor serialised. Unknown fields are
+    rejected before any query runs.
+    '''
+
+    # Fields of the full representation, in output order
+    sparse_fields = ("id",)
+
+    def get_fields(self, request):
+        requested = request.GET.get("fields")
+        if not requested:
+            return self.sparse_fields
+        requested = set(requested.split(","))
+        unknown = requested - set(self.sparse_fields)
+        if unknown:
+            raise ValueError("Unknown fields: %s" % ", ".join(sorted(unknown)))
+        return tuple(
+            field for field in self.sparse_fields if field in requested or field == "id"
+        )
@@ -0,0 +1,127 @@
+'''
+Filmography of a person for GET /people/<pk>/filmography/
+(views.PersonViewSet): the roles grouped by role type, the movies of
+every group sorted by release date, and the aggregates
+
+    {"movies": 12, "first_year": 1982, "last_year": 2021,
+     "roles": {"Actor": {"movies": 10, "first_year": 1982, "last_year": 2021}, ...}}
+
+computed by the database (Count/Min/Max annotations), so a request
+takes the same number of queries for 1 and for 1000 roles.
+
+Aggregates of the people requested more than YAMOD_PERSON_SUMMARY_HITS
+times (default 5, counted in the cache) are stored in
+models.PersonSummary and read with one query. A stored summary is
+marked stale when a role of the person, one of their movies or a role
+type changes (signals.py, CatalogueImporter.finish) and recomputed
+by the next request.
+'''
+from django.conf import settings
+from django.db.models import Count, F, Max, Min
+from django.utils import timezone
+
+from . import models
+from . import routers
+from .cache import get_cache
+
+
+def roles_queryset(person_pk):
+    return models.Role.objects.filter(person=person_pk).select_related("movie", "role").only(
+        "person", "movie__movie_title", "movie__released", "role__name"
+    ).order_by("role__name", "movie__released", "movie__pk")
+
+
+def filmography(person_pk):
+    '''
+    [{"role": name, "movies": [{"id", "movie_title", "released"}, ...]}, ...]
+    '''
+    groups = []
+    for role in roles_queryset(person_pk):
+        if not groups or groups[-1]["role"] != role.role.name:
+            groups.append({"role": role.role.name, "movies": []})
+        groups[-1]["movies"].append({
+            "id": role.movie.pk, "movie_title": role.movie.movie_title, "released": role.movie.released,
+        })
+    return groups
+
+
+def year(date):
+    return date.year if date is not None else None
+
+
+def aggregate(person_pk):
+    '''
+    The aggregates of a person, computed with two queries.
+    '''
+    roles = models.Role.objects.filter(person=person_pk)
+    total = roles.aggregate(
+        movies=Count("movie", distinct=True), first=Min("movie__released"), last=Max("movie__released")
+    )
+    per_role = roles.values("role__name").annotate(
+        movies=Count("movie", distinct=True), first=Min("movie__released"), last=Max("movie__released")
+    ).order_by("role__name")
+    return {
+        "movies": total["movies"],
+        "first_year": year(total["first"]),
+        "last_year": year(total["last"]),
+        "roles": {
+            row["role__name"]: {"movies": row["movies"], "first_year": year(row["first"]),
+                                "last_year": year(row["last"])}
+            for row in per_role
+        },
+    }
+
+
+def hits_key(person_pk):
+    return "yamod:person_hits:%s" % person_pk
+
+
+def count_hit(person_pk):
+    cache = get_cache()
+    key = hits_key(person_pk)
+    # add is a no-op for an existing counter, incr is atomic in memcached/redis
+    cache.add(key, 0, getattr(settings, "YAMOD_CACHE_TIMEOUT", 3600))
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # expired in between
+        return 1
+
+
+def summary(person_pk):
+    '''
+    The aggregates of a person: from models.PersonSummary if stored
+    and fresh, computed otherwise (and stored for frequently requested
+    people).
+    '''
+    stored = models.PersonSummary.objects.filter(pk=person_pk).first()
+    if stored is not None and not stored.stale:
+        return {"movies": stored.movies, "first_year": stored.first_year,
+                "last_year": stored.last_year, "roles": stored.roles}
+    version = None
+    if stored is not None:
+        # read before the aggregate, older if read from a lagging replica
+        version = stored.version
+    elif count_hit(person_pk) > getattr(settings, "YAMOD_PERSON_SUMMARY_HITS", 5):
+        # a stale row first, so mark_stale counts the changes from now on
+        models.PersonSummary.objects.bulk_create([models.PersonSummary(
+            person_id=person_pk, movies=0, roles={}, stale=True)], ignore_conflicts=True)
+        version = 0
+    # stored for everyone: not from a lagging replica (routers.py)
+    with routers.reading_primary():
+        data = aggregate(person_pk)
+    if version is not None:
+        # a change since the version (mark_stale) may be missing from
+        # data: then the row stays stale for the next request
+        models.PersonSummary.objects.filter(pk=person_pk, version=version).update(
+            stale=False, refreshed_at=timezone.now(), **data
+        )
+    return data
+
+
+def mark_stale(**filters):
+    '''
+    Marks the stored summaries matching filters (all without) stale.
+    '''
+    # stale ones too: a summary being computed must not be stored
+    models.PersonSummary.objects.filter(**filters).update(stale=True, version=F("version") + 1)
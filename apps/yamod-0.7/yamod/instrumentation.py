@@ -0,0 +1,245 @@
+'''
+Per view request instrumentation (see middleware.InstrumentationMiddleware):
+the number of queries and the time spent in SQL, in Python and in
+rendering the response of every request.
+
+The timings are sent back as a Server-Timing header
+
+    Server-Timing: sql;dur=1.20;desc="3 queries", python;dur=4.10, render;dur=0.35, total;dur=5.65
+
+and collected per view (e.g. "GenreViewSet.list") in in-process
+histograms, scraped from GET /metrics/ (JSON) or /metrics/prometheus/.
+
+Query budgets: YAMOD_QUERY_BUDGETS maps view names to the maximum
+number of queries of one request ("*" for all other views), or to
+(queries, queries per batch) for views writing in batches (see
+count_batches). A request over budget is logged to the "yamod.queries"
+logger with its first statements, or raises QueryBudgetExceeded with
+YAMOD_QUERY_BUDGET_ACTION = "raise" (the tests run with it).
+'''
+import bisect
+import contextvars
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger("yamod.queries")
+
+# upper bounds, in ms for the timings
+TIME_BUCKETS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+# the statements of a request over budget in the message, shortened
+LOGGED_STATEMENTS = 20
+LOGGED_STATEMENT_LENGTH = 500
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryRecorder:
+    '''
+    Counts the queries and their time between start() and stop() in
+    the current context (request), works without DEBUG.
+
+    Under ASGI the connections of the thread shared by sync_to_async
+    run the queries of all concurrent requests, so every connection
+    has a single execute wrapper (record_query) that passes a query to
+    the recorder of the context it runs in.
+    '''
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = []
+        self.batches = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.statements.append(sql)
+
+    def start(self):
+        # the connections of other threads get the wrapper on connect
+        for alias in connections:
+            install(connections[alias])
+        _recorder.set(self)
+
+    def stop(self):
+        if _recorder.get() is self:
+            _recorder.set(None)
+
+
+_recorder = contextvars.ContextVar("yamod_query_recorder", default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    recorder = _recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+def count_batches(batches):
+    '''
+    Adds batches to the query budget of the current request.
+    '''
+    recorder = _recorder.get()
+    if recorder is not None:
+        recorder.batches += batches
+
+
+def install(connection):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@receiver(connection_created)
+def connection_opened(sender, connection, **kwargs):
+    install(connection)
+
+
+class Histogram:
+    '''
+    Cumulative histogram (like Prometheus): count, sum and the number
+    of observations less or equal to every bucket bound.
+    '''
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self):
+        cumulative, total = {}, 0
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            total += count
+            cumulative[str(bound)] = total
+        return {"count": self.count, "sum": round(self.sum, 3), "buckets": cumulative}
+
+
+class RequestMetrics:
+    '''
+    Histograms per view: queries, sql, python, render and total (ms).
+    '''
+
+    KINDS = {
+        "queries": QUERY_BUCKETS,
+        "sql_ms": TIME_BUCKETS,
+        "python_ms": TIME_BUCKETS,
+        "render_ms": TIME_BUCKETS,
+        "total_ms": TIME_BUCKETS,
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def observe(self, view, **values):
+        with self._lock:
+            histograms = self._views.get(view)
+            if histograms is None:
+                histograms = self._views[view] = {
+                    kind: Histogram(buckets) for kind, buckets in self.KINDS.items()
+                }
+            for kind, value in values.items():
+                histograms[kind].observe(value)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                view: {kind: histogram.snapshot() for kind, histogram in histograms.items()}
+                for view, histograms in self._views.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+
+    def prometheus(self):
+        '''
+        The histograms in the Prometheus text format.
+        '''
+        lines = []
+        snapshot = self.snapshot()
+        for kind in self.KINDS:
+            metric = "yamod_request_%s" % kind
+            lines.append("# TYPE %s histogram" % metric)
+            for view, histograms in sorted(snapshot.items()):
+                histogram = histograms[kind]
+                for bound, count in histogram["buckets"].items():
+                    lines.append('%s_bucket{view="%s",le="%s"} %d' % (metric, view, bound, count))
+                lines.append('%s_sum{view="%s"} %s' % (metric, view, histogram["sum"]))
+                lines.append('%s_count{view="%s"} %d' % (metric, view, histogram["count"]))
+        return "\n".join(lines) + "\n"
+
+
+metrics = RequestMetrics()
+
+
+def view_name(view_func, method):
+    '''
+    "GenreViewSet.list" for viewset actions, the function name otherwise.
+    '''
+    cls = getattr(view_func, "cls", None)
+    actions = getattr(view_func, "actions", None)
+    if cls is not None and actions:
+        return "%s.%s" % (cls.__name__, actions.get(method.lower(), method.lower()))
+    if cls is not None:
+        return cls.__name__
+    return getattr(view_func, "__qualname__", view_func.__name__)
+
+
+def query_budget(view, batches=0):
+    budgets = getattr(settings, "YAMOD_QUERY_BUDGETS", {})
+    budget = budgets.get(view, budgets.get("*"))
+    if isinstance(budget, (tuple, list)):
+        queries, per_batch = budget
+        return queries + per_batch * batches
+    return budget
+
+
+def shorten(statement):
+    if len(statement) <= LOGGED_STATEMENT_LENGTH:
+        return statement
+    return "%s... (%d characters)" % (statement[:LOGGED_STATEMENT_LENGTH], len(statement))
+
+
+def check_budget(view, recorder):
+    budget = query_budget(view, recorder.batches)
+    if budget is None or recorder.count <= budget:
+        return
+    statements = [shorten(statement) for statement in recorder.statements[:LOGGED_STATEMENTS]]
+    if recorder.count > LOGGED_STATEMENTS:
+        statements.append("... (%d more)" % (recorder.count - LOGGED_STATEMENTS))
+    message = "%s ran %d queries (budget: %d):\n%s" % (
+        view, recorder.count, budget, "\n".join(statements))
+    if getattr(settings, "YAMOD_QUERY_BUDGET_ACTION", "log") == "raise":
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+
+
+def server_timing(queries, sql, python, render, total):
+    return ", ".join([
+        'sql;dur=%.2f;desc="%d queries"' % (sql, queries),
+        "python;dur=%.2f" % python,
+        "render;dur=%.2f" % render,
+        "total;dur=%.2f" % total,
+    ])
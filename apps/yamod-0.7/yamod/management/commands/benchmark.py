@@ -0,0 +1,104 @@
+import datetime
+import json
+import platform
+import subprocess
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (
+    setup_databases, setup_test_environment,
+    teardown_databases, teardown_test_environment,
+)
+
+from yamod.benchmarks import BENCHMARKS, SCALES, SUITE, compare
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = "Runs the yamod performance benchmarks against a throw-away test database."
+
+    def add_arguments(self, parser):
+        parser.add_argument("names", nargs="*", help="Benchmarks to run (default: all)")
+        parser.add_argument("--suite", action="store_true",
+                            help="Run the suite: %s" % ", ".join(SUITE))
+        parser.add_argument("--rows", type=int, help="Number of rows (default: per benchmark)")
+        parser.add_argument("--scale", choices=SCALES, help="Number of rows: %s" % ", ".join(
+            "%s=%d" % item for item in SCALES.items()))
+        parser.add_argument("--repeat", type=int, help="Repetitions per measurement (default: 5)")
+        parser.add_argument("--json", metavar="FILE", help="Write the results as JSON to FILE")
+        parser.add_argument("--compare", metavar="FILE",
+                            help="Fail if a timing is slower than in the results in FILE (see --json)")
+        parser.add_argument("--threshold", type=float, default=0.2,
+                            help="Slowdown reported by --compare (default: 0.2, i.e. 20%%)")
+
+    def handle(self, *args, **options):
+        names = list(options["names"]) + (list(SUITE) if options["suite"] else [])
+        unknown = set(names) - set(BENCHMARKS)
+        if unknown:
+            raise CommandError("Unknown benchmark(s): %s" % ", ".join(sorted(unknown)))
+        if options["rows"] is not None and options["scale"] is not None:
+            raise CommandError("Use either --rows or --scale.")
+        if options["scale"] is not None:
+            options["rows"] = SCALES[options["scale"]]
+        baseline = None
+        if options["compare"]:
+            with open(options["compare"]) as file:
+                baseline = json.load(file)["results"]
+
+        results = []
+
+        def report(name, **metrics):
+            results.append({"benchmark": name, "metrics": metrics})
+            self.stdout.write("%-12s %s" % (name, "  ".join(
+                "%s=%.2fms" % (key, value * 1000) if isinstance(value, float)
+                else "%s=%s" % (key, value)
+                for key, value in metrics.items()
+            )))
+
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False, aliases={"default"})
+        try:
+            kwargs = {
+                key: options[key] for key in ("rows", "repeat") if options[key] is not None
+            }
+            for name in dict.fromkeys(names or BENCHMARKS):
+                BENCHMARKS[name](report, **kwargs)
+            database = "%s %s" % (connection.vendor, ".".join(map(str, connection.Database.sqlite_version_info))
+                                  if connection.vendor == "sqlite" else connection.Database.__version__)
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        if options["json"]:
+            # timings in seconds
+            with open(options["json"], "w") as file:
+                json.dump({
+                    "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                    "commit": git_commit(),
+                    "python": platform.python_version(),
+                    "django": django.get_version(),
+                    "database": database,
+                    "options": kwargs,
+                    "results": results,
+                }, file, indent=1)
+        if baseline is not None:
+            regressions = compare(baseline, results, options["threshold"])
+            for name, labels, key, before, after in regressions:
+                change = "%.2fms -> %.2fms (%+.0f%%)" % (
+                    before * 1000, after * 1000, (after / before - 1) * 100
+                ) if isinstance(after, float) else "%s -> %s" % (before, after)
+                self.stderr.write("%-12s %s  %s: %s" % (
+                    name, "  ".join("%s=%s" % item for item in labels.items()), key, change))
+            if regressions:
+                raise CommandError("%d regression(s): timings more than %.0f%% slower or more queries." % (
+                    len(regressions), options["threshold"] * 100))
+            self.stdout.write("No regressions against %s." % options["compare"])
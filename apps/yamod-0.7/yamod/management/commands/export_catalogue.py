@@ -0,0 +1,65 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from yamod import catalogue
+
+
+class Command(BaseCommand):
+    help = (
+        "Exports the catalogue tables (and the Movie.genre/Season.cast edge lists) "
+        "to one JSON lines or CSV file per table plus a manifest.json."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("directory", help="Output directory (created if missing)")
+        parser.add_argument("--format", choices=("jsonl", "csv"), default="jsonl")
+        parser.add_argument("--tables", help="Comma separated tables (default: all): %s" % ",".join(catalogue.EXPORTS))
+        parser.add_argument("--gzip", action="store_true", help="Compress the files")
+        parser.add_argument("--since-pk", type=int, help="Only rows with a larger primary key")
+        parser.add_argument("--since", metavar="MANIFEST",
+                            help="manifest.json of an earlier export: only rows added since (per table)")
+        parser.add_argument("--changed-since", metavar="DATETIME",
+                            help="Skip tables unchanged since DATETIME (ISO 8601, tables with change tracking only)")
+        parser.add_argument("--chunk-size", type=int, default=2000, help="Rows fetched per round trip")
+        parser.add_argument("--database", default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        names = options["tables"].split(",") if options["tables"] else list(catalogue.EXPORTS)
+        unknown = set(names) - set(catalogue.EXPORTS)
+        if unknown:
+            raise CommandError("Unknown table(s): %s" % ", ".join(sorted(unknown)))
+
+        since_pks = {}
+        if options["since"]:
+            with open(options["since"]) as file:
+                since_pks = {
+                    name: table["max_pk"] for name, table in json.load(file)["tables"].items()
+                    if table["max_pk"] is not None
+                }
+        if options["since_pk"] is not None:
+            since_pks = {name: max(since_pks.get(name, 0), options["since_pk"]) for name in names}
+
+        changed_since = None
+        if options["changed_since"]:
+            changed_since = parse_datetime(options["changed_since"])
+            if changed_since is None:
+                raise CommandError("Invalid datetime: %s" % options["changed_since"])
+            if timezone.is_naive(changed_since):
+                changed_since = timezone.make_aware(changed_since)
+
+        os.makedirs(options["directory"], exist_ok=True)
+        manifest = catalogue.export_catalogue(
+            options["directory"], names, format=options["format"], compress=options["gzip"],
+            since_pks=since_pks, changed_since=changed_since,
+            chunk_size=options["chunk_size"], using=options["database"],
+        )
+        with open(os.path.join(options["directory"], "manifest.json"), "w") as file:
+            json.dump(manifest, file, indent=2)
+        for name, table in manifest["tables"].items():
+            self.stdout.write("%s: %d rows" % (name, table["rows"]))
+        self.stdout.write(self.style.SUCCESS("Catalogue exported."))
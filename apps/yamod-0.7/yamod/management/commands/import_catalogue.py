@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, DatabaseError
+
+from yamod import catalogue
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports movies, people and roles from CSV/TSV/JSON lines files "
+        "(see yamod/catalogue.py). Re-running an interrupted import resumes it."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--movies", help="Movies file")
+        parser.add_argument("--people", help="People file")
+        parser.add_argument("--roles", help="Roles file (imported after movies and people)")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Objects per bulk_create")
+        parser.add_argument("--chunk-size", type=int, default=50000, help="Rows per transaction")
+        parser.add_argument("--database", default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        files = [(kind, options[kind]) for kind in ("people", "movies", "roles") if options[kind]]
+        if not files:
+            raise CommandError("Nothing to import, give --movies, --people and/or --roles.")
+        try:
+            for kind, path in files:
+                catalogue.file_format(path)
+        except ValueError as e:
+            raise CommandError(e)
+
+        def progress(kind, rows):
+            if options["verbosity"] > 1:
+                self.stdout.write("%s: %d rows committed" % (kind, rows))
+
+        importer = catalogue.CatalogueImporter(
+            batch_size=options["batch_size"], chunk_size=options["chunk_size"],
+            using=options["database"], progress=progress,
+        )
+        try:
+            for kind, path in files:
+                count = getattr(importer, "import_" + kind)(catalogue.read_rows(path))
+                self.stdout.write("%s: %d rows" % (kind, count))
+        except (KeyError, ValueError, DatabaseError) as e:
+            raise CommandError("Import failed (committed chunks are kept, re-run to resume): %r" % e)
+        finally:
+            importer.finish()
+        self.stdout.write(self.style.SUCCESS("Catalogue imported."))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from yamod import search
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the full text search index (SQLite FTS5) of yamod and its triggers."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        connection = connections[options["database"]]
+        if connection.vendor != "sqlite":
+            raise CommandError("The search index requires SQLite, other databases use LIKE queries.")
+        missing = search.is_available(connection) and search.missing_triggers(connection)
+        with transaction.atomic(using=options["database"]):
+            search.rebuild(connection)
+        if missing:
+            self.stdout.write("Missing triggers created: %s" % ", ".join(missing))
+        self.stdout.write(self.style.SUCCESS("Search index rebuilt."))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from yamod import counters
+
+
+class Command(BaseCommand):
+    help = "Recomputes the denormalised counters of yamod (movie_count, cast_count, ...) and their triggers."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--check", action="store_true",
+                            help="Only list wrong counters, fail if there are any")
+        parser.add_argument("--database", default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        using = options["database"]
+        wrong = counters.inconsistencies(using, limit=20)
+        for model, pk, field, stored, actual in wrong:
+            self.stdout.write("%s %s: %s is %s, should be %s" % (model, pk, field, stored, actual))
+        if options["check"]:
+            if wrong:
+                raise CommandError("Counters are inconsistent (at most 20 per counter listed).")
+            self.stdout.write(self.style.SUCCESS("Counters are consistent."))
+            return
+        with transaction.atomic(using=using):
+            connection = connections[using]
+            if connection.vendor == "sqlite":
+                with connection.cursor() as cursor:
+                    counters.create_triggers(cursor)
+            rows = counters.recount(using)
+        for (model, field), count in rows.items():
+            self.stdout.write("%s.%s: %d rows recounted" % (model, field, count))
+        self.stdout.write(self.style.SUCCESS("Counters recounted."))
@@ -0,0 +1,73 @@
+import asyncio
+import time
+
+from django.utils.decorators import sync_and_async_middleware
+from django.utils.deprecation import MiddlewareMixin
+
+from . import instrumentation
+from . import routers
+
+
+@sync_and_async_middleware
+def replica_pinning_middleware(get_response):
+    '''
+    Reads of a request go to the primary once it has written (see
+    routers.ReplicaRouter), the next request starts on the replicas.
+    Async capable, so async views (async_views.py) stay async.
+    '''
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            with routers.request_scope():
+                return await get_response(request)
+    else:
+        def middleware(request):
+            with routers.request_scope():
+                return get_response(request)
+    return middleware
+
+
+class InstrumentationMiddleware(MiddlewareMixin):
+    '''
+    Records queries, SQL, Python and render time of every request (see
+    instrumentation.py), adds the Server-Timing header and checks the
+    query budget of the view. Goes first in MIDDLEWARE, so the time
+    of the other middleware counts as Python time.
+    '''
+
+    def process_request(self, request):
+        recorder = instrumentation.QueryRecorder()
+        recorder.start()
+        request._yamod_instrumentation = {
+            "recorder": recorder,
+            "start": time.perf_counter(),
+            "view": None,
+            "render_start": None,
+        }
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._yamod_instrumentation["view"] = instrumentation.view_name(view_func, request.method)
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after this hook
+        request._yamod_instrumentation["render_start"] = time.perf_counter()
+        return response
+
+    def process_response(self, request, response):
+        state = getattr(request, "_yamod_instrumentation", None)
+        if state is None:
+            return response
+        end = time.perf_counter()
+        recorder = state["recorder"]
+        recorder.stop()
+        total = (end - state["start"]) * 1000
+        render = (end - state["render_start"]) * 1000 if state["render_start"] else 0.0
+        sql = recorder.duration * 1000
+        python = max(total - sql - render, 0.0)
+        response["Server-Timing"] = instrumentation.server_timing(recorder.count, sql, python, render, total)
+        if state["view"] is not None:
+            instrumentation.metrics.observe(
+                state["view"], queries=recorder.count, sql_ms=sql, python_ms=python,
+                render_ms=render, total_ms=total,
+            )
+            instrumentation.check_budget(state["view"], recorder)
+        return response
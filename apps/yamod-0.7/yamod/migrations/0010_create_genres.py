@@ -1,9 +1,8 @@
 from django.db import migrations
-from yamod import models
 
-def create_genres(apps,schema_editor):
-    for name in ["Action","Horror","Scifi","Drama","Comedy"]: 
-        models.Genre.objects.get_or_create(name=name)
+from yamod.seeding import Seed
+
+GENRES = ["Action","Horror","Scifi","Drama","Comedy"]
 
 class Migration(migrations.Migration):
 
@@ -12,5 +11,5 @@ class Migration(migrations.Migration):
     ]
 
     operations = [
-        migrations.RunPython(create_genres),
+        Seed("yamod", "Genre", [{"name": name} for name in GENRES], key=("name",)).operation(),
     ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.8 on 2026-10-18 12:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('yamod', '0012_tvshow_original_title'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='genre',
+            index=models.Index(fields=['name', 'id'], name='yamod_genre_name_id_idx'),
+        ),
+    ]
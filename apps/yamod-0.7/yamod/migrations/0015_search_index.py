@@ -0,0 +1,25 @@
+from django.db import migrations
+
+from yamod import search
+
+def create_search_index(apps, schema_editor):
+    # FTS5 is SQLite only, other databases use the LIKE fallback of search.py
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    search.rebuild(schema_editor.connection)
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    with schema_editor.connection.cursor() as cursor:
+        search.drop_index(cursor)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('yamod', '0014_tableversion'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.8 on 2026-10-18 13:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('yamod', '0015_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['released', 'id'], name='yamod_movie_released_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['runtime', 'id'], name='yamod_movie_runtime_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['movie_title', 'id'], name='yamod_movie_title_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='role',
+            index=models.Index(fields=['movie', 'role', 'person'], name='yamod_role_movie_role_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tvshow',
+            index=models.Index(fields=['released_year'], name='yamod_tvshow_released_idx'),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('yamod', '0016_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='genre',
+            name='name_key',
+            field=models.CharField(editable=False, max_length=1024, null=True),
+        ),
+    ]
@@ -0,0 +1,58 @@
+from collections import defaultdict
+
+from django.db import migrations
+
+def normalize(name):
+    # same as models.Genre.normalize
+    return " ".join(name.split()).casefold()
+
+def merge_duplicate_genres(apps, schema_editor):
+    '''
+    Sets the normalized name of every genre. Genres whose names only
+    differ in case or whitespace are merged into the oldest of them,
+    the movies of the others are moved over.
+    '''
+    Genre = apps.get_model("yamod", "Genre")
+    MovieGenre = apps.get_model("yamod", "Movie")._meta.get_field("genre").remote_field.through
+    # the database being migrated, not the one a router would choose
+    genres = Genre.objects.using(schema_editor.connection.alias)
+    links = MovieGenre.objects.using(schema_editor.connection.alias)
+
+    groups = defaultdict(list)
+    for pk, name in genres.order_by("pk").values_list("pk", "name").iterator():
+        groups[normalize(name)].append(pk)
+
+    duplicates = {}
+    for pks in groups.values():
+        for pk in pks[1:]:
+            duplicates[pk] = pks[0]
+    if duplicates:
+        existing = set(links.filter(genre_id__in=set(duplicates.values())).values_list(
+            "movie_id", "genre_id"))
+        moved = set()
+        for movie_id, genre_id in links.filter(genre_id__in=duplicates).values_list(
+                "movie_id", "genre_id").iterator():
+            link = (movie_id, duplicates[genre_id])
+            if link not in existing:
+                moved.add(link)
+        links.bulk_create(
+            [MovieGenre(movie_id=movie_id, genre_id=genre_id) for movie_id, genre_id in moved],
+            batch_size=500
+        )
+        links.filter(genre_id__in=duplicates).delete()
+        genres.filter(pk__in=duplicates).delete()
+
+    updated = list(genres.only("pk", "name"))
+    for genre in updated:
+        genre.name_key = normalize(genre.name)
+    genres.bulk_update(updated, ["name_key"], batch_size=500)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('yamod', '0017_genre_name_key'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_genres, migrations.RunPython.noop),
+    ]
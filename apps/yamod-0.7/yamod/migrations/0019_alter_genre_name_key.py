@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('yamod', '0018_merge_duplicate_genres'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='genre',
+            name='name_key',
+            field=models.CharField(editable=False, max_length=1024, unique=True),
+        ),
+    ]
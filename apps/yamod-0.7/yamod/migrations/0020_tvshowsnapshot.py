@@ -0,0 +1,22 @@
+# Generated by Django 3.2.8 on 2026-10-18 13:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('yamod', '0019_alter_genre_name_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TVShowSnapshot',
+            fields=[
+                ('tv_show', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='yamod.tvshow')),
+                ('data', models.JSONField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 3.2.8 on 2026-10-18 13:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('yamod', '0020_tvshowsnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PersonSummary',
+            fields=[
+                ('person', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='yamod.person')),
+                ('movies', models.IntegerField()),
+                ('first_year', models.IntegerField(null=True)),
+                ('last_year', models.IntegerField(null=True)),
+                ('roles', models.JSONField()),
+                ('stale', models.BooleanField(default=False)),
+                ('refreshed_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 3.2.8 on 2026-10-18 14:00
+
+from django.db import migrations, models
+
+from yamod import counters, search
+
+
+def create_search_triggers(apps, schema_editor):
+    # adding and removing the columns rebuilds yamod_movie and yamod_tvshow
+    # on SQLite, which drops their search triggers
+    if schema_editor.connection.vendor == "sqlite" and search.is_available(schema_editor.connection):
+        with schema_editor.connection.cursor() as cursor:
+            search.create_triggers(cursor)
+
+
+def create_counters(apps, schema_editor):
+    # the SQLite triggers are created after the last migration
+    # (counters.create_after_migrate): later ones may rebuild tables
+    counters.recount(schema_editor.connection.alias, apps)
+    create_search_triggers(apps, schema_editor)
+
+
+def drop_counters(apps, schema_editor):
+    if schema_editor.connection.vendor == "sqlite":
+        with schema_editor.connection.cursor() as cursor:
+            counters.drop_triggers(cursor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('yamod', '0021_personsummary'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, create_search_triggers),
+        migrations.AddField(
+            model_name='genre',
+            name='movie_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='cast_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='season',
+            name='episode_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='tvshow',
+            name='episode_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='tvshow',
+            name='season_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(create_counters, drop_counters),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.8 on 2026-10-18 14:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('yamod', '0022_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='person',
+            index=models.Index(fields=['gender', 'id'], name='yamod_person_gender_id_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.8 on 2026-10-18 15:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('yamod', '0023_person_gender_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='personsummary',
+            name='version',
+            field=models.IntegerField(default=0),
+        ),
+    ]
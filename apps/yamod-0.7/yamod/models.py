@@ -1,16 +1,82 @@
 from django.db import models
 
-class Genre(models.Model):
+class CounterMixin:
+    '''
+    Models with counter columns maintained by the database (see
+    counters.py): saving an existing row does not write them back,
+    unless named in update_fields. A row deleted elsewhere is inserted
+    again by save() as usual, with its counters reset.
+    '''
+
+    counter_fields = ()
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        if update_fields is None:
+            values = [value for value in values if value[0].name not in self.counter_fields]
+        updated = super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
+        if not updated and not forced_update:
+            # inserted next: the counted rows went with the deleted one
+            for name in self.counter_fields:
+                setattr(self, name, self._meta.get_field(name).get_default())
+        return updated
+
+class GenreQuerySet(models.QuerySet):
+
+    def named(self, name):
+        # case and whitespace insensitive, see Genre.normalize
+        return self.filter(name_key=Genre.normalize(name))
+
+    def get_or_create_named(self, name):
+        return self.get_or_create(name_key=Genre.normalize(name), defaults={"name": name})
+
+class Genre(CounterMixin, models.Model):
+
+    objects = GenreQuerySet.as_manager()
+    counter_fields = ("movie_count",)
 
     name = models.CharField(max_length=1024)
+    # normalized name (see Genre.normalize), unique: lookups by name
+    # and get_or_create are a single probe of its index
+    name_key = models.CharField(max_length=1024,unique=True,editable=False)
+    # counters.py
+    movie_count = models.IntegerField(default=0,editable=False)
+
+    class Meta:
+        indexes = [
+            # keyset pagination ordered by name (see pagination.py)
+            models.Index(fields=["name", "id"], name="yamod_genre_name_id_idx"),
+        ]
+
+    @staticmethod
+    def normalize(name):
+        return " ".join(name.split()).casefold()
+
+    def save(self, *args, **kwargs):
+        self.name_key = self.normalize(self.name)
+        if kwargs.get("update_fields") is not None and "name" in kwargs["update_fields"]:
+            kwargs["update_fields"] = {*kwargs["update_fields"], "name_key"}
+        super().save(*args, **kwargs)
     
-class Movie(models.Model):
+class Movie(CounterMixin, models.Model):
+
+    counter_fields = ("cast_count",)
 
     movie_title = models.CharField(max_length=1024)
     original_title = models.CharField(max_length=1024,null=True)
     released = models.DateField()
     runtime = models.IntegerField(default=90,help_text="in minutes")
     genre = models.ManyToManyField(Genre)
+    # people with a role in the movie (counters.py)
+    cast_count = models.IntegerField(default=0,editable=False)
+
+    class Meta:
+        indexes = [
+            # released/runtime range filters and keyset pagination
+            # (see pagination.py) by released, runtime and title
+            models.Index(fields=["released", "id"], name="yamod_movie_released_id_idx"),
+            models.Index(fields=["runtime", "id"], name="yamod_movie_runtime_id_idx"),
+            models.Index(fields=["movie_title", "id"], name="yamod_movie_title_id_idx"),
+        ]
 
     def __str__(self):
         return self.movie_title
@@ -29,6 +95,12 @@ class Person(models.Model):
     participates_in = models.ManyToManyField(Movie,through="Role")
     gender = models.CharField(max_length=1,choices=GENDER_CHOICES)
 
+    class Meta:
+        indexes = [
+            # the admin gender filter (see admin.GenderFilter), ordered by pk
+            models.Index(fields=["gender", "id"], name="yamod_person_gender_id_idx"),
+        ]
+
     def __str__(self):
         return self.credited_name
 
@@ -44,19 +116,38 @@ class Role(models.Model):
 
     class Meta:
         unique_together = ('person','movie','role')
+        indexes = [
+            # covers the cast of a movie (movie -> role, person)
+            # without reading the table
+            models.Index(fields=["movie", "role", "person"], name="yamod_role_movie_role_idx"),
+        ]
+
+class TVShow(CounterMixin, models.Model):
 
-class TVShow(models.Model):
+    counter_fields = ("season_count", "episode_count")
 
     name = models.CharField(max_length=1024)
     original_title = models.CharField(max_length=1024,null=True)
     released_year = models.IntegerField()
     created_by = models.ForeignKey(Person,on_delete=models.PROTECT,null=True)
+    # counters.py
+    season_count = models.IntegerField(default=0,editable=False)
+    episode_count = models.IntegerField(default=0,editable=False)
 
-class Season(models.Model):
+    class Meta:
+        indexes = [
+            models.Index(fields=["released_year"], name="yamod_tvshow_released_idx"),
+        ]
+
+class Season(CounterMixin, models.Model):
+
+    counter_fields = ("episode_count",)
 
     season_no = models.IntegerField()
     tv_show = models.ForeignKey(TVShow, on_delete=models.PROTECT)
     cast = models.ManyToManyField(Person)
+    # counters.py
+    episode_count = models.IntegerField(default=0,editable=False)
 
     class Meta:
         unique_together = ("season_no","tv_show")
@@ -66,3 +157,41 @@ class Episode(models.Model):
 
     name = models.CharField(max_length=1024)
     season = models.ForeignKey(Season,on_delete=models.PROTECT)
+
+class TVShowSnapshot(models.Model):
+    '''
+    The tree of a show (seasons, episodes, cast) as served by
+    GET /tvshows/<pk>/?snapshot=1, rebuilt when the show or one of
+    its children changes (see tvshows.py)
+    '''
+
+    tv_show = models.OneToOneField(TVShow, on_delete=models.CASCADE, primary_key=True)
+    data = models.JSONField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+class PersonSummary(models.Model):
+    '''
+    The filmography aggregates of a frequently requested person (see
+    filmography.py): marked stale when their roles or movies change
+    and recomputed by the next request
+    '''
+
+    person = models.OneToOneField(Person, on_delete=models.CASCADE, primary_key=True)
+    movies = models.IntegerField()
+    first_year = models.IntegerField(null=True)
+    last_year = models.IntegerField(null=True)
+    roles = models.JSONField()
+    stale = models.BooleanField(default=False)
+    # counts the changes marking it stale
+    version = models.IntegerField(default=0)
+    refreshed_at = models.DateTimeField(auto_now=True)
+
+class TableVersion(models.Model):
+    '''
+    Change counter per table, bumped by the model signals (signals.py)
+    and used for the ETag/Last-Modified headers of the API (conditional.py)
+    '''
+
+    table = models.CharField(max_length=255,unique=True)
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
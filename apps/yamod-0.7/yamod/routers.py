@@ -0,0 +1,95 @@
+'''
+Read replica routing for the yamod app:
+
+    DATABASE_ROUTERS = ["yamod.routers.ReplicaRouter"]
+    YAMOD_PRIMARY_DATABASE = "default"
+    YAMOD_REPLICA_DATABASES = ["replica"]
+
+Writes go to the primary, reads to a random replica - unless the
+current request (see middleware.replica_pinning_middleware) has written
+already or a transaction is open on the primary: then reads stay on
+the primary, so a request always sees its own writes. Results stored
+in the shared cache are read from the primary as well (reading_primary):
+a lagging replica would store rows older than the invalidation of a
+write. Replicas are copies of the primary and never migrated.
+'''
+import contextvars
+import random
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+_pinned = contextvars.ContextVar("yamod_pinned_to_primary", default=False)
+
+
+def primary():
+    return getattr(settings, "YAMOD_PRIMARY_DATABASE", DEFAULT_DB_ALIAS)
+
+
+def replicas():
+    return getattr(settings, "YAMOD_REPLICA_DATABASES", [])
+
+
+def is_pinned():
+    return _pinned.get()
+
+
+def pin_to_primary():
+    _pinned.set(True)
+
+
+@contextmanager
+def request_scope():
+    '''
+    Scope of the read-your-writes pinning: reads go to the replicas
+    again after it.
+    '''
+    token = _pinned.set(False)
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+
+@contextmanager
+def reading_primary():
+    '''
+    Reads go to the primary within, like after a write.
+    '''
+    token = _pinned.set(True)
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+
+class ReplicaRouter:
+
+    app_labels = {"yamod"}
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label not in self.app_labels:
+            return None
+        aliases = replicas()
+        if not aliases or _pinned.get() or connections[primary()].in_atomic_block:
+            return primary()
+        return random.choice(aliases)
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label not in self.app_labels:
+            return None
+        pin_to_primary()
+        return primary()
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # all aliases hold the same data
+        aliases = {primary(), *replicas()}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in replicas():
+            return False
+        return None
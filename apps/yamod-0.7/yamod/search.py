@@ -0,0 +1,191 @@
+'''
+Full text search over movies, people, TV shows and episodes.
+
+On SQLite the titles live in the FTS5 table "yamod_search", kept in
+sync by triggers on the source tables (so bulk_create and queryset
+updates are covered as well). The rowid of an entry is
+<object id> * 4 + <kind code>, which makes the triggers' deletes
+rowid lookups. Other databases fall back to LIKE queries.
+
+On SQLite Django rebuilds a table for most schema changes, which drops
+its triggers: after migrate missing triggers are created again and the
+index is rebuilt (create_after_migrate).
+'''
+import re
+
+from django.apps import apps
+from django.db import connection as default_connection, connections, router
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+# kind: (code, model, table, title column, original title column). Plain
+# names instead of model classes, so migrations can use this module.
+SOURCES = {
+    "movie": (0, "Movie", "yamod_movie", "movie_title", "original_title"),
+    "person": (1, "Person", "yamod_person", "credited_name", None),
+    "tvshow": (2, "TVShow", "yamod_tvshow", "name", "original_title"),
+    "episode": (3, "Episode", "yamod_episode", "name", None),
+}
+KINDS = {source[0]: kind for kind, source in SOURCES.items()}
+
+
+def _sources():
+    for kind, (code, model, table, title, original_title) in SOURCES.items():
+        yield code, table, title, original_title
+
+
+def is_available(connection=None):
+    connection = connection or default_connection
+    if connection.vendor != "sqlite":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'yamod_search'")
+        return cursor.fetchone() is not None
+
+
+def create_triggers(cursor):
+    for code, table, title, original_title in _sources():
+        insert = (
+            "INSERT INTO yamod_search(rowid, title, original_title) VALUES (new.id * 4 + %d, new.%s, %s);"
+            % (code, title, "new." + original_title if original_title else "NULL")
+        )
+        delete = "DELETE FROM yamod_search WHERE rowid = old.id * 4 + %d;" % code
+        columns = ", ".join(column for column in (title, original_title) if column)
+        cursor.execute("CREATE TRIGGER IF NOT EXISTS %s_search_insert AFTER INSERT ON %s BEGIN %s END"
+                       % (table, table, insert))
+        cursor.execute("CREATE TRIGGER IF NOT EXISTS %s_search_update AFTER UPDATE OF %s ON %s BEGIN %s %s END"
+                       % (table, columns, table, delete, insert))
+        cursor.execute("CREATE TRIGGER IF NOT EXISTS %s_search_delete AFTER DELETE ON %s BEGIN %s END"
+                       % (table, table, delete))
+
+
+def drop_triggers(cursor):
+    for name in trigger_names():
+        cursor.execute("DROP TRIGGER IF EXISTS %s" % name)
+
+
+def trigger_names():
+    for code, table, title, original_title in _sources():
+        for action in ("insert", "update", "delete"):
+            yield "%s_search_%s" % (table, action)
+
+
+def missing_triggers(connection=None):
+    connection = connection or default_connection
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")
+        existing = {name for name, in cursor.fetchall()}
+    return [name for name in trigger_names() if name not in existing]
+
+
+def create_after_migrate(sender, using, **kwargs):
+    '''
+    post_migrate receiver: rebuilds the index if a migration dropped
+    triggers, rows changed without them are missing from it.
+    '''
+    connection = connections[using]
+    if is_available(connection) and missing_triggers(connection):
+        rebuild(connection)
+
+
+def create_index(cursor):
+    cursor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS yamod_search USING fts5("
+        "title, original_title, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+    )
+    create_triggers(cursor)
+
+
+def drop_index(cursor):
+    drop_triggers(cursor)
+    cursor.execute("DROP TABLE IF EXISTS yamod_search")
+
+
+def rebuild(connection=None):
+    '''
+    Re-creates the search index (and its triggers) from the source tables.
+    '''
+    connection = connection or default_connection
+    with connection.cursor() as cursor:
+        create_index(cursor)
+        cursor.execute("DELETE FROM yamod_search")
+        for code, table, title, original_title in _sources():
+            cursor.execute(
+                "INSERT INTO yamod_search(rowid, title, original_title) SELECT id * 4 + %d, %s, %s FROM %s"
+                % (code, title, original_title or "NULL", table)
+            )
+        cursor.execute("INSERT INTO yamod_search(yamod_search) VALUES ('optimize')")
+
+
+def match_expression(q):
+    '''
+    Turns user input into an FTS5 query: every word is quoted (so no
+    FTS syntax is interpreted) and matched as prefix.
+    '''
+    return " ".join('"%s"*' % term for term in re.findall(r"\w+", q))
+
+
+def search(q, kinds=None, limit=20, connection=None):
+    '''
+    Returns up to limit matches as dicts with kind, id, title and
+    original_title, the best matches first.
+    '''
+    # routed like the source tables, e.g. to a read replica (routers.py)
+    connection = connection or connections[router.db_for_read(apps.get_model("yamod", "Movie"))]
+    kinds = kinds or list(SOURCES)
+    expression = match_expression(q)
+    if not expression:
+        return []
+    if not is_available(connection):
+        return _search_like(q, kinds, limit)
+    codes = [SOURCES[kind][0] for kind in kinds]
+    with connection.cursor() as cursor:
+        # bm25 weights: title matches rank above original title matches
+        cursor.execute(
+            "SELECT rowid, title, original_title FROM yamod_search "
+            "WHERE yamod_search MATCH %s AND rowid %% 4 IN (" + ", ".join(["%s"] * len(codes)) + ") "
+            "ORDER BY bm25(yamod_search, 1.0, 0.5) LIMIT %s",
+            [expression, *codes, limit]
+        )
+        return [
+            {"kind": KINDS[rowid % 4], "id": rowid // 4, "title": title, "original_title": original_title}
+            for rowid, title, original_title in cursor.fetchall()
+        ]
+
+
+def filter_matches(queryset, kind, q):
+    '''
+    Restricts a queryset of the model of kind to the rows search()
+    would find for q, unranked and unlimited: an index lookup on
+    SQLite, LIKE queries elsewhere.
+    '''
+    expression = match_expression(q)
+    if not expression:
+        return queryset
+    code, model, table, title, original_title = SOURCES[kind]
+    if is_available(connections[queryset.db]):
+        return queryset.filter(pk__in=RawSQL(
+            "SELECT rowid / 4 FROM yamod_search WHERE yamod_search MATCH %s AND rowid %% 4 = %s",
+            (expression, code)
+        ))
+    condition = Q(**{title + "__icontains": q})
+    if original_title:
+        condition |= Q(**{original_title + "__icontains": q})
+    return queryset.filter(condition)
+
+
+def _search_like(q, kinds, limit):
+    results = []
+    for kind in kinds:
+        code, model, table, title, original_title = SOURCES[kind]
+        fields = [title] + ([original_title] if original_title else [])
+        queryset = apps.get_model("yamod", model).objects.filter(
+            **{title + "__icontains": q}).values_list("pk", *fields)
+        for row in queryset[:limit - len(results)]:
+            results.append({
+                "kind": kind, "id": row[0], "title": row[1],
+                "original_title": row[2] if original_title else None,
+            })
+        if len(results) >= limit:
+            break
+    return results
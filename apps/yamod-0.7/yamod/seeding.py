@@ -0,0 +1,105 @@
+'''
+Seed data for data migrations.
+
+    from yamod.seeding import Seed
+
+    operations = [
+        Seed("yamod", "Genre", [{"name": "Action"}, ...], key=("name",)).operation(),
+    ]
+
+Seeding always goes through the historical model of the migration, so
+it neither depends on fields added later nor fires signal receivers.
+The keys already in the table are read with one query, only the
+missing rows are inserted, with bulk_create in batches. Running it
+again inserts nothing, so a seed can be extended by a later migration
+with the full list. Rows may be a callable returning an iterable (e.g.
+a generator reading a file), which is consumed batch by batch - only
+the existing keys and one batch are held in memory.
+'''
+import itertools
+
+from django.db import migrations
+
+BATCH_SIZE = 1000
+
+
+def batches(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def seed(model, rows, key, using="default", batch_size=BATCH_SIZE):
+    '''
+    Inserts the rows (dicts of field values) whose key fields are not
+    in the table yet and returns the number of inserted rows.
+    '''
+    manager = model._base_manager.db_manager(using)
+    existing = set(manager.values_list(*key).iterator(chunk_size=10000))
+    created = 0
+    for batch in batches(rows, batch_size):
+        objects = []
+        for row in batch:
+            row_key = tuple(row[field] for field in key)
+            # also skips duplicates within the seed data
+            if row_key not in existing:
+                existing.add(row_key)
+                objects.append(model(**row))
+        # ignore_conflicts: rows inserted concurrently (or keys that differ
+        # only where a unique index is less strict) are skipped, not fatal
+        manager.bulk_create(objects, ignore_conflicts=True)
+        created += len(objects)
+    return created
+
+
+def unseed(model, rows, key, using="default", batch_size=BATCH_SIZE):
+    '''
+    Deletes the rows with the key fields of the seed data.
+    '''
+    manager = model._base_manager.db_manager(using)
+    deleted = 0
+    for batch in batches(rows, batch_size):
+        if len(key) == 1:
+            queryset = manager.filter(**{key[0] + "__in": [row[key[0]] for row in batch]})
+        else:
+            queryset = manager.none()
+            for row in batch:
+                queryset = queryset | manager.filter(**{field: row[field] for field in key})
+        deleted += queryset.delete()[0]
+    return deleted
+
+
+class Seed:
+    '''
+    A seed for one model: rows is a list of dicts or a callable returning
+    an iterable of them, key the fields identifying a row.
+    '''
+
+    def __init__(self, app_label, model_name, rows, key, batch_size=BATCH_SIZE, reversible=False):
+        self.app_label = app_label
+        self.model_name = model_name
+        self.rows = rows
+        self.key = tuple(key)
+        self.batch_size = batch_size
+        self.reversible = reversible
+
+    def get_rows(self):
+        return self.rows() if callable(self.rows) else self.rows
+
+    def forwards(self, apps, schema_editor):
+        model = apps.get_model(self.app_label, self.model_name)
+        seed(model, self.get_rows(), self.key, schema_editor.connection.alias, self.batch_size)
+
+    def backwards(self, apps, schema_editor):
+        model = apps.get_model(self.app_label, self.model_name)
+        unseed(model, self.get_rows(), self.key, schema_editor.connection.alias, self.batch_size)
+
+    def operation(self):
+        # Seeded rows may be in use by the time the migration is reversed,
+        # so deleting them on the way back is opt-in
+        return migrations.RunPython(
+            self.forwards, self.backwards if self.reversible else migrations.RunPython.noop
+        )
@@ -0,0 +1,254 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.contrib.auth import get_user_model
+from django.db import connections, transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import authentication
+from . import autocomplete
+from . import cache
+from . import counters
+from . import filmography
+from . import models
+from . import tvshows
+from .conditional import bump_version
+
+_batch = ContextVar("yamod_invalidation_batch", default=None)
+
+
+@contextmanager
+def batched_invalidation():
+    '''
+    Collects the invalidations of all receivers below and runs them once
+    on exit, instead of once per saved or deleted row.
+    '''
+    batch = {"pks": set(), "names": set(), "models": set()}
+    token = _batch.set(batch)
+    try:
+        yield
+    finally:
+        _batch.reset(token)
+        if batch["pks"]:
+            cache.invalidate_genres(batch["pks"], batch["names"])
+        for model in batch["models"]:
+            bump_version(model)
+
+
+def invalidate(sender, pk, names):
+    batch = _batch.get()
+    if batch is None:
+        cache.invalidate_genre(pk, *names)
+        bump_version(sender)
+    else:
+        batch["pks"].add(pk)
+        batch["names"].update(names)
+        batch["models"].add(sender)
+
+
+@receiver(pre_save, sender=models.Genre)
+def remember_genre_name(sender, instance, raw, **kwargs):
+    # A renamed genre must also leave the lists filtered by its old name
+    instance._old_name = None
+    if instance.pk is not None and not raw:
+        instance._old_name = sender.objects.filter(pk=instance.pk).values_list(
+            "name", flat=True).first()
+
+
+@receiver(post_save, sender=models.Genre)
+def genre_saved(sender, instance, **kwargs):
+    names = {instance.name, getattr(instance, "_old_name", None)} - {None}
+    invalidate(sender, instance.pk, names)
+
+
+@receiver(post_delete, sender=models.Genre)
+def genre_deleted(sender, instance, **kwargs):
+    invalidate(sender, instance.pk, {instance.name})
+
+
+# Tables without cached responses only need their version bumped
+# for the ETags of the viewsets reading them (conditional.py)
+VERSIONED_MODELS = (models.Movie, models.Person, models.Role, models.RoleType,
+                    models.TVShow, models.Season, models.Episode)
+
+
+def table_changed(sender, **kwargs):
+    batch = _batch.get()
+    if batch is None:
+        bump_version(sender)
+    else:
+        batch["models"].add(sender)
+
+
+def m2m_table_changed(sender, action, **kwargs):
+    if action in ("post_add", "post_remove", "post_clear"):
+        table_changed(sender)
+
+
+for model in VERSIONED_MODELS:
+    post_save.connect(table_changed, sender=model, dispatch_uid="yamod_version_save_%s" % model.__name__)
+    post_delete.connect(table_changed, sender=model, dispatch_uid="yamod_version_delete_%s" % model.__name__)
+m2m_changed.connect(m2m_table_changed, sender=models.Movie.genre.through, dispatch_uid="yamod_version_movie_genre")
+m2m_changed.connect(m2m_table_changed, sender=models.Season.cast.through, dispatch_uid="yamod_version_season_cast")
+
+
+# Stored filmography aggregates (filmography.py) are recomputed on the next read
+@receiver(post_save, sender=models.Role)
+@receiver(post_delete, sender=models.Role)
+def role_changed(sender, instance, **kwargs):
+    filmography.mark_stale(pk=instance.person_id)
+
+
+@receiver(post_save, sender=models.Movie)
+def movie_saved(sender, instance, created, **kwargs):
+    # a new movie has no roles yet
+    if not created:
+        filmography.mark_stale(person__role__movie=instance.pk)
+
+
+@receiver(post_save, sender=models.RoleType)
+@receiver(post_delete, sender=models.RoleType)
+def role_type_changed(sender, instance, **kwargs):
+    filmography.mark_stale()
+
+
+# TV show snapshots (tvshows.py) are rebuilt after the commit
+@receiver(post_save, sender=models.TVShow)
+def tv_show_saved(sender, instance, **kwargs):
+    tvshows.schedule([instance.pk])
+
+
+@receiver(post_save, sender=models.Season)
+@receiver(post_delete, sender=models.Season)
+def season_changed(sender, instance, **kwargs):
+    tvshows.schedule([instance.tv_show_id])
+
+
+@receiver(post_save, sender=models.Episode)
+@receiver(post_delete, sender=models.Episode)
+def episode_changed(sender, instance, **kwargs):
+    tvshows.schedule(models.Season.objects.filter(pk=instance.season_id).values_list("tv_show_id", flat=True))
+
+
+@receiver(m2m_changed, sender=models.Season.cast.through)
+def season_cast_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            tvshows.schedule([instance.tv_show_id])
+    elif action == "pre_clear":
+        tvshows.schedule(list(tvshows.shows_of_person(instance.pk)))
+    elif action in ("post_add", "post_remove"):
+        tvshows.schedule(models.Season.objects.filter(pk__in=pk_set).values_list("tv_show_id", flat=True))
+
+
+@receiver(post_save, sender=models.Person)
+@receiver(pre_delete, sender=models.Person)
+def person_changed(sender, instance, **kwargs):
+    # the name of a creator or cast member; on delete the cast rows go
+    # without m2m_changed
+    tvshows.schedule(list(tvshows.shows_of_person(instance.pk)))
+
+
+# Counters (counters.py) are kept by triggers on SQLite, recounted here otherwise
+COUNTING_MODELS = (models.Role, models.Episode, models.Season)
+
+
+def maintains_counters(using):
+    return connections[using].vendor != "sqlite"
+
+
+def remember_counted(sender, instance, raw, using, **kwargs):
+    # the row may move to another counter
+    instance._old_counted = None
+    if instance.pk is not None and not raw and maintains_counters(using):
+        instance._old_counted = sender._base_manager.using(using).filter(pk=instance.pk).values_list(
+            counters.COUNTED_BY[sender.__name__][0], flat=True).first()
+
+
+def counted_changed(sender, instance, using, **kwargs):
+    if maintains_counters(using):
+        field = counters.COUNTED_BY[sender.__name__][0]
+        counters.recount_rows(sender.__name__, [getattr(instance, field), getattr(instance, "_old_counted", None)], using)
+
+
+for model in COUNTING_MODELS:
+    pre_save.connect(remember_counted, sender=model, dispatch_uid="yamod_counted_pre_save_%s" % model.__name__)
+    post_save.connect(counted_changed, sender=model, dispatch_uid="yamod_counted_save_%s" % model.__name__)
+    post_delete.connect(counted_changed, sender=model, dispatch_uid="yamod_counted_delete_%s" % model.__name__)
+
+
+@receiver(m2m_changed, sender=models.Movie.genre.through)
+def movie_genres_changed(sender, instance, action, reverse, pk_set, using, **kwargs):
+    if not maintains_counters(using):
+        return
+    if reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            counters.recount_rows("Movie_genre", [instance.pk], using)
+    elif action == "pre_clear":
+        instance._old_genres = list(instance.genre.values_list("pk", flat=True))
+    elif action == "post_clear":
+        counters.recount_rows("Movie_genre", instance._old_genres, using)
+    elif action in ("post_add", "post_remove"):
+        counters.recount_rows("Movie_genre", pk_set, using)
+
+
+@receiver(pre_delete, sender=models.Movie)
+def remember_movie_genres(sender, instance, using, **kwargs):
+    # the genre rows of a movie are deleted without m2m_changed
+    if maintains_counters(using):
+        instance._old_genres = list(instance.genre.values_list("pk", flat=True))
+
+
+@receiver(post_delete, sender=models.Movie)
+def movie_deleted(sender, instance, using, **kwargs):
+    if maintains_counters(using):
+        counters.recount_rows("Movie_genre", instance._old_genres, using)
+
+
+def remember_title(sender, instance, raw, **kwargs):
+    # The old title has to leave the autocomplete index on rename
+    instance._old_title = None
+    if instance.pk is not None and not raw and autocomplete.index.is_loaded:
+        field = autocomplete.SOURCES[autocomplete.MODEL_KINDS[sender]][1]
+        instance._old_title = sender.objects.filter(pk=instance.pk).values_list(
+            field, flat=True).first()
+
+
+def title_saved(sender, instance, created, **kwargs):
+    kind = autocomplete.MODEL_KINDS[sender]
+    title = getattr(instance, autocomplete.SOURCES[kind][1])
+    old_title = getattr(instance, "_old_title", None)
+
+    def update_index():
+        if old_title is not None:
+            autocomplete.index.remove(kind, instance.pk, old_title)
+        if created or old_title is not None:
+            autocomplete.index.add(kind, instance.pk, title)
+    transaction.on_commit(update_index)
+
+
+def title_deleted(sender, instance, **kwargs):
+    kind = autocomplete.MODEL_KINDS[sender]
+    title = getattr(instance, autocomplete.SOURCES[kind][1])
+    pk = instance.pk
+    transaction.on_commit(lambda: autocomplete.index.remove(kind, pk, title))
+
+
+for model in autocomplete.MODEL_KINDS:
+    pre_save.connect(remember_title, sender=model, dispatch_uid="yamod_autocomplete_pre_save_%s" % model.__name__)
+    post_save.connect(title_saved, sender=model, dispatch_uid="yamod_autocomplete_save_%s" % model.__name__)
+    post_delete.connect(title_deleted, sender=model, dispatch_uid="yamod_autocomplete_delete_%s" % model.__name__)
+
+
+def user_changed(sender, instance, **kwargs):
+    # Cached JWT principals (authentication.py) must not outlive a
+    # deactivation or a changed is_superuser flag. Dropped again after
+    # commit: a request in between may have cached the old row.
+    pk = instance.pk
+    authentication.tokens.invalidate_user(pk)
+    transaction.on_commit(lambda: authentication.tokens.invalidate_user(pk))
+
+
+post_save.connect(user_changed, sender=get_user_model(), dispatch_uid="yamod_jwt_user_save")
+post_delete.connect(user_changed, sender=get_user_model(), dispatch_uid="yamod_jwt_user_delete")
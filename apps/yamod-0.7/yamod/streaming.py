@@ -0,0 +1,77 @@
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import BaseRenderer
+
+NDJSON = "application/x-ndjson"
+
+
+class NDJSONRenderer(BaseRenderer):
+    '''
+    Renders a list as newline delimited JSON (one item per line). Needed so
+    DRF's content negotiation accepts "Accept: application/x-ndjson" - the
+    streamed bodies themselves are written by stream_response.
+    '''
+
+    media_type = NDJSON
+    format = "ndjson"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        items = data if isinstance(data, list) else [data]
+        return "".join(json.dumps(item, cls=DjangoJSONEncoder) + "\n" for item in items).encode("utf-8")
+
+
+def stream_format(request):
+    '''
+    Returns "ndjson" or "json" if the client asked for a streamed
+    list, None otherwise:
+
+    GET /genres/?stream=1                          -> chunked JSON array
+    GET /genres/?stream=ndjson                     -> NDJSON
+    GET /genres/ with Accept: application/x-ndjson -> NDJSON
+    '''
+    stream = request.GET.get("stream")
+    if stream == "ndjson" or NDJSON in request.META.get("HTTP_ACCEPT", ""):
+        return "ndjson"
+    if stream in ("1", "true", "json"):
+        return "json"
+    return None
+
+
+def _ndjson_chunks(rows, chunk_size):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(row, cls=DjangoJSONEncoder))
+        if len(lines) >= chunk_size:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+def _json_array_chunks(rows, chunk_size):
+    yield "["
+    separator = ""
+    for chunk in _ndjson_chunks(rows, chunk_size):
+        yield separator + chunk.rstrip("\n").replace("\n", ",")
+        separator = ","
+    yield "]"
+
+
+def stream_response(queryset, fields, stream="json", chunk_size=None):
+    '''
+    Streams the given fields of every row of the queryset. The rows are
+    fetched with values_list().iterator() in chunks and written as soon
+    as they are serialised, so neither the queryset nor the body is ever
+    held in memory as a whole.
+    '''
+    chunk_size = chunk_size or getattr(settings, "YAMOD_STREAM_CHUNK_SIZE", 2000)
+    rows = queryset.values_list(*fields).iterator(chunk_size=chunk_size)
+    if stream == "ndjson":
+        return StreamingHttpResponse(_ndjson_chunks(rows, chunk_size), content_type=NDJSON)
+    return StreamingHttpResponse(_json_array_chunks(rows, chunk_size), content_type="application/json")
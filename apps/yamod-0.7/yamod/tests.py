@@ -1,19 +1,69 @@
+import asyncio
+import csv
 import datetime
+import gzip
+import importlib
+import io
 import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from unittest import skipUnless
 
+from asgiref.sync import sync_to_async
+from django.apps import apps as django_apps
+from django.conf import settings
 from django.test import Client
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.management.sql import emit_post_migrate_signal, emit_pre_migrate_signal
+from django.contrib.admin.sites import site as admin_site
 from django.contrib.auth import get_user_model
-from django.db.models import Q
-from django.db.utils import IntegrityError
-from django.test import TestCase
+from django.db import connection, connections, router, transaction
+from django.db.models import Max, Q
+from django.db.utils import ConnectionHandler, IntegrityError
+from django.db.migrations.executor import MigrationExecutor
+from django.test import AsyncClient, RequestFactory, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
 
 from rest_framework.test import APIClient
 
+from . import admin
+from . import async_views
+from . import authentication
+from . import autocomplete
+from . import benchmarks
+from . import bulk
+from . import cache
+from . import catalogue
+from . import conditional
+from . import counters
+from . import filmography
+from . import instrumentation
 from . import models
+from . import routers
+from . import search
+from . import seeding
+from . import tvshows
+from .pagination import EstimatedCountPaginator, KeysetPaginator, encode_cursor, estimated_count
 
+# N+1 queries fail the tests (see instrumentation.py)
+@override_settings(YAMOD_QUERY_BUDGET_ACTION="raise")
 class YamodBaseTest(TestCase):
 
     def setUp(self):
+        # Responses are cached, start every test with an empty cache
+        # (and an autocomplete index loaded from the test's data, no
+        # cached JWTs or request metrics)
+        caches["default"].clear()
+        autocomplete.index.reset()
+        authentication.tokens.clear()
+        instrumentation.metrics.reset()
         self.genres=["Action","Horror","Scifi","Drama","Comedy"]
         self.movies = [
             ("Blade Runner", datetime.date(year=1982,month=6,day=25),"Scifi",100),
@@ -35,13 +85,35 @@ class YamodBaseTest(TestCase):
         for movie_title,released, genre,runtime in self.movies:
             models.Movie.objects.get(movie_title=movie_title).genre.add(models.Genre.objects.get(name=genre))
 
+    def get_token(self,is_superuser=False):
+        password="api_user"
+        # Create us an API user:
+        api_user , created = get_user_model().objects.get_or_create(
+            username="api_user",
+            is_active=True,
+            is_superuser=is_superuser
+        )
+        api_user.set_password(password)
+        api_user.save()
+        # Now, request a token for this user:
+        # for more details
+        client = APIClient()
+        # Provide credentials
+        response = client.post("/api-token-auth/",{"username":"api_user","password":password})
+        # Assure, we get a valid response
+        self.assertEqual(response.status_code,200)
+        # Extract token.
+        return response.json().get("token")
+
 
 class YamodModelTest(YamodBaseTest):
 
     def test_create_genre(self):
         # Create a new model instance for model "Genre" with name "Comedy"
         # YOUR CODE HERE:
-        genre = models.Genre.objects.create(name="Comedy")
+        # (Genre names are unique and "Comedy" already exists
+        # after setUp - see YamodGenreNameTest)
+        genre, created = models.Genre.objects.get_or_create_named("Comedy")
         # /ENDYOURCODE
         self.assertEqual(genre.name,"Comedy")
 
@@ -266,26 +338,6 @@ class MigrationTests(YamodBaseTest):
 
 class YamodGenreAPITest(YamodBaseTest):
 
-    def get_token(self,is_superuser=False):
-        password="api_user"
-        # Create us an API user:
-        api_user , created = get_user_model().objects.get_or_create(
-            username="api_user",
-            is_active=True,
-            is_superuser=is_superuser
-        )
-        api_user.set_password(password)
-        api_user.save()
-        # Now, request a token for this user:
-        # for more details
-        client = APIClient()
-        # Provide credentials
-        response = client.post("/api-token-auth/",{"username":"api_user","password":password})
-        # Assure, we get a valid response
-        self.assertEqual(response.status_code,200)
-        # Extract token.
-        return response.json().get("token")
-
     def test_list_genres(self):
         client = APIClient()
         client.credentials(HTTP_AUTHORIZATION="JWT %s" % self.get_token())
@@ -342,6 +394,17 @@ class YamodGenreAPITest(YamodBaseTest):
         # Should result in a HTTP 400 Bad request
         self.assertEquals(response.status_code,400)
 
+    def test_genre_name_not_a_string(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION="JWT %s" % self.get_token())
+        pk = models.Genre.objects.named("Drama").get().pk
+        for name in (5, None, ["Drama"]):
+            response = client.post("/genres/",{"name":name},format="json")
+            self.assertEquals(response.status_code,400)
+            response = client.put("/genres/%d/" % pk,{"name":name},format="json")
+            self.assertEquals(response.status_code,400)
+        self.assertEquals(models.Genre.objects.get(pk=pk).name,"Drama")
+
     def test_update_thriller_genre(self):
         client = APIClient()
         client.credentials(HTTP_AUTHORIZATION="JWT %s" % self.get_token())
@@ -385,3 +448,1920 @@ class YamodGenreAPITest(YamodBaseTest):
         response = client.delete("/genres/%s/" % thriller_id)
         # We expect a HTTP code 403 (FORBIDDEN) as we are not a superuser:
         self.assertEqual(response.status_code,403)                  
+
+
+class YamodGenrePaginationTest(YamodBaseTest):
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION="JWT %s" % self.get_token())
+
+    def fetch_all(self, order_by):
+        names, pages, cursor = [], 0, ""
+        while cursor is not None:
+            response = self.client.get("/genres/?order_by=%s&page_size=2&cursor=%s" % (order_by, cursor))
+            self.assertEqual(response.status_code,200)
+            results = response.json()
+            names += [name for pk, name in results["results"]]
+            pages += 1
+            cursor = results["next"]
+        return names, pages
+
+    def test_paginate_by_name(self):
+        names, pages = self.fetch_all("name")
+        self.assertEqual(names,["Action","Comedy","Drama","Horror","Scifi"])
+        self.assertEqual(pages,3)
+
+    def test_paginate_by_name_desc(self):
+        names, pages = self.fetch_all("-name")
+        self.assertEqual(names,["Scifi","Horror","Drama","Comedy","Action"])
+
+    def test_paginate_with_duplicate_keys(self):
+        # pk is the tie-breaker for equal keys (two movies run 100 minutes)
+        titles, cursor = [], ""
+        while cursor is not None:
+            response = self.client.get("/movies/?order_by=runtime&page_size=1&fields=runtime&cursor=%s" % cursor)
+            titles += [movie["id"] for movie in response.json()["results"]]
+            cursor = response.json()["next"]
+        self.assertEqual(titles,list(models.Movie.objects.order_by("runtime","pk").values_list("pk",flat=True)))
+
+    def test_cursor_stable_on_insert(self):
+        response = self.client.get("/genres/?order_by=name&page_size=2")
+        cursor = response.json()["next"]
+        # A row inserted before the cursor must not shift the next page
+        models.Genre.objects.create(name="Adventure")
+        response = self.client.get("/genres/?order_by=name&page_size=2&cursor=%s" % cursor)
+        self.assertEqual([name for pk, name in response.json()["results"]],["Drama","Horror"])
+
+    def test_invalid_cursor(self):
+        response = self.client.get("/genres/?page_size=2&cursor=invalid")
+        self.assertEqual(response.status_code,400)
+        # a cursor of another ordering is rejected as well
+        cursor = self.client.get("/genres/?order_by=name&page_size=2").json()["next"]
+        response = self.client.get("/genres/?order_by=-name&cursor=%s" % cursor)
+        self.assertEqual(response.status_code,400)
+
+    def test_tampered_cursor(self):
+        # well-formed tokens with values of the wrong type
+        for url, cursor in (
+            ("/genres/?page_size=2", encode_cursor("pk", None, "x")),
+            ("/genres/?page_size=2", encode_cursor("pk", None, {"a": 1})),
+            ("/genres/?order_by=name&page_size=2", encode_cursor("name", None, 1)),
+            ("/movies/?order_by=runtime&page_size=2", encode_cursor("runtime", "abc", 1)),
+            ("/movies/?order_by=runtime&page_size=2", encode_cursor("runtime", 100, {"a": 1})),
+            ("/movies/?order_by=released&page_size=2", encode_cursor("released", "1999-13-45", 1)),
+            ("/movies/?order_by=released&page_size=2", encode_cursor("released", [1999], 1)),
+        ):
+            response = self.client.get("%s&cursor=%s" % (url, cursor))
+            self.assertEqual(response.status_code,400,cursor)
+
+    def test_invalid_order_by(self):
+        response = self.client.get("/genres/?order_by=unknown")
+        self.assertEqual(response.status_code,400)
+
+
+class YamodGenreStreamingTest(YamodBaseTest):
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION="JWT %s" % self.get_token())
+
+    def test_stream_json_array(self):
+        response = self.client.get("/genres/?stream=1&order_by=name")
+        self.assertTrue(response.streaming)
+        results = json.loads(b"".join(response.streaming_content))
+        # Same representation as the unstreamed list
+        self.assertEqual(results,self.client.get("/genres/?order_by=name").json())
+
+    def test_stream_ndjson(self):
+        response = self.client.get("/genres/?order_by=-name",HTTP_ACCEPT="application/x-ndjson")
+        self.assertEqual(response["Content-Type"],"application/x-ndjson")
+        lines = b"".join(response.streaming_content).decode("utf-8").splitlines()
+        self.assertEqual([json.loads(line)[1] for line in lines],
+                         ["Scifi","Horror","Drama","Comedy","Action"])
+
+    def test_stream_empty(self):
+        response = self.client.get("/genres/?stream=1&name=Western")
+        self.assertEqual(json.loads(b"".join(response.streaming_content)),[])
+
+
+class YamodGenreCacheTest(YamodBaseTest):
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION="JWT %s" % self.get_token(is_superuser=True))
+
+    def test_list_is_cached(self):
+        self.client.get("/genres/?order_by=name")
+        # Nothing hits the database, not even the JWT user lookup
+        # (cached, see authentication.py)
+        with self.assertNumQueries(0):
+            self.assertEqual(len(self.client.get("/genres/?order_by=name").json()),5)
+
+    def test_create_invalidates_list(self):
+        self.client.get("/genres/")
+        self.client.get("/genres/?order_by=-id")
+        self.client.post("/genres/",{"name":"Thriller"})
+        self.assertEqual(len(self.client.get("/genres/").json()),6)
+        self.assertEqual(self.client.get("/genres/?order_by=-pk").json()[0][1],"Thriller")
+
+    def test_update_invalidates_old_and_new_name(self):
+        genre_id = models.Genre.objects.get(name="Drama").pk
+        self.client.get("/genres/?name=Drama")
+        self.client.get("/genres/?name=Tragedy")
+        self.client.get("/genres/%s/" % genre_id)
+        self.client.put("/genres/%s/" % genre_id,{"name":"Tragedy"})
+        self.assertEqual(self.client.get("/genres/?name=Drama").json(),[])
+        self.assertEqual(self.client.get("/genres/?name=Tragedy").json(),[[genre_id,"Tragedy"]])
+        self.assertEqual(self.client.get("/genres/0%s/" % genre_id).json()["name"],"Tragedy")
+
+    def test_delete_invalidates_detail(self):
+        genre_id = models.Genre.objects.get(name="Drama").pk
+        self.client.get("/genres/%s/" % genre_id)
+        self.client.delete("/genres/%s/" % genre_id)
+        self.assertEqual(self.client.get("/genres/%s/" % genre_id).status_code,404)
+
+    def test_invalidated_again_after_commit(self):
+        # a read between the write and its commit caches the old rows
+        key = cache.genre_list_key(None, None)
+        for write in (
+            lambda: models.Genre.objects.create(name="Thriller"),
+            lambda: self.client.post("/genres/bulk/", [{"name": "Western"}], format="json"),
+        ):
+            with self.captureOnCommitCallbacks(execute=True):
+                with transaction.atomic():
+                    write()
+                    cache.get_cache().set(key, [(0, "stale")])
+            self.assertNotIn([0, "stale"], self.client.get("/genres/").json())
+        self.assertEqual(len(self.client.get("/genres/").json()), 7)
+
+    def test_unrelated_entries_survive(self):
+        self.client.get("/genres/?name=Comedy")
+        self.client.post("/genres/",{"name":"Thriller"})
+        # Only the bumped table version (conditional.py), no list
+        # query (the JWT user is cached)
+        with self.assertNumQueries(1):
+            self.client.get("/genres/?name=Comedy")
+
+    def test_metrics(self):
+        cache.stats.reset()
+        self.client.get("/genres/")
+        self.client.get("/genres/")
+        counts = self.client.get("/metrics/").json()["cache"]["genres"]
+        self.assertEqual((counts["hits"],counts["misses"]),(1,1))
+
+
+class YamodGenreConditionalTest(YamodBaseTest):
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION="JWT %s" % self.get_token())
+
+    def test_not_modified(self):
+        etag = self.client.get("/genres/")["ETag"]
+        # Neither the JWT user lookup (cached) nor the list query
+        with self.assertNumQueries(0):
+            response = self.client.get("/genres/",HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code,304)
+        self.assertEqual(response.content,b"")
+
+    def test_modified_after_create(self):
+        etag = self.client.get("/genres/")["ETag"]
+        self.client.post("/genres/",{"name":"Thriller"})
+        response = self.client.get("/genres/",HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code,200)
+        self.assertNotEqual(response["ETag"],etag)
+        self.assertTrue(response.has_header("Last-Modified"))
+        self.assertEqual(len(response.json()),6)
+
+    def test_modified_after_commit(self):
+        etag = self.client.get("/genres/")["ETag"]
+        old = conditional.table_versions(["yamod.genre"])["yamod.genre"]
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                models.Genre.objects.create(name="Thriller")
+                # another connection reads the old version before the commit
+                cache.get_cache().set(conditional.version_key("yamod.genre"), old)
+        response = self.client.get("/genres/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 6)
+
+    def test_invalid_query_not_modified(self):
+        # the view would reject the query string: 400, not 304
+        movie = models.Movie.objects.first().pk
+        for base, urls in (
+            ("/genres/", ("/genres/?order_by=bad", "/genres/?order_by=", "/genres/?page_size=two",
+                          "/genres/?page_size=2&cursor=invalid")),
+            ("/movies/", ("/movies/?order_by=bad", "/movies/?fields=bad", "/movies/%d/?expand=bad" % movie)),
+            ("/people/", ("/people/?order_by=bad", "/people/?fields=bad")),
+            ("/tvshows/", ("/tvshows/?order_by=bad",)),
+            ("/facets/", ("/facets/?gender=q",)),
+        ):
+            etag = self.client.get(base)["ETag"]
+            for url in urls:
+                self.assertEqual(self.client.get(url,HTTP_IF_NONE_MATCH=etag).status_code,400,url)
+            valid = base + ("?gender=f" if base == "/facets/" else "?order_by=-pk&page_size=2")
+            self.assertEqual(self.client.get(valid,HTTP_IF_NONE_MATCH=etag).status_code,304,valid)
+
+    def test_retrieve_not_modified(self):
+        genre_id = models.Genre.objects.get(name="Drama").pk
+        etag = self.client.get("/genres/%s/" % genre_id)["ETag"]
+        response = self.client.get("/genres/%s/" % genre_id,HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code,304)
+
+
+class YamodGenreBulkTest(YamodBaseTest):
+
+    def client_for(self, is_superuser=False):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION="JWT %s" % self.get_token(is_superuser=is_superuser))
+        return client
+
+    def test_bulk_max_size_in_budget(self):
+        # the query budget grows with the batches (settings.YAMOD_QUERY_BUDGETS)
+        client = self.client_for(is_superuser=True)
+        response = client.post("/genres/bulk/",[{"name":"Genre %d" % i} for i in range(10000)],format="json")
+        self.assertEqual(response.status_code,201)
+        pks = [genre["id"] for genre in response.json()]
+        response = client.put("/genres/bulk/",[{"id":pk,"name":"Renamed %d" % pk} for pk in pks],format="json")
+        self.assertEqual(response.status_code,200)
+        self.assertEqual(client.delete("/genres/bulk/",pks,format="json").status_code,204)
+
+    def test_bulk_create(self):
+        client = self.client_for()
+        client.get("/genres/")
+        response = client.post("/genres/bulk/",[{"name":"Thriller"},{"name":"Western"}],format="json")
+        self.assertEqual(response.status_code,201)
+        created = response.json()
+        self.assertEqual([genre["name"] for genre in created],["Thriller","Western"])
+        self.assertEqual(client.get("/genres/%s/" % created[1]["id"]).json()["name"],"Western")
+        # the cached list has been invalidated
+        self.assertEqual(len(client.get("/genres/").json()),7)
+
+    def test_bulk_create_ids(self):
+        # the ids are those of the created rows, not of the newest ones
+        newest = models.Genre.objects.create(name="Thriller")
+        pks = bulk._created_pks([
+            models.Genre(name=name, name_key=models.Genre.normalize(name)) for name in ("Drama","Comedy")])
+        self.assertEqual(pks,[models.Genre.objects.get(name=name).pk for name in ("Drama","Comedy")])
+        self.assertNotIn(newest.pk,pks)
+
+    def test_bulk_create_reports_errors_per_item(self):
+        client = self.client_for()
+        response = client.post("/genres/bulk/",[{"name":"Thriller"},{},"Western"],format="json")
+        self.assertEqual(response.status_code,400)
+        self.assertEqual([error["index"] for error in response.json()["errors"]],[1,2])
+        # nothing has been written
+        self.assertFalse(models.Genre.objects.filter(name="Thriller").exists())
+
+    def test_bulk_create_expects_list(self):
+        response = self.client_for().post("/genres/bulk/",{"name":"Thriller"},format="json")
+        self.assertEqual(response.status_code,400)
+
+    def test_bulk_update(self):
+        client = self.client_for()
+        drama, comedy = [models.Genre.objects.get(name=name).pk for name in ("Drama","Comedy")]
+        client.get("/genres/?name=Drama")
+        response = client.put("/genres/bulk/",[{"id":drama,"name":"Tragedy"},{"id":comedy,"name":"Farce"}],format="json")
+        self.assertEqual(response.status_code,200)
+        self.assertEqual(client.get("/genres/?name=Drama").json(),[])
+        self.assertEqual(client.get("/genres/%s/" % comedy).json()["name"],"Farce")
+
+    def test_bulk_update_not_found(self):
+        drama = models.Genre.objects.get(name="Drama").pk
+        response = self.client_for().put("/genres/bulk/",[{"id":drama,"name":"Tragedy"},{"id":23746,"name":"Farce"}],format="json")
+        self.assertEqual(response.status_code,400)
+        self.assertEqual(response.json()["errors"],[{"index":1,"error":"Not found."}])
+        self.assertEqual(models.Genre.objects.get(pk=drama).name,"Drama")
+
+    def test_bulk_update_duplicate_id(self):
+        drama = models.Genre.objects.get(name="Drama").pk
+        response = self.client_for().put("/genres/bulk/",[{"id":drama,"name":"Tragedy"},{"id":drama,"name":"Farce"}],format="json")
+        self.assertEqual(response.status_code,400)
+        self.assertEqual(response.json()["errors"],[{"index":1,"error":"Duplicate id."}])
+        self.assertEqual(models.Genre.objects.get(pk=drama).name,"Drama")
+
+    def test_bulk_delete(self):
+        ids = [models.Genre.objects.get(name=name).pk for name in ("Drama","Comedy")]
+        client = self.client_for(is_superuser=True)
+        etag = client.get("/genres/")["ETag"]
+        response = client.delete("/genres/bulk/",ids,format="json")
+        self.assertEqual(response.status_code,204)
+        response = client.get("/genres/",HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(len(response.json()),3)
+
+    def test_bulk_delete_not_authorized(self):
+        ids = [models.Genre.objects.get(name="Drama").pk]
+        response = self.client_for().delete("/genres/bulk/",ids,format="json")
+        self.assertEqual(response.status_code,403)
+
+
+class YamodMovieAPITest(YamodBaseTest):
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION="JWT %s" % self.get_token())
+        actor = models.RoleType.objects.get(name="Actor")
+        for movie in models.Movie.objects.all():
+            for i in range(3):
+                person = models.Person.objects.create(
+                    credited_name="%s actor %d" % (movie.movie_title, i),
+                    year_of_birth=1970,
+                    gender="f"
+                )
+                models.Role.objects.create(person=person,movie=movie,role=actor)
+
+    def test_list_movies(self):
+        response = self.client.get("/movies/?order_by=released")
+        results = response.json()
+        self.assertEqual(len(results),5)
+        self.assertEqual(results[0]["movie_title"],"Blade Runner")
+        self.assertNotIn("cast",results[0])
+
+    def test_list_movies_expanded(self):
+        response = self.client.get("/movies/?order_by=movie_title&expand=genres,cast")
+        blade_runner = response.json()[0]
+        self.assertEqual(blade_runner["genres"][0]["name"],"Scifi")
+        self.assertEqual(len(blade_runner["cast"]),3)
+        self.assertEqual(blade_runner["cast"][0]["role"],"Actor")
+
+    def test_list_movies_query_count(self):
+        # JWT user, table versions, movies, genres and roles
+        # (with person and role type joined in)
+        with self.assertNumQueries(5):
+            self.client.get("/movies/?expand=genres,cast")
+        for i in range(20):
+            movie = models.Movie.objects.create(movie_title="Movie %d" % i,
+                                                released=datetime.date(2000,1,1))
+            movie.genre.add(models.Genre.objects.get(name="Drama"))
+        # the same, except for the JWT user which is cached now
+        with self.assertNumQueries(4):
+            response = self.client.get("/movies/?expand=genres,cast")
+        self.assertEqual(len(response.json()),25)
+
+    def test_retrieve_movie(self):
+        movie = models.Movie.objects.get(movie_title="Nomadland")
+        response = self.client.get("/movies/%s/?expand=cast" % movie.pk)
+        self.assertEqual(response.json()["movie_title"],"Nomadland")
+        self.assertEqual(len(response.json()["cast"]),3)
+        self.assertEqual(self.client.get("/movies/23746/").status_code,404)
+
+    def test_unknown_expand(self):
+        response = self.client.get("/movies/?expand=directors")
+        self.assertEqual(response.status_code,400)
+
+    def test_paginate_movies(self):
+        response = self.client.get("/movies/?order_by=-released&page_size=2&expand=genres")
+        results = response.json()
+        self.assertEqual([movie["movie_title"] for movie in results["results"]],
+                         ["The French Dispatch","Nomadland"])
+        response = self.client.get("/movies/?order_by=-released&page_size=2&cursor=%s" % results["next"])
+        self.assertEqual([movie["movie_title"] for movie in response.json()["results"]],
+                         ["Blade Runner 2049","Rushmoore"])
+
+    def test_sparse_fields(self):
+        response = self.client.get("/movies/?fields=movie_title,released&order_by=-runtime")
+        self.assertEqual(response.json()[0],{"id":models.Movie.objects.get(movie_title="Blade Runner 2049").pk,
+                                             "movie_title":"Blade Runner 2049",
+                                             "released":"2017-10-06"})
+
+    def test_sparse_fields_expanded_and_paginated(self):
+        response = self.client.get("/movies/?fields=runtime&expand=genres&order_by=movie_title&page_size=2")
+        first = response.json()["results"][0]
+        self.assertEqual(set(first),{"id","runtime","genres"})
+        response = self.client.get("/movies/?fields=runtime&order_by=movie_title&page_size=2&cursor=%s"
+                                   % response.json()["next"])
+        self.assertEqual(response.json()["results"][0]["runtime"],110)
+
+    def test_sparse_fields_pushed_down(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get("/movies/?fields=movie_title")
+        movie_query = [query["sql"] for query in queries if 'FROM "yamod_movie"' in query["sql"]][0]
+        self.assertNotIn("original_title",movie_query)
+
+    def test_unknown_fields(self):
+        with self.assertNumQueries(2):
+            # JWT user and table versions only
+            response = self.client.get("/movies/?fields=budget")
+        self.assertEqual(response.status_code,400)
+
+
+class YamodSearchTest(YamodBaseTest):
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION="JWT %s" % self.get_token())
+        self.goyer = models.Person.objects.create(credited_name="David S. Goyer",gender="m",year_of_birth=1965)
+        self.foundation = models.TVShow.objects.create(name="Foundation",original_title="Foundation",
+                                                       released_year=2021,created_by=self.goyer)
+
+    def titles(self, url):
+        return [(result["kind"],result["title"]) for result in self.client.get(url).json()]
+
+    def test_search_prefix(self):
+        self.assertEqual(set(self.titles("/search/?q=blade run")),
+                         {("movie","Blade Runner"),("movie","Blade Runner 2049")})
+        self.assertEqual(self.titles("/search/?q=found"),[("tvshow","Foundation")])
+
+    def test_search_kind(self):
+        models.Movie.objects.create(movie_title="David",released=datetime.date(2000,1,1))
+        self.assertEqual(self.titles("/search/?q=david&kind=person"),[("person","David S. Goyer")])
+        self.assertEqual(self.client.get("/search/?q=david&kind=studio").status_code,400)
+
+    def test_search_follows_changes(self):
+        # The index is kept in sync by triggers, bulk writes included
+        models.Movie.objects.filter(movie_title="Nomadland").update(movie_title="Nowhereland",
+                                                                   original_title="Nowhereland")
+        self.assertEqual(self.titles("/search/?q=nomad"),[])
+        self.assertEqual(self.titles("/search/?q=nowhere"),[("movie","Nowhereland")])
+        models.Movie.objects.filter(movie_title="Nowhereland").delete()
+        self.assertEqual(self.titles("/search/?q=nowhere"),[])
+
+    def test_search_ignores_fts_syntax(self):
+        self.assertEqual(self.client.get('/search/?q=blade" OR "').status_code,200)
+        self.assertEqual(self.client.get("/search/?q=").json(),[])
+
+    def test_rebuild_search_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM yamod_search")
+        self.assertEqual(self.titles("/search/?q=rushmoore"),[])
+        call_command("rebuild_search_index",stdout=io.StringIO())
+        self.assertEqual(self.titles("/search/?q=rushmoore"),[("movie","Rushmoore")])
+
+    def test_rebuild_search_index_creates_triggers(self):
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TRIGGER yamod_person_search_insert")
+        self.assertEqual(search.missing_triggers(),["yamod_person_search_insert"])
+        out = io.StringIO()
+        call_command("rebuild_search_index",stdout=out)
+        self.assertIn("yamod_person_search_insert",out.getvalue())
+        self.assertEqual(search.missing_triggers(),[])
+        models.Person.objects.create(credited_name="Jared Harris",gender="m",year_of_birth=1961)
+        self.assertEqual(self.titles("/search/?q=jared"),[("person","Jared Harris")])
+
+
+class YamodAutocompleteTest(YamodBaseTest):
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION="JWT %s" % self.get_token())
+        models.Person.objects.create(credited_name="Ryan Gosling",year_of_birth=1980,gender="m")
+
+    def titles(self, url):
+        return [result["title"] for result in self.client.get(url).json()]
+
+    def test_complete(self):
+        self.assertEqual(self.titles("/autocomplete/?q=bla"),["Blade Runner","Blade Runner 2049"])
+        self.assertEqual(self.titles("/autocomplete/?q=r"),["Rushmoore","Ryan Gosling"])
+        self.assertEqual(self.titles("/autocomplete/?q=r&kind=person"),["Ryan Gosling"])
+        self.assertEqual(self.titles("/autocomplete/?q=BLADE RUNNER 2&limit=1"),["Blade Runner 2049"])
+        self.assertEqual([result["kind"] for result in self.client.get("/autocomplete/?q=r").json()],["movie","person"])
+
+    def test_complete_without_database(self):
+        self.client.get("/autocomplete/?q=bla")
+        # No query at all, the JWT user is cached
+        with self.assertNumQueries(0):
+            self.client.get("/autocomplete/?q=no")
+
+    def test_complete_follows_changes(self):
+        self.client.get("/autocomplete/?q=bla")
+        with self.captureOnCommitCallbacks(execute=True):
+            models.Movie.objects.create(movie_title="Blast from the Past",released=datetime.date(1999,2,12))
+        with self.captureOnCommitCallbacks(execute=True):
+            movie = models.Movie.objects.get(movie_title="Blade Runner")
+            movie.movie_title = "Bladerunner"
+            movie.save()
+        self.assertEqual(self.titles("/autocomplete/?q=bla"),["Blade Runner 2049","Bladerunner","Blast from the Past"])
+        with self.captureOnCommitCallbacks(execute=True):
+            movie.delete()
+        self.assertEqual(self.titles("/autocomplete/?q=blader"),[])
+
+    def test_invalid_kind(self):
+        self.assertEqual(self.client.get("/autocomplete/?q=r&kind=genre").status_code,400)
+
+    @override_settings(YAMOD_AUTOCOMPLETE_MAX_AGE=0)
+    def test_reload_in_background(self):
+        reloads = []
+
+        class Index(autocomplete.Autocomplete):
+            def _start_reload(self, generation):
+                reloads.append(generation)
+
+        index = Index()
+        titles = lambda: [result["title"] for result in index.complete("bla")]
+        self.assertEqual(titles(),["Blade Runner","Blade Runner 2049"])
+        movie = models.Movie.objects.create(movie_title="Blast from the Past",released=datetime.date(1999,2,12))
+        # stale: answered from the old index while one reload runs
+        self.assertEqual(titles(),["Blade Runner","Blade Runner 2049"])
+        self.assertEqual(titles(),["Blade Runner","Blade Runner 2049"])
+        self.assertEqual(reloads,[0])
+        # a rename during the reload is replayed on the loaded rows
+        index.remove("movie",movie.pk,"Blast from the Past")
+        index.add("movie",movie.pk,"Blast Off")
+        index._reload(reloads[0])
+        self.assertEqual(titles(),["Blade Runner","Blade Runner 2049","Blast Off"])
+        # a reload started before a reset is dropped
+        index.reset()
+        titles()
+        index._reload(reloads[0])
+        self.assertEqual(titles(),["Blade Runner","Blade Runner 2049","Blast from the Past"])
+
+
+    def test_warm(self):
+        reloads = []
+
+        class Index(autocomplete.Autocomplete):
+            def _start_reload(self, generation):
+                reloads.append(generation)
+
+        index = Index()
+        index.warm()
+        self.assertEqual(reloads,[0])
+        results = []
+        query = threading.Thread(target=lambda: results.extend(index.complete("bla")))
+        query.start()
+        # the query waits for the load instead of loading itself
+        query.join(0.2)
+        self.assertTrue(query.is_alive())
+        self.assertFalse(index.is_loaded)
+        index._reload(reloads[0])
+        query.join()
+        self.assertEqual([result["title"] for result in results],["Blade Runner","Blade Runner 2049"])
+
+    def test_pks_in_order(self):
+        index = autocomplete.PrefixIndex(models.Movie,"movie_title")
+        index.load()
+        self.assertEqual(list(index.titles),sorted(index.titles,key=autocomplete.normalize))
+        self.assertEqual(list(index.pks),[
+            models.Movie.objects.get(movie_title=title).pk for title in index.titles])
+
+class QueryPlanTest(YamodBaseTest):
+    '''
+    The hot queries of views.py and of the tests above must be answered
+    through an index: EXPLAIN QUERY PLAN may not contain a full table scan.
+
+    Not covered: LIKE queries (startswith/contains, served by search.py and
+    autocomplete.py instead) and ORs across a join (test_or_query), which
+    SQLite cannot answer from an index.
+    '''
+
+    def assertNoFullScan(self, queryset):
+        plan = queryset.explain()
+        full_scans = [line for line in plan.splitlines()
+                      if re.search(r"\bSCAN (TABLE )?yamod_\w+$", line.strip())]
+        self.assertEqual(full_scans,[],"Full table scan in:\n%s\n%s" % (queryset.query,plan))
+
+    def keyset_page(self, queryset, order_by, key, pk):
+        # the query of the second page, see pagination.py
+        paginator = KeysetPaginator(queryset,order_by,2)
+        with CaptureQueriesContext(connection) as queries:
+            paginator.page(encode_cursor(order_by,key,pk))
+        return queries[0]["sql"]
+
+    def assertSqlNoFullScan(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN QUERY PLAN " + sql)
+            plan = [row[-1] for row in cursor.fetchall()]
+        self.assertEqual([line for line in plan if re.search(r"\bSCAN (TABLE )?yamod_\w+$", line)],[],
+                         "Full table scan in:\n%s\n%s" % (sql,"\n".join(plan)))
+
+    def test_genre_queries(self):
+        self.assertNoFullScan(models.Genre.objects.filter(name="Drama"))
+        self.assertSqlNoFullScan(self.keyset_page(models.Genre.objects.all(),"name","Comedy",2))
+        self.assertSqlNoFullScan(self.keyset_page(models.Genre.objects.all(),"-name","Comedy",2))
+
+    def test_movie_filters(self):
+        self.assertNoFullScan(models.Movie.objects.filter(released__year__gte=2000))
+        self.assertNoFullScan(models.Movie.objects.filter(runtime__lte=100))
+        self.assertNoFullScan(models.Movie.objects.filter(genre__name="Comedy"))
+        self.assertNoFullScan(models.Movie.objects.filter(released__range=(datetime.date(1990,1,1),
+                                                                           datetime.date(2000,1,1))))
+
+    def test_movie_keyset_pages(self):
+        for order_by, key in (("released","2000-01-01"),("-runtime",100),("movie_title","Nomadland")):
+            queryset = models.Movie.objects.values("id",order_by.lstrip("-"))
+            self.assertSqlNoFullScan(self.keyset_page(queryset,order_by,key,3))
+
+    def test_movie_prefetches(self):
+        self.assertNoFullScan(models.Genre.objects.filter(movie__in=[1,2]))
+        self.assertNoFullScan(models.Role.objects.filter(movie__in=[1,2]).select_related("person","role"))
+
+    def test_tv_show_queries(self):
+        self.assertNoFullScan(models.TVShow.objects.filter(released_year=2021))
+        self.assertNoFullScan(models.Season.objects.filter(tv_show=1))
+        self.assertNoFullScan(models.Episode.objects.filter(season=1))
+
+    def test_person_queries(self):
+        self.assertNoFullScan(models.Person.objects.filter(year_of_birth__gte=1970))
+
+
+class YamodGenreNameTest(YamodBaseTest):
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION="JWT %s" % self.get_token())
+
+    def test_names_are_unique(self):
+        with self.assertRaises(IntegrityError):
+            models.Genre.objects.create(name=" comedy ")
+
+    def test_named(self):
+        drama = models.Genre.objects.named("  DRAMA").get()
+        self.assertEqual(drama.name,"Drama")
+        genre, created = models.Genre.objects.get_or_create_named("drama")
+        self.assertEqual((genre, created),(drama, False))
+
+    def test_lookup_is_case_insensitive(self):
+        self.assertEqual(self.client.get("/genres/?name=scifi").json()[0][1],"Scifi")
+
+    def test_create_existing_genre(self):
+        response = self.client.post("/genres/",{"name":"HORROR"})
+        self.assertEqual(response.status_code,400)
+
+    def test_rename_to_existing_genre(self):
+        drama = models.Genre.objects.named("Drama").get()
+        response = self.client.put("/genres/%s/" % drama.pk,{"name":"Comedy"})
+        self.assertEqual(response.status_code,400)
+        # changing only the case is fine
+        response = self.client.put("/genres/%s/" % drama.pk,{"name":"DRAMA"})
+        self.assertEqual(response.status_code,200)
+
+    def test_bulk_create_existing_genres(self):
+        response = self.client.post("/genres/bulk/",[{"name":"Thriller"},{"name":"thriller"},{"name":"Drama"}],
+                                    format="json")
+        self.assertEqual([error["index"] for error in response.json()["errors"]],[1,2])
+
+
+class GenreMergeMigrationTest(TransactionTestCase):
+    '''
+    Migration 0018 merges genres whose names only differ in case
+    or whitespace before the unique name_key index is created.
+    '''
+
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate([("yamod", target)])
+        return executor.loader.project_state([("yamod", target)]).apps
+
+    def tearDown(self):
+        # back to the latest migration for the tests that follow, with
+        # the triggers created after migrate (counters.create_after_migrate)
+        call_command("migrate", "yamod", verbosity=0)
+        super().tearDown()
+
+    def test_merge_duplicate_genres(self):
+        apps = self.migrate("0017_genre_name_key")
+        Genre, Movie = apps.get_model("yamod","Genre"), apps.get_model("yamod","Movie")
+        # seeded by migration 0010 unless flushed by an earlier test
+        drama = Genre.objects.get_or_create(name="Drama")[0]
+        count = Genre.objects.count()
+        duplicates = [Genre.objects.create(name=name) for name in ("drama","  DRAMA ")]
+        movie_1 = Movie.objects.create(movie_title="One",released=datetime.date(2000,1,1))
+        movie_2 = Movie.objects.create(movie_title="Two",released=datetime.date(2000,1,1))
+        movie_1.genre.add(drama,duplicates[0])
+        movie_2.genre.add(*duplicates)
+        apps = self.migrate("0019_alter_genre_name_key")
+        Genre, Movie = apps.get_model("yamod","Genre"), apps.get_model("yamod","Movie")
+        self.assertEqual(list(Genre.objects.filter(name_key="drama").values_list("pk",flat=True)),[drama.pk])
+        for movie in (movie_1, movie_2):
+            self.assertEqual(list(Movie.objects.get(pk=movie.pk).genre.values_list("pk",flat=True)),[drama.pk])
+        self.assertEqual(Genre.objects.count(),count)
+
+
+class SeedingTest(YamodBaseTest):
+    '''
+    seeding.seed inserts only missing rows with one lookup query and
+    bulk_create, so re-running a seed is a no-op.
+    '''
+
+    def test_seed_inserts_missing_rows(self):
+        rows = [{"name": name} for name in ("Action", "Western", "Noir", "Western")]
+        with self.assertNumQueries(2):
+            created = seeding.seed(models.RoleType, rows, key=("name",))
+        self.assertEqual(created, 3)
+        with self.assertNumQueries(1):
+            self.assertEqual(seeding.seed(models.RoleType, rows, key=("name",)), 0)
+        self.assertEqual(models.RoleType.objects.filter(name="Western").count(), 1)
+
+    def test_seed_batches_generator(self):
+        rows = ({"name": "Type %d" % i} for i in range(25))
+        with self.assertNumQueries(1 + 3):
+            seeding.seed(models.RoleType, rows, key=("name",), batch_size=10)
+        self.assertEqual(models.RoleType.objects.filter(name__startswith="Type ").count(), 25)
+
+    def test_unseed(self):
+        rows = [{"name": "Western"}, {"name": "Noir"}]
+        seeding.seed(models.RoleType, rows, key=("name",))
+        self.assertEqual(seeding.unseed(models.RoleType, rows, key=("name",)), 2)
+        self.assertFalse(models.RoleType.objects.filter(name__in=["Western", "Noir"]).exists())
+
+    def test_genre_seed_is_idempotent(self):
+        '''
+        Migration 0010 can run again (e.g. in a later migration) without duplicates.
+        '''
+        migration = importlib.import_module("yamod.migrations.0010_create_genres")
+        operation = migration.Migration.operations[0]
+        operation.code(django_apps, connection.schema_editor())
+        for name in migration.GENRES:
+            self.assertEqual(models.Genre.objects.filter(name=name).count(), 1)
+
+
+class CatalogueImportTest(YamodBaseTest):
+    '''
+    manage.py import_catalogue loads movies, people and roles with
+    bulk_create, creating missing genres and role types on the way.
+    '''
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, name, text):
+        path = os.path.join(self.directory.name, name)
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(text)
+        return path
+
+    def write_catalogue(self):
+        people = self.write("people.csv", (
+            "id,credited_name,year_of_birth,year_of_death,gender\n"
+            "nm0001001,Frances McDormand,1957,,f\n"
+            "nm0001002,Chloé Zhao,1982,\\N,f\n"
+        ))
+        movies = self.write("movies.jsonl", "\n".join(json.dumps(movie) for movie in [
+            {"id": "tt0001001", "movie_title": "Fargo", "released": "1996-03-08",
+             "runtime": 98, "genres": ["Crime", "drama "]},
+            {"id": "tt0001002", "movie_title": "Nomadland 2", "released": "2024",
+             "genres": "Drama"},
+        ]))
+        roles = self.write("roles.tsv", (
+            "movie\tperson\trole\n"
+            "tt0001001\tnm0001001\tActor\n"
+            "tt0001002\tnm0001001\tActor\n"
+            "tt0001002\tnm0001002\tEditor\n"
+        ))
+        return ["--people", people, "--movies", movies, "--roles", roles]
+
+    def test_import(self):
+        call_command("import_catalogue", *self.write_catalogue(), stdout=io.StringIO())
+        fargo = models.Movie.objects.get(pk=1001)
+        self.assertEqual(fargo.movie_title, "Fargo")
+        self.assertEqual(fargo.runtime, 98)
+        # genres are matched case insensitively, missing ones are created
+        self.assertEqual(sorted(fargo.genre.values_list("name", flat=True)), ["Crime", "Drama"])
+        self.assertEqual(models.Genre.objects.named("drama").count(), 1)
+        nomadland = models.Movie.objects.get(pk=1002)
+        self.assertEqual(nomadland.released, datetime.date(2024, 1, 1))
+        self.assertEqual(nomadland.runtime, 90)
+        self.assertIsNone(models.Person.objects.get(pk=1002).year_of_death)
+        self.assertEqual(models.Role.objects.filter(person_id=1001).count(), 2)
+        self.assertTrue(models.RoleType.objects.filter(name="Editor").exists())
+
+    def test_import_is_resumable(self):
+        args = self.write_catalogue()
+        call_command("import_catalogue", *args, stdout=io.StringIO())
+        counts = [model.objects.count() for model in (models.Movie, models.Person, models.Role, models.Genre)]
+        call_command("import_catalogue", *args, stdout=io.StringIO())
+        self.assertEqual(
+            [model.objects.count() for model in (models.Movie, models.Person, models.Role, models.Genre)],
+            counts
+        )
+
+    def test_failed_chunk_keeps_committed_chunks(self):
+        people = self.write("people.jsonl", "\n".join(json.dumps(person) for person in [
+            {"id": 2001, "credited_name": "One", "year_of_birth": 1970, "gender": "m"},
+            {"id": 2002, "credited_name": "Two", "year_of_birth": 1971, "gender": "f"},
+            {"id": 2003, "credited_name": "No year", "gender": "x"},
+        ]))
+        with self.assertRaises(CommandError):
+            call_command("import_catalogue", "--people", people, "--chunk-size", "2", stdout=io.StringIO())
+        self.assertEqual(list(models.Person.objects.filter(pk__gte=2001).values_list("pk", flat=True)),
+                         [2001, 2002])
+
+    def test_unknown_references(self):
+        roles = self.write("roles.csv", "movie,person,role\n1,999,Actor\n")
+        with self.assertRaises(CommandError):
+            call_command("import_catalogue", "--roles", roles, stdout=io.StringIO())
+        self.assertFalse(models.Role.objects.exists())
+
+    def test_import_updates_etag(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION="JWT " + self.get_token())
+        etag = client.get("/movies/")["ETag"]
+        call_command("import_catalogue", *self.write_catalogue(), stdout=io.StringIO())
+        self.assertNotEqual(client.get("/movies/")["ETag"], etag)
+
+
+class CatalogueExportTest(YamodBaseTest):
+    '''
+    manage.py export_catalogue writes one file per table, m2m tables as
+    edge lists, and supports incremental exports.
+    '''
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def export(self, *args):
+        call_command("export_catalogue", self.directory.name, *args, stdout=io.StringIO())
+        with open(os.path.join(self.directory.name, "manifest.json")) as file:
+            return json.load(file)
+
+    def read_jsonl(self, name):
+        with open(os.path.join(self.directory.name, name)) as file:
+            return [json.loads(line) for line in file]
+
+    def test_export_jsonl(self):
+        manifest = self.export()
+        self.assertEqual(set(manifest["tables"]), set(catalogue.EXPORTS))
+        movies = self.read_jsonl("movie.jsonl")
+        self.assertEqual(len(movies), 5)
+        self.assertEqual(movies[0]["movie_title"], "Blade Runner")
+        self.assertEqual(movies[0]["released"], "1982-06-25")
+        edges = self.read_jsonl("movie_genre.jsonl")
+        scifi = models.Genre.objects.get(name="Scifi").pk
+        self.assertEqual(
+            sorted(edge["movie_id"] for edge in edges if edge["genre_id"] == scifi),
+            sorted(models.Movie.objects.filter(genre=scifi).values_list("pk", flat=True))
+        )
+        self.assertEqual(manifest["tables"]["movie"]["max_pk"], models.Movie.objects.order_by("pk").last().pk)
+
+    def test_export_csv_gzip(self):
+        manifest = self.export("--format", "csv", "--gzip", "--tables", "movie,season_cast")
+        self.assertEqual(set(manifest["tables"]), {"movie", "season_cast"})
+        with gzip.open(os.path.join(self.directory.name, "movie.csv.gz"), "rt") as file:
+            rows = list(csv.DictReader(file))
+        self.assertEqual([row["movie_title"] for row in rows][:2], ["Blade Runner", "Blade Runner 2049"])
+        self.assertEqual(rows[0]["original_title"], "Blade Runner")
+
+    def test_export_since_manifest(self):
+        self.export("--tables", "movie")
+        previous = os.path.join(self.directory.name, "previous.json")
+        os.rename(os.path.join(self.directory.name, "manifest.json"), previous)
+        models.Movie.objects.create(movie_title="Dune", released=datetime.date(2021, 9, 15))
+        manifest = self.export("--tables", "movie", "--since", previous)
+        self.assertEqual([movie["movie_title"] for movie in self.read_jsonl("movie.jsonl")], ["Dune"])
+        self.assertEqual(manifest["tables"]["movie"]["rows"], 1)
+        # nothing new: max_pk stays the one of the earlier export
+        manifest = self.export("--tables", "movie", "--since", os.path.join(self.directory.name, "manifest.json"))
+        self.assertEqual(manifest["tables"]["movie"]["rows"], 0)
+        self.assertEqual(manifest["tables"]["movie"]["max_pk"], models.Movie.objects.get(movie_title="Dune").pk)
+
+    def test_export_changed_since(self):
+        models.Movie.objects.create(movie_title="Dune", released=datetime.date(2021, 9, 15))
+        since = timezone.now()
+        models.Person.objects.create(credited_name="Denis Villeneuve", year_of_birth=1967, gender="m")
+        manifest = self.export("--changed-since", since.isoformat())
+        self.assertIn("person", manifest["tables"])
+        self.assertNotIn("movie", manifest["tables"])
+        self.assertNotIn("tvshow", manifest["tables"])
+
+    def test_export_streams_rows(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.export("--tables", "movie", "--chunk-size", "2")
+        self.assertEqual(len([query for query in queries if "yamod_movie" in query["sql"]]), 1)
+
+
+@skipUnless("production" in getattr(settings, "DATABASE_PROFILES", {}), "no production database profile")
+class SQLitePragmaTest(TestCase):
+    '''
+    The production database profile (movie_site/db/base.py) applies
+    its pragmas to every new connection.
+    '''
+
+    def test_pragmas_applied(self):
+        profile = settings.DATABASE_PROFILES["production"]
+        pragmas = profile["OPTIONS"]["pragmas"]
+        with tempfile.TemporaryDirectory() as directory:
+            handler = ConnectionHandler({"default": dict(profile, NAME=os.path.join(directory, "db.sqlite3"))})
+            production = handler["default"]
+            try:
+                with production.cursor() as cursor:
+                    cursor.execute("PRAGMA temp_store")
+                    self.assertEqual(cursor.fetchone()[0], {"MEMORY": 2, "FILE": 1, "DEFAULT": 0}[pragmas["temp_store"]])
+                    cursor.execute("PRAGMA busy_timeout")
+                    self.assertEqual(cursor.fetchone()[0], pragmas["busy_timeout"])
+                    cursor.execute("PRAGMA journal_mode")
+                    self.assertEqual(cursor.fetchone()[0].upper(), pragmas["journal_mode"])
+            finally:
+                production.close()
+
+
+@override_settings(DATABASE_ROUTERS=["yamod.routers.ReplicaRouter"],
+                   YAMOD_REPLICA_DATABASES=["yamod_test_replica"])
+class ReplicaRouterTest(TransactionTestCase):
+    '''
+    routers.ReplicaRouter with two SQLite databases: the replica is a
+    copy of the primary taken in setUp, so rows written afterwards are
+    only visible on the primary (like on a lagging replica).
+    '''
+
+    databases = {"default", "yamod_test_replica"}
+
+    def setUp(self):
+        caches["default"].clear()
+        # the genres seeded by migration 0010 exist unless flushed by an earlier test
+        models.Genre.objects.get_or_create_named("Drama")
+        connections["default"].ensure_connection()
+        connections["yamod_test_replica"].ensure_connection()
+        connections["default"].connection.backup(connections["yamod_test_replica"].connection)
+        models.Genre.objects.create(name="Noir")
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create(username="api_user"))
+
+    def test_reads_go_to_replica(self):
+        with routers.request_scope():
+            self.assertEqual(models.Genre.objects.all().db, "yamod_test_replica")
+            self.assertTrue(models.Genre.objects.named("Drama").exists())
+            self.assertFalse(models.Genre.objects.named("Noir").exists())
+
+    def test_reads_after_write_go_to_primary(self):
+        with routers.request_scope():
+            models.Genre.objects.create(name="Western")
+            self.assertTrue(models.Genre.objects.named("Noir").exists())
+            self.assertTrue(models.Genre.objects.named("Western").exists())
+        # the next request reads from the replica again
+        with routers.request_scope():
+            self.assertFalse(models.Genre.objects.named("Noir").exists())
+
+    def test_reads_in_transaction_go_to_primary(self):
+        with routers.request_scope(), transaction.atomic():
+            self.assertTrue(models.Genre.objects.named("Noir").exists())
+
+    def test_replicas_are_not_migrated(self):
+        self.assertFalse(router.allow_migrate("yamod_test_replica", "yamod"))
+        self.assertTrue(router.allow_migrate("default", "yamod"))
+
+    def test_api(self):
+        # paginated lists are not cached, read from the replica
+        names = [name for pk, name in self.client.get("/genres/?page_size=100").json()["results"]]
+        self.assertIn("Drama", names)
+        self.assertNotIn("Noir", names)
+        response = self.client.post("/genres/", {"name": "Western"}, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(models.Genre.objects.using("default").named("Western").count(), 1)
+        # the pinning ends with the request (middleware.replica_pinning_middleware)
+        names = [name for pk, name in self.client.get("/genres/?order_by=name&page_size=100").json()["results"]]
+        self.assertNotIn("Western", names)
+        self.assertFalse(models.Genre.objects.using("yamod_test_replica").named("Western").exists())
+
+
+    def test_cache_filled_from_primary(self):
+        # a request that has not written must not cache replica rows
+        names = [name for pk, name in self.client.get("/genres/").json()]
+        self.assertIn("Noir", names)
+        pk = models.Genre.objects.using("default").named("Noir").get().pk
+        self.assertEqual(self.client.get("/genres/%d/" % pk).status_code, 200)
+        caches["default"].clear()
+        with routers.request_scope():
+            versions = conditional.table_versions(["yamod.genre"])
+        self.assertEqual(versions["yamod.genre"][0], models.TableVersion.objects.using(
+            "default").get(table="yamod.genre").version)
+
+    def test_stored_from_primary(self):
+        # written after the replica was copied
+        with routers.request_scope():
+            person = models.Person.objects.create(credited_name="Jared Harris", gender="m", year_of_birth=1961)
+            movie = models.Movie.objects.create(movie_title="Foundation", released=datetime.date(2021, 9, 24))
+            role = models.RoleType.objects.get_or_create(name="Actor")[0]
+            models.Role.objects.create(person=person, movie=movie, role=role)
+            show = models.TVShow.objects.create(name="Foundation", released_year=2021, created_by=person)
+        with routers.request_scope():
+            self.assertEqual(filmography.summary(person.pk)["movies"], 1)
+            self.assertEqual(tvshows.snapshot(show.pk)["created_by"]["id"], person.pk)
+
+
+class AsyncGenreViewTest(YamodBaseTest):
+    '''
+    The async genre endpoints (async_views.py) answer like the viewset.
+    '''
+
+    def setUp(self):
+        super().setUp()
+        self.token = self.get_token()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION="JWT " + self.token)
+        self.async_client = AsyncClient()
+
+    async def get(self, path, **headers):
+        return await self.async_client.get(path, AUTHORIZATION="JWT " + self.token, **headers)
+
+    async def test_list(self):
+        for query in ("", "?order_by=-name", "?name=scifi"):
+            response = await self.get("/async/genres/" + query)
+            self.assertEqual(response.status_code, 200)
+            expected = await sync_to_async(self.client.get)("/genres/" + query)
+            self.assertEqual(response.json(), expected.json())
+
+    async def test_list_invalid_order_by(self):
+        response = await self.get("/async/genres/?order_by=password")
+        self.assertEqual(response.status_code, 400)
+
+    async def test_retrieve(self):
+        genre = await sync_to_async(models.Genre.objects.named("Drama").get)()
+        response = await self.get("/async/genres/%d/" % genre.pk)
+        self.assertEqual(response.json(), {"name": "Drama", "pk": genre.pk})
+        self.assertEqual((await self.get("/async/genres/999999/")).status_code, 404)
+        self.assertEqual((await self.get("/async/genres/drama/")).status_code, 404)
+
+    async def test_authentication_required(self):
+        response = await self.async_client.get("/async/genres/")
+        self.assertEqual(response.status_code, 401)
+        response = await self.async_client.get("/async/genres/", AUTHORIZATION="JWT invalid")
+        self.assertEqual(response.status_code, 401)
+
+    async def test_not_modified(self):
+        response = await self.get("/async/genres/")
+        response = await self.get("/async/genres/", IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+    async def test_invalid_order_by_not_modified(self):
+        response = await self.get("/async/genres/")
+        response = await self.get("/async/genres/?order_by=password", IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 400)
+
+    async def test_retrieve_not_modified(self):
+        genre = await sync_to_async(models.Genre.objects.named("Drama").get)()
+        response = await self.get("/async/genres/%d/" % genre.pk)
+        response = await self.get("/async/genres/%d/" % genre.pk, IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+    async def test_missing_action(self):
+        class ListOnlyView(async_views.AsyncListRetrieveView):
+            async def list(self, request):
+                return async_views.json_response([])
+        request = RequestFactory().get("/")
+        response = await ListOnlyView.as_view(detail=True)(request, pk=1)
+        self.assertEqual(response.status_code, 405)
+
+    async def test_aiterator_chunks(self):
+        rows = [row async for row in async_views.aiterator(
+            models.Genre.objects.order_by("pk").values_list("name", flat=True), chunk_size=2)]
+        self.assertEqual(rows, await sync_to_async(list)(
+            models.Genre.objects.order_by("pk").values_list("name", flat=True)))
+
+
+class JWTCacheTest(YamodBaseTest):
+    '''
+    authentication.CachedJSONWebTokenAuthentication verifies a token
+    once and drops it when its user changes.
+    '''
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION="JWT %s" % self.get_token(is_superuser=True))
+        self.user = get_user_model().objects.get(username="api_user")
+
+    def test_token_is_cached(self):
+        # the autocomplete index is loaded by the first request
+        self.client.get("/autocomplete/?q=bla")
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get("/autocomplete/?q=bla").status_code, 200)
+
+    def test_deactivated_user(self):
+        self.client.get("/genres/")
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get("/genres/").status_code, 401)
+
+    def test_superuser_revoked(self):
+        self.client.get("/genres/")
+        self.user.is_superuser = False
+        self.user.save()
+        genre = models.Genre.objects.get(name="Horror")
+        self.assertEqual(self.client.delete("/genres/%s/" % genre.pk).status_code, 403)
+
+    @override_settings(YAMOD_JWT_CACHE_TTL=0)
+    def test_ttl(self):
+        self.client.get("/autocomplete/?q=bla")
+        # JWT user lookup again
+        with self.assertNumQueries(1):
+            self.client.get("/autocomplete/?q=bla")
+
+    @override_settings(YAMOD_JWT_CACHE_SIZE=2)
+    def test_lru_is_bounded(self):
+        cache = authentication.TokenCache()
+        expires = time.time() + 60
+        for token in ("a", "b", "c"):
+            cache.set(token, self.user, expires)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("c"), self.user)
+        cache.invalidate_user(self.user.pk)
+        self.assertEqual(len(cache), 0)
+
+    def test_user_per_request(self):
+        cache = authentication.TokenCache()
+        self.user.email = "api@example.com"
+        self.user.save()
+        cache.set("a", self.user, time.time() + 60)
+        first, second = cache.get("a"), cache.get("a")
+        self.assertIsNot(first, second)
+        first.is_superuser = not self.user.is_superuser
+        first.cached_value = 1
+        self.assertEqual(second.is_superuser, self.user.is_superuser)
+        self.assertFalse(hasattr(second, "cached_value"))
+        self.assertEqual((second.pk, second.username, second.is_active), (self.user.pk, "api_user", True))
+        # not cached, loaded on access
+        with self.assertNumQueries(1):
+            self.assertEqual(second.email, "api@example.com")
+
+    def test_expired_entry(self):
+        cache = authentication.TokenCache()
+        cache.set("a", self.user, time.time() - 1)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 0)
+
+
+class InstrumentationTest(YamodBaseTest):
+    '''
+    middleware.InstrumentationMiddleware: Server-Timing header, request
+    histograms per view and query budgets.
+    '''
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION="JWT %s" % self.get_token())
+
+    def test_server_timing(self):
+        response = self.client.get("/genres/")
+        timing = response["Server-Timing"]
+        self.assertRegex(timing, r'^sql;dur=[0-9.]+;desc="\d+ queries", python;dur=[0-9.]+, '
+                                 r'render;dur=[0-9.]+, total;dur=[0-9.]+$')
+        # cached: no queries at all
+        response = self.client.get("/genres/")
+        self.assertIn('desc="0 queries"', response["Server-Timing"])
+
+    def test_histograms(self):
+        self.client.get("/genres/")
+        self.client.get("/genres/")
+        self.client.get("/movies/")
+        snapshot = self.client.get("/metrics/").json()["requests"]
+        genres = snapshot["GenreViewSet.list"]
+        self.assertEqual(genres["queries"]["count"], 2)
+        self.assertEqual(genres["queries"]["buckets"]["+Inf"], 2)
+        # the second request was served from the cache
+        self.assertEqual(genres["queries"]["buckets"]["0"], 1)
+        self.assertEqual(snapshot["MovieViewSet.list"]["total_ms"]["count"], 1)
+        self.assertGreater(genres["render_ms"]["sum"], 0)
+
+    async def test_concurrent_async_requests(self):
+        # under ASGI the queries of all requests run on one shared thread
+        pk = await sync_to_async(lambda: models.Genre.objects.named("Drama").get().pk)()
+        token = await sync_to_async(self.get_token)()
+        client = AsyncClient()
+        responses = await asyncio.gather(*(
+            client.get("/async/genres/%d/" % pk, AUTHORIZATION="JWT " + token) for _ in range(20)
+        ))
+        queries = [benchmarks.server_queries(response) for response in responses]
+        self.assertEqual([response.status_code for response in responses], [200] * 20)
+        # the user, the table version and the genre at most (cached after the first)
+        self.assertLessEqual(max(queries), 3)
+
+    def test_prometheus(self):
+        self.client.get("/genres/")
+        response = self.client.get("/metrics/prometheus/")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        text = response.content.decode()
+        self.assertIn("# TYPE yamod_request_queries histogram", text)
+        self.assertIn('yamod_request_sql_ms_count{view="GenreViewSet.list"} 1', text)
+        self.assertIn('yamod_request_total_ms_bucket{view="GenreViewSet.list",le="+Inf"} 1', text)
+
+    def test_async_view_name(self):
+        self.assertEqual(
+            instrumentation.view_name(async_views.AsyncGenreView.as_view(detail=True), "GET"),
+            "AsyncGenreView.retrieve"
+        )
+
+    @override_settings(YAMOD_QUERY_BUDGETS={"*": 10, "MovieViewSet.list": 0})
+    def test_budget_raises(self):
+        with self.assertRaises(instrumentation.QueryBudgetExceeded):
+            self.client.get("/movies/")
+        self.assertEqual(self.client.get("/genres/").status_code, 200)
+
+    @override_settings(YAMOD_QUERY_BUDGETS={"*": 0}, YAMOD_QUERY_BUDGET_ACTION="log")
+    def test_budget_logs(self):
+        with self.assertLogs("yamod.queries", "WARNING") as logs:
+            response = self.client.get("/movies/")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("MovieViewSet.list ran", logs.output[0])
+
+    @override_settings(YAMOD_QUERY_BUDGETS={"*": 6, "GenreViewSet.bulk": (12, 0)}, YAMOD_BULK_BATCH_SIZE=100)
+    def test_budget_per_batch(self):
+        user = get_user_model().objects.get(username="api_user")
+        user.is_superuser = True
+        user.save()
+        items = [{"name": "Genre %d" % i} for i in range(1000)]
+        with self.assertRaises(instrumentation.QueryBudgetExceeded):
+            self.client.post("/genres/bulk/", [{"name": "Other %d" % i} for i in range(1000)], format="json")
+        with override_settings(YAMOD_QUERY_BUDGETS={"*": 6, "GenreViewSet.bulk": (12, 3)}):
+            response = self.client.post("/genres/bulk/", items, format="json")
+            self.assertEqual(response.status_code, 201)
+            pks = [genre["id"] for genre in response.json()]
+            response = self.client.put("/genres/bulk/", [
+                {"id": pk, "name": "Renamed %d" % pk} for pk in pks], format="json")
+            self.assertEqual(response.status_code, 200)
+            response = self.client.delete("/genres/bulk/", pks, format="json")
+            self.assertEqual(response.status_code, 204)
+
+    @override_settings(YAMOD_QUERY_BUDGETS={"*": 0}, YAMOD_QUERY_BUDGET_ACTION="log")
+    def test_budget_log_shortened(self):
+        items = [{"name": "Genre %d" % i} for i in range(1000)]
+        with self.assertLogs("yamod.queries", "WARNING") as logs:
+            self.client.post("/genres/bulk/", items, format="json")
+        lines = logs.output[0].splitlines()
+        self.assertLessEqual(len(lines), instrumentation.LOGGED_STATEMENTS + 2)
+        self.assertLessEqual(max(len(line) for line in lines), instrumentation.LOGGED_STATEMENT_LENGTH + 50)
+
+    def test_destroy_queries(self):
+        user = get_user_model().objects.get(username="api_user")
+        user.is_superuser = True
+        user.save()
+        genre = models.Genre.objects.get(name="Horror")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.delete("/genres/%s/" % genre.pk)
+        self.assertEqual(response.status_code, 204)
+        # the genre is not selected again to be deleted
+        selects = [query["sql"] for query in queries.captured_queries
+                   if query["sql"].startswith('SELECT "yamod_genre"')]
+        self.assertEqual(len(selects), 1)
+
+
+class BenchmarkSuiteTest(YamodBaseTest):
+    '''
+    The data generator and the result comparison of the benchmark
+    suite (benchmarks.py).
+    '''
+
+    def test_catalogue_is_deterministic(self):
+        counts = benchmarks.create_catalogue(300, batch_size=100)
+        self.assertEqual(counts["movie"], 300)
+        self.assertEqual(counts["role"], 900)
+        self.assertEqual(counts["tvshow"], 3)
+        self.assertEqual(models.Episode.objects.count(), counts["episode"])
+        titles = list(models.Movie.objects.order_by("-pk").values_list("movie_title", flat=True)[:300])
+        self.assertEqual(benchmarks.create_catalogue(300, batch_size=100), counts)
+        again = list(models.Movie.objects.order_by("-pk").values_list("movie_title", flat=True)[:300])
+        self.assertEqual(titles, again)
+
+    def test_compare(self):
+        def results(time, queries, q="blade"):
+            return [{"benchmark": "api", "metrics": {"q": q, "queries": queries, "time": time}}]
+
+        self.assertEqual(benchmarks.compare(results(0.010, 2), results(0.011, 2)), [])
+        self.assertEqual(
+            benchmarks.compare(results(0.010, 2), results(0.013, 2)),
+            [("api", {"q": "blade"}, "time", 0.010, 0.013)]
+        )
+        self.assertEqual(
+            benchmarks.compare(results(0.010, 2), results(0.010, 3)),
+            [("api", {"q": "blade"}, "queries", 2, 3)]
+        )
+        # noise, other labels
+        self.assertEqual(benchmarks.compare(results(0.0001, 2), results(0.0003, 2)), [])
+        self.assertEqual(benchmarks.compare(results(0.010, 2), results(0.020, 2, q="run")), [])
+
+
+class TVShowTreeTest(YamodBaseTest):
+    '''
+    GET /tvshows/<pk>/: the show tree in a constant number of queries,
+    and its snapshot (tvshows.py).
+    '''
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION="JWT %s" % self.get_token())
+        self.creator = models.Person.objects.create(credited_name="Vince Gilligan", year_of_birth=1967, gender="m")
+        self.actors = [
+            models.Person.objects.create(credited_name=name, year_of_birth=1960, gender="m")
+            for name in ("Bryan Cranston", "Aaron Paul")
+        ]
+        self.show = self.create_show("Breaking Bad", seasons=2, episodes=3)
+
+    def create_show(self, name, seasons, episodes):
+        show = models.TVShow.objects.create(name=name, released_year=2008, created_by=self.creator)
+        for season_no in range(1, seasons + 1):
+            season = models.Season.objects.create(season_no=season_no, tv_show=show)
+            season.cast.set(self.actors)
+            for number in range(1, episodes + 1):
+                models.Episode.objects.create(name="Episode %d.%d" % (season_no, number), season=season)
+        return show
+
+    def get_tree(self, show, snapshot=False):
+        response = self.client.get("/tvshows/%d/%s" % (show.pk, "?snapshot=1" if snapshot else ""))
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_tree(self):
+        tree = self.get_tree(self.show)
+        self.assertEqual(tree["name"], "Breaking Bad")
+        self.assertEqual(tree["created_by"]["credited_name"], "Vince Gilligan")
+        self.assertEqual([season["season_no"] for season in tree["seasons"]], [1, 2])
+        self.assertEqual([person["credited_name"] for person in tree["seasons"][0]["cast"]],
+                         ["Aaron Paul", "Bryan Cranston"])
+        self.assertEqual([episode["name"] for episode in tree["seasons"][1]["episodes"]],
+                         ["Episode 2.1", "Episode 2.2", "Episode 2.3"])
+
+    def test_constant_queries(self):
+        large = self.create_show("The Wire", seasons=5, episodes=12)
+        # table versions are cached by the first requests
+        self.get_tree(self.show)
+        caches["default"].clear()
+        self.get_tree(large)
+        for show in (self.show, large):
+            caches["default"].clear()
+            # versions, show + created_by, seasons, episodes, cast
+            with self.assertNumQueries(5):
+                self.get_tree(show)
+
+    def test_not_found(self):
+        self.assertEqual(self.client.get("/tvshows/0/").status_code, 404)
+        self.assertEqual(self.client.get("/tvshows/0/?snapshot=1").status_code, 404)
+        self.assertEqual(self.client.get("/tvshows/abc/").status_code, 404)
+
+    def test_list(self):
+        response = self.client.get("/tvshows/?page_size=10&order_by=name")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["results"], [{
+            "id": self.show.pk, "name": "Breaking Bad", "original_title": None, "released_year": 2008,
+            "created_by": {"id": self.creator.pk, "credited_name": "Vince Gilligan"},
+            "season_count": 2, "episode_count": 6,
+        }])
+
+    def test_snapshot(self):
+        tree = self.get_tree(self.show)
+        self.assertEqual(self.get_tree(self.show, snapshot=True), tree)
+        self.assertTrue(models.TVShowSnapshot.objects.filter(pk=self.show.pk).exists())
+        caches["default"].clear()
+        self.get_tree(self.show, snapshot=True)
+        with self.assertNumQueries(1):
+            self.get_tree(self.show, snapshot=True)
+
+    def test_snapshot_rebuilt(self):
+        self.get_tree(self.show, snapshot=True)
+        season = self.show.season_set.get(season_no=1)
+        changes = [
+            lambda: models.Episode.objects.create(name="Pilot", season=season),
+            lambda: season.episode_set.filter(name="Episode 1.1").get().delete(),
+            lambda: self.actors[0].season_set.remove(season),
+            lambda: models.Person.objects.filter(pk=self.creator.pk).get().save(),
+            lambda: setattr(self.creator, "credited_name", "V. Gilligan") or self.creator.save(),
+            lambda: models.Season.objects.create(season_no=3, tv_show=self.show),
+        ]
+        for change in changes:
+            with self.captureOnCommitCallbacks(execute=True):
+                change()
+            self.assertEqual(
+                models.TVShowSnapshot.objects.get(pk=self.show.pk).data,
+                self.get_tree(self.show)
+            )
+        snapshot = models.TVShowSnapshot.objects.get(pk=self.show.pk).data
+        self.assertEqual(snapshot["created_by"]["credited_name"], "V. Gilligan")
+        self.assertEqual(len(snapshot["seasons"]), 3)
+        self.assertEqual([person["credited_name"] for person in snapshot["seasons"][0]["cast"]],
+                         ["Aaron Paul"])
+
+    def test_person_deleted(self):
+        self.get_tree(self.show, snapshot=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.actors[1].delete()
+        snapshot = models.TVShowSnapshot.objects.get(pk=self.show.pk).data
+        self.assertEqual([person["credited_name"] for person in snapshot["seasons"][0]["cast"]],
+                         ["Bryan Cranston"])
+
+    def test_no_snapshot_no_rebuild(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            models.Episode.objects.create(name="Pilot", season=self.show.season_set.first())
+        self.assertFalse(models.TVShowSnapshot.objects.exists())
+
+
+class PersonFilmographyTest(YamodBaseTest):
+    '''
+    GET /people/<pk>/filmography/: roles grouped by role type in a
+    fixed number of queries, aggregates stored for frequently
+    requested people (filmography.py).
+    '''
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION="JWT %s" % self.get_token())
+        self.person = models.Person.objects.create(credited_name="Denis Villeneuve", year_of_birth=1967, gender="m")
+        director = models.RoleType.objects.get(name="Director")
+        producer = models.RoleType.objects.get(name="Producer")
+        for title in ("Blade Runner 2049", "Nomadland", "Blade Runner"):
+            movie = models.Movie.objects.get(movie_title=title)
+            models.Role.objects.create(person=self.person, movie=movie, role=director)
+        models.Role.objects.create(person=self.person, role=producer,
+                                   movie=models.Movie.objects.get(movie_title="Nomadland"))
+
+    def get(self, path):
+        response = self.client.get(path % self.person.pk)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_filmography(self):
+        data = self.get("/people/%d/filmography/")
+        self.assertEqual(data["credited_name"], "Denis Villeneuve")
+        self.assertEqual([group["role"] for group in data["filmography"]], ["Director", "Producer"])
+        self.assertEqual([movie["movie_title"] for movie in data["filmography"][0]["movies"]],
+                         ["Blade Runner", "Blade Runner 2049", "Nomadland"])
+        self.assertEqual(data["summary"], {
+            "movies": 3, "first_year": 1982, "last_year": 2020,
+            "roles": {
+                "Director": {"movies": 3, "first_year": 1982, "last_year": 2020},
+                "Producer": {"movies": 1, "first_year": 2020, "last_year": 2020},
+            },
+        })
+        self.assertEqual(self.get("/people/%d/")["summary"], data["summary"])
+
+    def test_constant_queries(self):
+        # the JWT user is loaded by the first request
+        self.client.get("/people/0/")
+        counts = []
+        for person in (self.person, models.Person.objects.create(
+                credited_name="Nobody", year_of_birth=1990, gender="x")):
+            caches["default"].clear()
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get("/people/%d/filmography/" % person.pk).status_code, 200)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_not_found(self):
+        self.assertEqual(self.client.get("/people/0/").status_code, 404)
+        self.assertEqual(self.client.get("/people/0/filmography/").status_code, 404)
+
+    def test_list(self):
+        response = self.client.get("/people/?fields=credited_name&order_by=-credited_name")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0], {"id": self.person.pk, "credited_name": "Denis Villeneuve"})
+
+    @override_settings(YAMOD_PERSON_SUMMARY_HITS=2)
+    def test_summary_stored(self):
+        for _ in range(2):
+            self.get("/people/%d/")
+        self.assertFalse(models.PersonSummary.objects.exists())
+        summary = self.get("/people/%d/")["summary"]
+        stored = models.PersonSummary.objects.get(pk=self.person.pk)
+        self.assertEqual((stored.movies, stored.first_year, stored.roles), (3, 1982, summary["roles"]))
+        # served from the table: no aggregate queries
+        with CaptureQueriesContext(connection) as queries:
+            self.get("/people/%d/")
+        self.assertFalse([query for query in queries if "COUNT" in query["sql"]])
+
+    @override_settings(YAMOD_PERSON_SUMMARY_HITS=0)
+    def test_summary_refreshed(self):
+        self.get("/people/%d/")
+        actor = models.RoleType.objects.get(name="Actor")
+        changes = [
+            (lambda: models.Role.objects.create(person=self.person, role=actor,
+                                                movie=models.Movie.objects.get(movie_title="The French Dispatch")),
+             lambda summary: self.assertEqual(summary["last_year"], 2021)),
+            (lambda: models.Movie.objects.filter(movie_title="Blade Runner").get().save(),
+             lambda summary: self.assertEqual(summary["first_year"], 1982)),
+            (lambda: setattr(actor, "name", "Actor/Actress") or actor.save(),
+             lambda summary: self.assertIn("Actor/Actress", summary["roles"])),
+            (lambda: models.Role.objects.filter(person=self.person, role=actor).delete(),
+             lambda summary: self.assertEqual(summary["last_year"], 2020)),
+        ]
+        for change, check in changes:
+            change()
+            self.assertTrue(models.PersonSummary.objects.get(pk=self.person.pk).stale)
+            caches["default"].clear()
+            check(self.get("/people/%d/")["summary"])
+            self.assertFalse(models.PersonSummary.objects.get(pk=self.person.pk).stale)
+
+    @override_settings(YAMOD_PERSON_SUMMARY_HITS=0)
+    def test_summary_changed_while_computed(self):
+        aggregate = filmography.aggregate
+
+        def changed_after(pk):
+            data = aggregate(pk)
+            filmography.mark_stale(pk=pk)
+            return data
+
+        # the new and then the stale row are not stored as fresh
+        filmography.aggregate = changed_after
+        try:
+            for _ in range(2):
+                filmography.summary(self.person.pk)
+                self.assertTrue(models.PersonSummary.objects.get(pk=self.person.pk).stale)
+        finally:
+            filmography.aggregate = aggregate
+        summary = filmography.summary(self.person.pk)
+        stored = models.PersonSummary.objects.get(pk=self.person.pk)
+        self.assertFalse(stored.stale)
+        self.assertEqual((stored.movies, stored.roles), (summary["movies"], summary["roles"]))
+
+
+@skipUnless(connection.vendor == "sqlite", "counter triggers are SQLite only")
+class CounterConsistencyTest(YamodBaseTest):
+    '''
+    The counters of counters.py stay exact through model methods,
+    m2m managers, bulk operations and queryset updates, and recount
+    repairs them.
+    '''
+
+    def setUp(self):
+        super().setUp()
+        self.people = [
+            models.Person.objects.create(credited_name="Person %d" % i, year_of_birth=1970, gender="x")
+            for i in range(4)
+        ]
+        self.show = models.TVShow.objects.create(name="Show", released_year=2000)
+        self.other_show = models.TVShow.objects.create(name="Other show", released_year=2001)
+        self.seasons = [models.Season.objects.create(season_no=i, tv_show=self.show) for i in (1, 2)]
+
+    def assertConsistent(self):
+        self.assertEqual(counters.inconsistencies(), [])
+
+    def counter(self, model, pk, field):
+        return model.objects.values_list(field, flat=True).get(pk=pk)
+
+    def test_initial_counts(self):
+        # setUp of YamodBaseTest: every movie has one genre
+        self.assertConsistent()
+        self.assertEqual(models.Genre.objects.get(name="Scifi").movie_count, 2)
+
+    def test_genre_links(self):
+        movie = models.Movie.objects.get(movie_title="Nomadland")
+        drama, comedy, horror = (models.Genre.objects.get(name=name) for name in ("Drama", "Comedy", "Horror"))
+        comedies = comedy.movie_set.count()
+        movie.genre.add(comedy, horror)
+        self.assertEqual(self.counter(models.Genre, comedy.pk, "movie_count"), comedies + 1)
+        horror.movie_set.add(*models.Movie.objects.all())
+        self.assertEqual(self.counter(models.Genre, horror.pk, "movie_count"), models.Movie.objects.count())
+        movie.genre.remove(comedy)
+        comedy.movie_set.clear()
+        self.assertEqual(self.counter(models.Genre, comedy.pk, "movie_count"), 0)
+        movie.genre.set([drama])
+        self.assertConsistent()
+        models.Movie.objects.filter(movie_title__startswith="Blade").delete()
+        self.assertEqual(self.counter(models.Genre, models.Genre.objects.get(name="Scifi").pk, "movie_count"), 0)
+        self.assertConsistent()
+
+    def test_cast(self):
+        movie = models.Movie.objects.get(movie_title="Nomadland")
+        actor, director = (models.RoleType.objects.get(name=name) for name in ("Actor", "Director"))
+        models.Role.objects.create(person=self.people[0], movie=movie, role=actor)
+        models.Role.objects.create(person=self.people[0], movie=movie, role=director)
+        models.Role.objects.bulk_create([
+            models.Role(person=person, movie=movie, role=actor) for person in self.people[1:]
+        ])
+        # a person counts once
+        self.assertEqual(self.counter(models.Movie, movie.pk, "cast_count"), 4)
+        models.Role.objects.filter(person=self.people[0], role=actor).delete()
+        self.assertEqual(self.counter(models.Movie, movie.pk, "cast_count"), 4)
+        other = models.Movie.objects.get(movie_title="Blade Runner")
+        models.Role.objects.filter(person=self.people[1]).update(movie=other)
+        self.assertEqual(self.counter(models.Movie, other.pk, "cast_count"), 1)
+        self.people[2].delete()
+        self.assertEqual(self.counter(models.Movie, movie.pk, "cast_count"), 2)
+        self.assertConsistent()
+
+    def test_episodes(self):
+        first, second = self.seasons
+        models.Episode.objects.create(name="Pilot", season=first)
+        models.Episode.objects.bulk_create([models.Episode(name="Episode %d" % i, season=second) for i in range(3)])
+        self.assertEqual(self.counter(models.Season, second.pk, "episode_count"), 3)
+        self.assertEqual(self.counter(models.TVShow, self.show.pk, "episode_count"), 4)
+        self.assertEqual(self.counter(models.TVShow, self.show.pk, "season_count"), 2)
+        # an episode and a season with its episodes move to the other show
+        other_season = models.Season.objects.create(season_no=1, tv_show=self.other_show)
+        models.Episode.objects.filter(name="Pilot").update(season=other_season)
+        self.assertEqual(self.counter(models.TVShow, self.other_show.pk, "episode_count"), 1)
+        second.refresh_from_db()
+        second.tv_show = self.other_show
+        second.season_no = 2
+        second.save()
+        self.assertEqual(self.counter(models.TVShow, self.other_show.pk, "season_count"), 2)
+        self.assertEqual(self.counter(models.TVShow, self.other_show.pk, "episode_count"), 4)
+        self.assertEqual(self.counter(models.TVShow, self.show.pk, "episode_count"), 0)
+        second.episode_set.all().delete()
+        first.delete()
+        self.assertEqual(self.counter(models.TVShow, self.show.pk, "season_count"), 0)
+        self.assertConsistent()
+
+    def test_save_keeps_counters(self):
+        # instances loaded before a change do not write their counters back
+        show = models.TVShow.objects.get(pk=self.show.pk)
+        season = models.Season.objects.get(pk=self.seasons[0].pk)
+        models.Episode.objects.create(name="Pilot", season=season)
+        show.name = "Renamed"
+        show.save()
+        season.save()
+        self.assertEqual(self.counter(models.TVShow, self.show.pk, "episode_count"), 1)
+        self.assertEqual(self.counter(models.Season, season.pk, "episode_count"), 1)
+        season.refresh_from_db(fields=["episode_count"])
+        self.assertEqual(season.episode_count, 1)
+        self.assertConsistent()
+
+    def test_save_deleted_row(self):
+        # saved without update_fields a row deleted elsewhere is inserted again
+        genre = models.Genre.objects.create(name="Film noir")
+        models.Movie.objects.first().genre.add(genre)
+        genre.refresh_from_db(fields=["movie_count"])
+        self.assertEqual(genre.movie_count, 1)
+        models.Genre.objects.filter(pk=genre.pk).delete()
+        genre.save()
+        self.assertTrue(models.Genre.objects.filter(pk=genre.pk).exists())
+        self.assertEqual(genre.movie_count, 0)
+        self.assertEqual(self.counter(models.Genre, genre.pk, "movie_count"), 0)
+        self.assertConsistent()
+
+    def test_random_operations(self):
+        rng = random.Random(1)
+        movies = list(models.Movie.objects.all())
+        genres = list(models.Genre.objects.all())
+        role_types = list(models.RoleType.objects.all())
+        seasons = self.seasons + [models.Season.objects.create(season_no=1, tv_show=self.other_show)]
+        for _ in range(200):
+            operation = rng.randrange(6)
+            if operation == 0:
+                rng.choice(movies).genre.add(rng.choice(genres))
+            elif operation == 1:
+                rng.choice(movies).genre.remove(rng.choice(genres))
+            elif operation == 2:
+                models.Role.objects.get_or_create(
+                    person=rng.choice(self.people), movie=rng.choice(movies), role=rng.choice(role_types))
+            elif operation == 3:
+                models.Role.objects.filter(pk__in=models.Role.objects.order_by("?").values("pk")[:1]).delete()
+            elif operation == 4:
+                models.Episode.objects.create(name="Episode", season=rng.choice(seasons))
+            else:
+                models.Episode.objects.filter(season=rng.choice(seasons)).update(season=rng.choice(seasons))
+        self.assertConsistent()
+
+    def test_recount(self):
+        models.Genre.objects.update(movie_count=99)
+        models.TVShow.objects.update(season_count=7)
+        wrong = counters.inconsistencies()
+        self.assertIn(("TVShow", self.show.pk, "season_count", 7, 2), wrong)
+        with self.assertRaises(CommandError):
+            call_command("recount", "--check", stdout=io.StringIO())
+        out = io.StringIO()
+        call_command("recount", stdout=out)
+        self.assertIn("Counters recounted", out.getvalue())
+        self.assertConsistent()
+        call_command("recount", "--check", stdout=out)
+
+    def test_catalogue_import(self):
+        importer = catalogue.CatalogueImporter()
+        importer.import_movies([{"id": "tt0900001", "movie_title": "Imported", "released": "1999", "genres": "Drama,Noir"}])
+        importer.import_people([{"id": "nm0900001", "credited_name": "Imported", "year_of_birth": "1960", "gender": "f"}])
+        importer.import_roles([{"movie": "tt0900001", "person": "nm0900001", "role": "Actor"}])
+        self.assertEqual(self.counter(models.Movie, 900001, "cast_count"), 1)
+        self.assertEqual(models.Genre.objects.named("Noir").get().movie_count, 1)
+        self.assertConsistent()
+
+
+    def test_recount_rows(self):
+        # what the model signals run on databases without the triggers
+        season = self.seasons[0]
+        models.Episode.objects.create(name="Pilot", season=season)
+        models.Season.objects.update(episode_count=5)
+        models.TVShow.objects.update(episode_count=5, season_count=5)
+        counters.recount_rows("Episode", [season.pk, None])
+        self.assertEqual(self.counter(models.Season, season.pk, "episode_count"), 1)
+        self.assertEqual(self.counter(models.TVShow, self.show.pk, "episode_count"), 1)
+        counters.recount_rows("Season", [self.show.pk, self.other_show.pk])
+        self.assertEqual(self.counter(models.TVShow, self.show.pk, "season_count"), 2)
+        self.assertEqual(self.counter(models.TVShow, self.other_show.pk, "season_count"), 0)
+
+
+class CounterMigrationTest(TransactionTestCase):
+    '''
+    The counter triggers are dropped while migrations run, so SQLite
+    can rebuild the tables they refer to, and created again afterwards
+    like the search triggers.
+    '''
+
+    def triggers(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE '%\\_count\\_%' ESCAPE '\\'")
+            return {name for name, in cursor.fetchall()}
+
+    @skipUnless(connection.vendor == "sqlite", "counter triggers are SQLite only")
+    def test_table_rebuild(self):
+        self.assertEqual(len(self.triggers()), 12)
+        executor = MigrationExecutor(connection)
+        plan = [(executor.loader.get_migration("yamod", "0022_counters"), False)]
+        emit_pre_migrate_signal(0, False, "default", plan=plan, apps=django_apps)
+        self.assertEqual(self.triggers(), set())
+        # what adding or altering a field of Genre does
+        with connection.schema_editor() as editor:
+            editor._remake_table(models.Genre)
+        movie = models.Movie.objects.create(movie_title="Rebuilt", released=datetime.date(2000,1,1))
+        movie.genre.add(models.Genre.objects.get_or_create_named("Drama")[0])
+        emit_post_migrate_signal(0, False, "default", plan=plan, apps=django_apps)
+        self.assertEqual(len(self.triggers()), 12)
+        self.assertEqual(counters.inconsistencies(), [])
+        movie.genre.clear()
+        self.assertEqual(counters.inconsistencies(), [])
+
+
+    @skipUnless(connection.vendor == "sqlite", "search triggers are SQLite only")
+    def test_search_triggers(self):
+        # a rebuilt table has lost its search triggers
+        with connection.schema_editor() as editor:
+            editor._remake_table(models.Person)
+        self.assertEqual(len(search.missing_triggers()), 3)
+        person = models.Person.objects.create(credited_name="Jared Harris", gender="m", year_of_birth=1961)
+        emit_post_migrate_signal(0, False, "default", plan=[], apps=django_apps)
+        self.assertEqual(search.missing_triggers(), [])
+        self.assertEqual([match["id"] for match in search.search("jared")], [person.pk])
+
+
+class FacetTest(YamodBaseTest):
+    '''
+    GET /facets/: the facet counts of the filtered movies and people
+    with a fixed number of queries, cached per filter (facets.py).
+    '''
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION="JWT %s" % self.get_token())
+        actor = models.RoleType.objects.get(name="Actor")
+        for name, gender, born, title in (
+            ("Harrison Ford", "m", 1942, "Blade Runner"),
+            ("Ryan Gosling", "m", 1980, "Blade Runner 2049"),
+            ("Frances McDormand", "f", 1957, "Nomadland"),
+            ("Tilda Swinton", "f", 1960, "The French Dispatch"),
+            ("Bill Murray", "m", 1950, "Rushmoore"),
+        ):
+            person = models.Person.objects.create(credited_name=name, gender=gender, year_of_birth=born)
+            models.Role.objects.create(person=person, role=actor, movie=models.Movie.objects.get(movie_title=title))
+        # in both Wes Anderson movies
+        models.Role.objects.create(person=person, role=actor,
+                                   movie=models.Movie.objects.get(movie_title="The French Dispatch"))
+
+    def get(self, query=""):
+        response = self.client.get("/facets/" + query)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def genre(self, name):
+        return models.Genre.objects.named(name).get().pk
+
+    def test_unfiltered(self):
+        data = self.get()
+        self.assertEqual(data["movies"]["count"], 5)
+        self.assertEqual([(genre["name"], genre["count"]) for genre in data["movies"]["genre"]],
+                         [("Comedy", 2), ("Scifi", 2), ("Drama", 1)])
+        self.assertEqual(data["movies"]["decade"], [
+            {"value": 1980, "count": 1}, {"value": 1990, "count": 1},
+            {"value": 2010, "count": 1}, {"value": 2020, "count": 2},
+        ])
+        self.assertEqual(data["movies"]["runtime"], [
+            {"value": "90-120", "count": 4}, {"value": "150-", "count": 1},
+        ])
+        self.assertEqual(data["people"], {
+            "count": 5,
+            "gender": [{"value": "m", "count": 3}, {"value": "f", "count": 2}],
+            "birth_decade": [
+                {"value": 1940, "count": 1}, {"value": 1950, "count": 2},
+                {"value": 1960, "count": 1}, {"value": 1980, "count": 1},
+            ],
+        })
+
+    def test_movie_filters(self):
+        data = self.get("?genre=%d&runtime=90-120" % self.genre("Comedy"))
+        self.assertEqual(data["movies"]["count"], 2)
+        self.assertEqual(data["movies"]["genre"], [
+            {"value": self.genre("Comedy"), "name": "Comedy", "count": 2}])
+        self.assertEqual(data["movies"]["decade"], [{"value": 1990, "count": 1}, {"value": 2020, "count": 1}])
+        # the people with a role in these movies, Bill Murray once
+        self.assertEqual(data["people"]["count"], 2)
+        self.assertEqual(data["people"]["gender"], [{"value": "m", "count": 1}, {"value": "f", "count": 1}])
+        data = self.get("?genre=%d,%d&decade=2010" % (self.genre("Comedy"), self.genre("Scifi")))
+        self.assertEqual(data["movies"]["count"], 1)
+        self.assertEqual(data["movies"]["runtime"], [{"value": "150-", "count": 1}])
+
+    def test_person_filters(self):
+        data = self.get("?gender=f")
+        self.assertEqual(data["people"]["count"], 2)
+        self.assertEqual([(genre["name"], genre["count"]) for genre in data["movies"]["genre"]],
+                         [("Comedy", 1), ("Drama", 1)])
+        data = self.get("?gender=m&birth_decade=1950&decade=2020")
+        self.assertEqual(data["movies"]["count"], 1)
+        self.assertEqual(data["people"]["birth_decade"], [{"value": 1950, "count": 1}])
+        self.assertEqual(self.get("?birth_decade=1990")["movies"]["count"], 0)
+
+    def test_invalid_filters(self):
+        for query in ("?decade=1995", "?birth_decade=x", "?runtime=90-100", "?gender=q", "?genre=drama"):
+            response = self.client.get("/facets/" + query)
+            self.assertEqual(response.status_code, 400, query)
+            self.assertIn("Invalid", response.json()["error"])
+
+    def test_cached_until_write(self):
+        self.get()
+        # versions, decade bounds of movies and people, movies, genres, people
+        caches["default"].clear()
+        with self.assertNumQueries(8):
+            self.get("?decade=2020")
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get("?decade=2020")["movies"]["count"], 2)
+        self.assertEqual(cache.stats.snapshot()["facets"]["hits"], 1)
+        movie = models.Movie.objects.create(movie_title="Asteroid City", released=datetime.date(2023, 6, 23))
+        movie.genre.add(models.Genre.objects.named("Comedy").get())
+        data = self.get("?decade=2020")
+        self.assertEqual(data["movies"]["count"], 3)
+        self.assertEqual(data["movies"]["genre"][0], {"value": self.genre("Comedy"), "name": "Comedy", "count": 2})
+        self.assertEqual(self.get()["movies"]["genre"][0]["count"], 3)
+
+
+class AdminPerformanceModeTest(YamodBaseTest):
+    '''
+    The admin change lists in performance mode (admin.py): estimated
+    counts, indexed search and the cached gender filter.
+    '''
+
+    def setUp(self):
+        super().setUp()
+        admin_user = get_user_model().objects.create(
+            username="admin_user", is_active=True, is_staff=True, is_superuser=True)
+        self.client.force_login(admin_user)
+        for name, gender in (("Frances McDormand", "f"), ("Tilda Swinton", "f"), ("Bill Murray", "m")):
+            models.Person.objects.create(credited_name=name, gender=gender, year_of_birth=1960)
+
+    def changelist(self, path):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return response, [query["sql"] for query in queries.captured_queries]
+
+    def test_estimated_count(self):
+        max_pk = models.Movie.objects.aggregate(pk=Max("pk"))["pk"]
+        models.Movie.objects.get(movie_title="Nomadland").delete()
+        # small tables are counted
+        self.assertEqual(EstimatedCountPaginator(models.Movie.objects.order_by("pk"), 2).count, 4)
+        with override_settings(YAMOD_ADMIN_EXACT_COUNT_LIMIT=3):
+            self.assertEqual(estimated_count(models.Movie), max_pk)
+            self.assertEqual(EstimatedCountPaginator(models.Movie.objects.order_by("pk"), 2).count, max_pk)
+            self.assertEqual(EstimatedCountPaginator(
+                models.Movie.objects.filter(runtime__gte=100).order_by("pk"), 2).count, 3)
+            self.assertEqual(EstimatedCountPaginator(models.Movie.objects.order_by("pk"), 2, count=7).count, 7)
+
+    @override_settings(YAMOD_ADMIN_EXACT_COUNT_LIMIT=3)
+    def test_no_count_queries(self):
+        response, queries = self.changelist("/admin/yamod/movie/")
+        self.assertContains(response, "Blade Runner 2049")
+        self.assertEqual([sql for sql in queries if "COUNT(" in sql], [])
+        # filtered: the result is counted, not the whole table
+        response, queries = self.changelist("/admin/yamod/movie/?runtime=100")
+        self.assertContains(response, "The French Dispatch")
+        self.assertNotContains(response, "Nomadland")
+        self.assertEqual(len([sql for sql in queries if "COUNT(" in sql]), 1)
+        with override_settings(YAMOD_ADMIN_PERFORMANCE_MODE=False):
+            response, queries = self.changelist("/admin/yamod/movie/?runtime=100")
+            self.assertEqual(len([sql for sql in queries if "COUNT(" in sql]), 2)
+
+    def test_search(self):
+        response, queries = self.changelist("/admin/yamod/genre/?q=%20dra")
+        self.assertContains(response, "Drama")
+        self.assertNotContains(response, "Comedy")
+        response, queries = self.changelist("/admin/yamod/movie/?q=blade%20run")
+        self.assertContains(response, "Blade Runner 2049")
+        self.assertNotContains(response, "Nomadland")
+        self.assertIn("yamod_search", " ".join(queries))
+        response, queries = self.changelist("/admin/yamod/person/?q=tilda")
+        self.assertContains(response, "Tilda Swinton")
+        self.assertNotContains(response, "Bill Murray")
+
+    def test_default_search(self):
+        # without search_queryset the search of ModelAdmin
+        model_admin = admin.PerformanceModeAdmin(models.Genre, admin_site)
+        model_admin.search_fields = ("name",)
+        queryset, may_have_duplicates = model_admin.get_search_results(
+            None, models.Genre.objects.all(), "rama")
+        self.assertEqual([genre.name for genre in queryset], ["Drama"])
+        self.assertFalse(may_have_duplicates)
+
+    def test_gender_filter(self):
+        response, queries = self.changelist("/admin/yamod/person/")
+        self.assertContains(response, "female (2)")
+        response, queries = self.changelist("/admin/yamod/person/?gender__exact=f")
+        self.assertContains(response, "Tilda Swinton")
+        self.assertNotContains(response, "Bill Murray")
+        # counts from the cache, the page is not counted
+        self.assertEqual([sql for sql in queries if "COUNT(" in sql], [])
+        models.Person.objects.create(credited_name="Lea Seydoux", gender="f", year_of_birth=1985)
+        response, queries = self.changelist("/admin/yamod/person/?gender__exact=f")
+        self.assertContains(response, "female (3)")
+        self.assertContains(response, "Lea Seydoux")
@@ -0,0 +1,130 @@
+'''
+The tree of a TV show: the show with created_by, its seasons (with
+cast) and their episodes, for GET /tvshows/<pk>/ (views.TVShowViewSet).
+
+tree_queryset loads any number of shows with four queries: shows
+joined with created_by, then one prefetch query each for the seasons,
+the episodes and the cast, whatever the number of seasons or episodes.
+
+With ?snapshot=1 the tree is read from models.TVShowSnapshot in one
+query. Snapshots are built on first read and rebuilt after the commit
+that changed the show, a season, an episode, the cast or a person in
+the tree (signals.py); a change rolled back leaves them as they are.
+'''
+import threading
+
+from django.db import transaction
+from django.db.models import Prefetch, Q
+from django.utils import timezone
+
+from . import models
+from . import routers
+
+_local = threading.local()
+
+
+def tree_queryset():
+    return models.TVShow.objects.select_related("created_by").prefetch_related(
+        Prefetch("season_set", queryset=models.Season.objects.order_by("season_no").prefetch_related(
+            Prefetch("episode_set", queryset=models.Episode.objects.order_by("pk")),
+            Prefetch("cast", queryset=models.Person.objects.only("credited_name").order_by(
+                "credited_name", "pk")),
+        ))
+    )
+
+
+def person(person):
+    if person is None:
+        return None
+    return {"id": person.pk, "credited_name": person.credited_name}
+
+
+def serialize_show(show):
+    return {"id": show.pk, "name": show.name, "original_title": show.original_title,
+            "released_year": show.released_year, "created_by": person(show.created_by),
+            "season_count": show.season_count, "episode_count": show.episode_count}
+
+
+def serialize_tree(show):
+    data = serialize_show(show)
+    data["seasons"] = [
+        {
+            "id": season.pk,
+            "season_no": season.season_no,
+            "episode_count": season.episode_count,
+            "cast": [person(member) for member in season.cast.all()],
+            "episodes": [{"id": episode.pk, "name": episode.name} for episode in season.episode_set.all()],
+        }
+        for season in show.season_set.all()
+    ]
+    return data
+
+
+def rebuild(pks, existing=None):
+    '''
+    Rebuilds the snapshots of the given shows, returns their trees.
+    existing are the pks with a snapshot (default: looked up).
+    '''
+    # stored for everyone: not from a lagging replica (routers.py)
+    with routers.reading_primary():
+        trees = {show.pk: serialize_tree(show) for show in tree_queryset().filter(pk__in=pks)}
+        if existing is None:
+            existing = list(models.TVShowSnapshot.objects.filter(pk__in=trees).values_list("pk", flat=True))
+    existing = set(existing) & set(trees)
+    now = timezone.now()
+    if existing:
+        # bulk_update does not set auto_now fields
+        models.TVShowSnapshot.objects.bulk_update(
+            [models.TVShowSnapshot(tv_show_id=pk, data=trees[pk], updated_at=now) for pk in existing],
+            ["data", "updated_at"]
+        )
+    # a concurrent build of a new snapshot has the same data
+    models.TVShowSnapshot.objects.bulk_create(
+        [models.TVShowSnapshot(tv_show_id=pk, data=tree) for pk, tree in trees.items()
+         if pk not in existing],
+        ignore_conflicts=True
+    )
+    return trees
+
+
+def snapshot(pk):
+    '''
+    The snapshot of a show, built if there is none. Raises
+    TVShow.DoesNotExist.
+    '''
+    data = models.TVShowSnapshot.objects.filter(pk=pk).values_list("data", flat=True).first()
+    if data is None:
+        data = rebuild([pk], existing=()).get(int(pk))
+        if data is None:
+            raise models.TVShow.DoesNotExist()
+    return data
+
+
+def schedule(pks):
+    '''
+    Rebuilds the existing snapshots of the shows after the commit.
+    Per thread: another thread's rebuild would not see this thread's
+    transaction.
+    '''
+    pending = getattr(_local, "pending", None)
+    if pending is None:
+        pending = _local.pending = set()
+    pending.update(pks)
+    transaction.on_commit(flush)
+
+
+def flush():
+    # on_commit runs once per scheduled change, the first one rebuilds all
+    pks, _local.pending = getattr(_local, "pending", set()), set()
+    if pks:
+        pks = list(models.TVShowSnapshot.objects.filter(pk__in=pks).values_list("pk", flat=True))
+    if pks:
+        rebuild(pks, existing=pks)
+
+
+def shows_of_person(pk):
+    # the shows with a snapshot the person appears in (the cast rows
+    # still exist in pre_delete)
+    return models.TVShowSnapshot.objects.filter(
+        Q(tv_show__created_by=pk) | Q(tv_show__season__cast=pk)
+    ).values_list("pk", flat=True).distinct()
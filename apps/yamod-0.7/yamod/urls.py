@@ -1,9 +1,21 @@
 from django.contrib import admin
 from django.urls import include, path
 from rest_framework import routers
+from . import async_views
 from . import views
 
 router = routers.DefaultRouter()
 router.register('genres', views.GenreViewSet, basename="genres")
+router.register('movies', views.MovieViewSet, basename="movies")
+router.register('people', views.PersonViewSet, basename="people")
+router.register('tvshows', views.TVShowViewSet, basename="tvshows")
+router.register('facets', views.FacetViewSet, basename="facets")
+router.register('search', views.SearchViewSet, basename="search")
+router.register('autocomplete', views.AutocompleteViewSet, basename="autocomplete")
+router.register('metrics', views.MetricsViewSet, basename="metrics")
 
-
+# Async versions of the read endpoints (see async_views.py), served under /async/
+async_urlpatterns = [
+    path('genres/', async_views.AsyncGenreView.as_view()),
+    path('genres/<pk>/', async_views.AsyncGenreView.as_view(detail=True)),
+]
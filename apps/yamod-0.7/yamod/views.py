@@ -1,7 +1,13 @@
 import json
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Prefetch
+from django.http import HttpResponse
 from rest_framework import viewsets
 from rest_framework.response import Response
 from rest_framework import permissions
+from rest_framework.decorators import action
+from rest_framework.settings import api_settings
 # Note: Django in general allows the exchange 
 # of its standard user model through your own. 
 # The "get_user_model" function is a helper function 
@@ -12,17 +18,35 @@ from rest_framework import permissions
 # generic. 
 # Equivalent: from django.contrib.auth.models import User
 
+from . import autocomplete
+from . import bulk
+from . import cache
+from . import facets
+from . import filmography
+from . import instrumentation
 from . import models
+from . import search
+from . import tvshows
+from .conditional import conditional
+from .fieldsets import SparseFieldsMixin
+from .pagination import KeysetPaginationMixin
+from .streaming import NDJSONRenderer, stream_format, stream_response
 
-class GenreViewSet(viewsets.ViewSet):
+class GenreViewSet(KeysetPaginationMixin, viewsets.ViewSet):
 
     permission_classes = [permissions.IsAuthenticated]
+    ordering_fields = ("pk", "id", "name")
+    # ?order_by= is rejected, no order_by keeps the table order
+    default_ordering = None
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [NDJSONRenderer]
 
+    @conditional(models.Genre)
     def list(self, request, format = None):
         if request.GET.get("name") is None:
             queryset = models.Genre.objects.all()
         else:
-            queryset = models.Genre.objects.filter(name=request.GET.get("name"))
+            # case insensitive lookup on the unique name_key index
+            queryset = models.Genre.objects.named(request.GET.get("name"))
 
         # Django Model manager's have not only a .filter method, but also 
         # an order_by method - 
@@ -37,11 +61,35 @@ class GenreViewSet(viewsets.ViewSet):
         # GET /genres/ should be still possible
         # Note: tested by test_list_genres_order_by_desc and test_list_genres_order_by_asc in tests.py
         # your code here
-        if request.GET.get("order_by") is not None:
-            queryset = queryset.order_by(request.GET.get("order_by"))
+        order_by = request.GET.get("order_by")
+        if order_by is not None and not self.is_valid_ordering(order_by):
+            return Response(
+                {"error": "Invalid order_by."},
+                status = 400
+            )
+        # Streamed lists (?stream=1 or Accept: application/x-ndjson),
+        # see streaming.stream_response
+        stream = stream_format(request)
+        if stream is not None:
+            if order_by is not None:
+                queryset = queryset.order_by(order_by)
+            return stream_response(queryset, ("pk", "name"), stream)
+        # Keyset pagination, see pagination.KeysetPaginationMixin
+        if self.is_paginated(request):
+            return self.paginated_response(
+                request, queryset, order_by or "pk",
+                lambda genre: (genre.pk, genre.name)
+            )
+        if order_by is not None:
+            queryset = queryset.order_by(order_by)
         # your code here
+        # Plain lists are served from the cache, see cache.py
+        results = cache.get_or_compute(
+            cache.genre_list_key(request.GET.get("name"), order_by),
+            lambda: [(genre.pk, genre.name) for genre in queryset]
+        )
         return Response(
-            [(genre.pk, genre.name) for genre in queryset],
+            results,
             status = 200
         )
 
@@ -61,21 +109,38 @@ class GenreViewSet(viewsets.ViewSet):
                 {"error": "No name given."},
                 status = 400
             )
+        if not isinstance(request.data["name"], str):
+            return Response(
+                {"error": "name must be a string."},
+                status = 400
+            )
         # your code here
-        genre = models.Genre.objects.create(name = request.data["name"])
+        try:
+            with transaction.atomic():
+                genre = models.Genre.objects.create(name = request.data["name"])
+        except IntegrityError:
+            # Genre names are unique, see models.Genre.name_key
+            return Response(
+                {"error": "Genre already exists."},
+                status = 400
+            )
         return Response(
             {"name": genre.name, "id": genre.pk},
             status = 201
         ) 
 
+    @conditional(models.Genre)
     def retrieve(self, request, pk=None, format=None):
-        try:
+        def load():
             genre = models.Genre.objects.get(pk = pk)
+            return {"name": genre.name,"pk": genre.pk}
+        try:
+            # int() so "06" and "6" share one cache entry
             return Response(
-                {"name": genre.name,"pk": genre.pk},
+                cache.get_or_compute(cache.genre_detail_key(int(pk)), load),
                 status = 200
             )
-        except models.Genre.DoesNotExist:
+        except (models.Genre.DoesNotExist, ValueError):
             return Response(
                 status = 404
             )
@@ -93,9 +158,21 @@ class GenreViewSet(viewsets.ViewSet):
                 return Response(
                     status = 400
                 )
+            if not isinstance(request.data["name"], str):
+                return Response(
+                    {"error": "name must be a string."},
+                    status = 400
+                )
             # your code here
             genre.name = request.data["name"]
-            genre.save()
+            try:
+                with transaction.atomic():
+                    genre.save()
+            except IntegrityError:
+                return Response(
+                    {"error": "Genre already exists."},
+                    status = 400
+                )
             return Response(
                 {"name": genre.name,"pk": genre.pk},
                 status = 200                
@@ -125,7 +202,7 @@ class GenreViewSet(viewsets.ViewSet):
         # Note: test covered by YamodGenreAPITest.test_delete_not_existing_genre
         # your code here
         try:
-            models.Genre.objects.get(pk = pk)
+            genre = models.Genre.objects.get(pk = pk)
         except models.Genre.DoesNotExist:
             return Response(
                 status = 404
@@ -135,16 +212,431 @@ class GenreViewSet(viewsets.ViewSet):
                 status = 403
             )
         # your code here
-        genre = models.Genre.objects.filter(
-            pk = pk
-        ).delete()
+        # deleting the fetched instance saves the collector's re-select
+        genre.delete()
         return Response(
             status=204
         )
 
+    @action(detail=False, methods=["post", "put", "delete"])
+    def bulk(self, request, format=None):
+        '''
+        Batch variants of create, update and destroy, written in one
+        transaction (see bulk.py):
+
+        POST   /genres/bulk/  [{"name": "Scifi"}, ...]
+        PUT    /genres/bulk/  [{"id": 1, "name": "Scifi"}, ...]
+        DELETE /genres/bulk/  [1, 2, ...]
+
+        Every item is validated like in create/update/destroy. If any
+        item is invalid nothing is written and a 400 lists the errors
+        by index of the item in the payload.
+        '''
+        items = request.data
+        max_size = getattr(settings, "YAMOD_MAX_BULK_SIZE", 10000)
+        if not isinstance(items, list):
+            return Response(
+                {"error": "Expected a list."},
+                status = 400
+            )
+        if len(items) > max_size:
+            return Response(
+                {"error": "At most %d items per request." % max_size},
+                status = 400
+            )
+        if request.method == "DELETE" and not(request.user.is_superuser):
+            return Response(
+                status = 403
+            )
+        try:
+            if request.method == "POST":
+                return Response(bulk.create_genres(items), status = 201)
+            if request.method == "PUT":
+                return Response(bulk.update_genres(items), status = 200)
+            bulk.delete_genres(items)
+            return Response(status = 204)
+        except bulk.BulkError as e:
+            return Response(
+                {"errors": e.errors},
+                status = 400
+            )
+
+
+# Every table a movie representation is read from
+MOVIE_TABLES = (models.Movie, models.Genre, models.Movie.genre.through,
+                models.Role, models.Person, models.RoleType)
+
+class MovieViewSet(KeysetPaginationMixin, SparseFieldsMixin, viewsets.ViewSet):
+    '''
+    Read only movie API. Related objects are embedded on request:
+
+    GET /movies/?expand=genres,cast
+    GET /movies/1/?expand=cast&fields=movie_title
+
+    The relations are loaded with one prefetch query each, so a list
+    takes the same number of queries for 1 and for 1000 movies.
+    '''
+
+    permission_classes = [permissions.IsAuthenticated]
+    ordering_fields = ("pk", "id", "movie_title", "released", "runtime")
+    sparse_fields = ("id", "movie_title", "original_title", "released", "runtime", "cast_count")
+    expandable = ("genres", "cast")
+
+    def get_expand(self, request):
+        expand = request.GET.get("expand")
+        expand = set(expand.split(",")) if expand else set()
+        unknown = expand - set(self.expandable)
+        if unknown:
+            raise ValueError("Unknown expand: %s" % ", ".join(sorted(unknown)))
+        return expand
+
+    def query_error(self, request):
+        try:
+            self.get_fields(request)
+            self.get_expand(request)
+        except ValueError as e:
+            return Response({"error": str(e)}, status = 400)
+        return super().query_error(request)
+
+    def get_queryset(self, fields, expand, order_by="pk"):
+        # Only the requested columns (and the ordering key) are fetched, see
+        # fieldsets.py. Without relations to embed plain dicts are enough.
+        columns = list(fields)
+        order_field = order_by.lstrip("-")
+        if order_field not in ("pk", "id") and order_field not in columns:
+            columns.append(order_field)
+        if not expand:
+            return models.Movie.objects.values(*columns)
+        queryset = models.Movie.objects.only(*columns)
+        if "genres" in expand:
+            queryset = queryset.prefetch_related(
+                Prefetch("genre", queryset=models.Genre.objects.order_by("name"))
+            )
+        if "cast" in expand:
+            # Role -> Person and Role -> RoleType are joined into the prefetch
+            queryset = queryset.prefetch_related(
+                Prefetch("role_set", queryset=models.Role.objects.select_related(
+                    "person", "role").only(
+                    "movie", "person__credited_name", "role__name").order_by(
+                    "role__name", "person__credited_name"))
+            )
+        return queryset
+
+    def serialize(self, movie, fields, expand):
+        if isinstance(movie, dict):
+            return {field: movie[field] for field in fields}
+        data = {field: getattr(movie, field) for field in fields}
+        if "genres" in expand:
+            data["genres"] = [{"id": genre.pk, "name": genre.name} for genre in movie.genre.all()]
+        if "cast" in expand:
+            data["cast"] = [
+                {
+                    "person": {"id": role.person.pk, "credited_name": role.person.credited_name},
+                    "role": role.role.name,
+                }
+                for role in movie.role_set.all()
+            ]
+        return data
+
+    @conditional(*MOVIE_TABLES)
+    def list(self, request, format = None):
+        try:
+            fields = self.get_fields(request)
+            expand = self.get_expand(request)
+        except ValueError as e:
+            return Response({"error": str(e)}, status = 400)
+        order_by = request.GET.get("order_by") or "pk"
+        if not self.is_valid_ordering(order_by):
+            return Response(
+                {"error": "Invalid order_by."},
+                status = 400
+            )
+        queryset = self.get_queryset(fields, expand, order_by)
+        if self.is_paginated(request):
+            return self.paginated_response(
+                request, queryset, order_by,
+                lambda movie: self.serialize(movie, fields, expand)
+            )
+        return Response(
+            [self.serialize(movie, fields, expand) for movie in queryset.order_by(order_by)],
+            status = 200
+        )
+
+    @conditional(*MOVIE_TABLES)
+    def retrieve(self, request, pk=None, format=None):
+        try:
+            fields = self.get_fields(request)
+            expand = self.get_expand(request)
+        except ValueError as e:
+            return Response({"error": str(e)}, status = 400)
+        try:
+            movie = self.get_queryset(fields, expand).get(pk = pk)
+        except (models.Movie.DoesNotExist, ValueError):
+            return Response(
+                status = 404
+            )
+        return Response(
+            self.serialize(movie, fields, expand),
+            status = 200
+        )
+
+
+PERSON_TABLES = (models.Person, models.Role, models.Movie, models.RoleType)
+
+class PersonViewSet(KeysetPaginationMixin, SparseFieldsMixin, viewsets.ViewSet):
+    '''
+    Read only person API:
+
+    GET /people/                    people (?fields=, ?order_by=, paginated like /movies/)
+    GET /people/1/                  a person with the aggregates of their roles
+    GET /people/1/filmography/      the same with the movies grouped by role type
+
+    Both take a fixed number of queries however many roles a person
+    has (see filmography.py).
+    '''
+
+    permission_classes = [permissions.IsAuthenticated]
+    ordering_fields = ("pk", "id", "credited_name", "year_of_birth")
+    sparse_fields = ("id", "credited_name", "year_of_birth", "year_of_death", "gender")
+
+    @conditional(*PERSON_TABLES)
+    def list(self, request, format = None):
+        try:
+            fields = self.get_fields(request)
+        except ValueError as e:
+            return Response({"error": str(e)}, status = 400)
+        order_by = request.GET.get("order_by") or "pk"
+        if not self.is_valid_ordering(order_by):
+            return Response(
+                {"error": "Invalid order_by."},
+                status = 400
+            )
+        columns = list(fields)
+        if order_by.lstrip("-") not in ("pk", "id") + fields:
+            columns.append(order_by.lstrip("-"))
+        queryset = models.Person.objects.values(*columns)
+        serialize = lambda person: {field: person[field] for field in fields}
+        if self.is_paginated(request):
+            return self.paginated_response(request, queryset, order_by, serialize)
+        return Response(
+            [serialize(person) for person in queryset.order_by(order_by)],
+            status = 200
+        )
+
+    def query_error(self, request):
+        if self.action == "list":
+            try:
+                self.get_fields(request)
+            except ValueError as e:
+                return Response({"error": str(e)}, status = 400)
+        return super().query_error(request)
+
+    def get_person(self, pk):
+        return models.Person.objects.values(*self.sparse_fields).get(pk = pk)
+
+    @conditional(*PERSON_TABLES)
+    def retrieve(self, request, pk=None, format=None):
+        try:
+            person = self.get_person(pk)
+        except (models.Person.DoesNotExist, ValueError):
+            return Response(
+                status = 404
+            )
+        person["summary"] = filmography.summary(person["id"])
+        return Response(
+            person,
+            status = 200
+        )
+
+    @action(detail=True)
+    @conditional(*PERSON_TABLES)
+    def filmography(self, request, pk=None, format=None):
+        try:
+            person = self.get_person(pk)
+        except (models.Person.DoesNotExist, ValueError):
+            return Response(
+                status = 404
+            )
+        person["summary"] = filmography.summary(person["id"])
+        person["filmography"] = filmography.filmography(person["id"])
+        return Response(
+            person,
+            status = 200
+        )
+
+
+TVSHOW_TABLES = (models.TVShow, models.Season, models.Season.cast.through,
+                 models.Episode, models.Person)
+
+class TVShowViewSet(KeysetPaginationMixin, viewsets.ViewSet):
+    '''
+    Read only TV show API:
+
+    GET /tvshows/                   shows with created_by
+    GET /tvshows/1/                 the tree: seasons with cast and episodes
+    GET /tvshows/1/?snapshot=1      the same tree, precomputed
+
+    A tree takes four queries for any number of seasons and episodes,
+    a snapshot one (see tvshows.py).
+    '''
+
+    permission_classes = [permissions.IsAuthenticated]
+    ordering_fields = ("pk", "id", "name", "released_year")
+
+    @conditional(*TVSHOW_TABLES)
+    def list(self, request, format = None):
+        order_by = request.GET.get("order_by") or "pk"
+        if not self.is_valid_ordering(order_by):
+            return Response(
+                {"error": "Invalid order_by."},
+                status = 400
+            )
+        queryset = models.TVShow.objects.select_related("created_by")
+        if self.is_paginated(request):
+            return self.paginated_response(request, queryset, order_by, tvshows.serialize_show)
+        return Response(
+            [tvshows.serialize_show(show) for show in queryset.order_by(order_by)],
+            status = 200
+        )
+
+    @conditional(*TVSHOW_TABLES)
+    def retrieve(self, request, pk=None, format=None):
+        try:
+            if request.GET.get("snapshot") in ("1", "true"):
+                data = tvshows.snapshot(pk)
+            else:
+                data = tvshows.serialize_tree(tvshows.tree_queryset().get(pk = pk))
+        except (models.TVShow.DoesNotExist, ValueError):
+            return Response(
+                status = 404
+            )
+        return Response(
+            data,
+            status = 200
+        )
+
+
+class FacetViewSet(viewsets.ViewSet):
+    '''
+    Facet counts of the filtered movies and people:
+
+    GET /facets/?genre=3&decade=1990&runtime=90-120&gender=f&birth_decade=1970
+
+    One conditional aggregate query per model and one for the genres,
+    cached per filter signature (see facets.py).
+    '''
+
+    permission_classes = [permissions.IsAuthenticated]
+
+    def query_error(self, request):
+        try:
+            facets.parse_filters(request.GET)
+        except ValueError as e:
+            return Response({"error": str(e)}, status = 400)
+        return None
+
+    @conditional(*facets.TABLES)
+    def list(self, request, format = None):
+        try:
+            filters = facets.parse_filters(request.GET)
+        except ValueError as e:
+            return Response({"error": str(e)}, status = 400)
+        return Response(
+            facets.facets(filters),
+            status = 200
+        )
+
+
+class SearchViewSet(viewsets.ViewSet):
+    '''
+    Ranked prefix search over movies, people, TV shows and episodes
+    (see search.py):
+
+    GET /search/?q=blade run
+    GET /search/?q=gos&kind=person&limit=5
+    '''
+
+    permission_classes = [permissions.IsAuthenticated]
+
+    def list(self, request, format = None):
+        kinds = request.GET.get("kind")
+        kinds = kinds.split(",") if kinds else None
+        if kinds and not set(kinds) <= set(search.SOURCES):
+            return Response(
+                {"error": "Invalid kind."},
+                status = 400
+            )
+        try:
+            limit = int(request.GET.get("limit", 20))
+        except ValueError:
+            limit = 0
+        if not (0 < limit <= 100):
+            return Response(
+                {"error": "limit must be between 1 and 100."},
+                status = 400
+            )
+        return Response(
+            search.search(request.GET.get("q", ""), kinds, limit),
+            status = 200
+        )
+
 
+class AutocompleteViewSet(viewsets.ViewSet):
+    '''
+    Type-ahead over movie titles, TV show names and credited names,
+    answered from the in-memory index of autocomplete.py:
 
+    GET /autocomplete/?q=bla
+    GET /autocomplete/?q=ry&kind=person&limit=5
+    '''
 
+    permission_classes = [permissions.IsAuthenticated]
+
+    def list(self, request, format = None):
+        kinds = request.GET.get("kind")
+        kinds = kinds.split(",") if kinds else None
+        if kinds and not set(kinds) <= set(autocomplete.SOURCES):
+            return Response(
+                {"error": "Invalid kind."},
+                status = 400
+            )
+        try:
+            limit = int(request.GET.get("limit", 10))
+        except ValueError:
+            limit = 0
+        if not (0 < limit <= 50):
+            return Response(
+                {"error": "limit must be between 1 and 50."},
+                status = 400
+            )
+        q = request.GET.get("q", "")
+        return Response(
+            autocomplete.index.complete(q, kinds, limit) if q else [],
+            status = 200
+        )
 
 
+class MetricsViewSet(viewsets.ViewSet):
+    '''
+    In-process counters for scraping (GET /metrics/): cache hits and
+    misses and the request histograms of instrumentation.py.
+    '''
 
+    permission_classes = [permissions.IsAuthenticated]
+
+    def list(self, request, format = None):
+        return Response(
+            {"cache": cache.stats.snapshot(), "requests": instrumentation.metrics.snapshot()},
+            status = 200
+        )
+
+    @action(detail=False)
+    def prometheus(self, request, format=None):
+        '''
+        The request histograms in the Prometheus text format
+        (GET /metrics/prometheus/).
+        '''
+        return HttpResponse(
+            instrumentation.metrics.prometheus(),
+            content_type = "text/plain; version=0.0.4"
+        )
@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'movie_site.settings')
 
 application = get_asgi_application()
+
+# load the type-ahead index before the first query (yamod/autocomplete.py)
+from yamod import autocomplete  # noqa: E402
+
+autocomplete.index.warm()
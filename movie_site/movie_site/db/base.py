@@ -0,0 +1,31 @@
+'''
+SQLite backend applying PRAGMAs to every new connection:
+
+    DATABASES = {
+        'default': {
+            'ENGINE': 'movie_site.db',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'OPTIONS': {
+                'pragmas': {'journal_mode': 'WAL', 'synchronous': 'NORMAL'},
+            },
+        }
+    }
+
+The pragmas are executed in the given order, everything else in
+OPTIONS is passed on to sqlite3.connect like with the stock backend.
+'''
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        kwargs.pop("pragmas", None)
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.settings_dict["OPTIONS"].get("pragmas", {}).items():
+            conn.execute("PRAGMA %s = %s" % (name, value))
+        return conn
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -42,6 +43,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'yamod.middleware.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -49,6 +51,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'yamod.middleware.replica_pinning_middleware',
 ]
 
 ROOT_URLCONF = 'movie_site.urls'
@@ -75,13 +78,111 @@ WSGI_APPLICATION = 'movie_site.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
+# Database profiles, chosen with the MOVIE_SITE_DB_PROFILE environment
+# variable (default: development, deployments opt in to production):
+#
+# - development: plain SQLite, a connection per request
+# - production: tuned for concurrent workers (see movie_site/db/base.py):
+#   WAL lets readers run next to a writer, writers wait up to 5s for the
+#   lock instead of failing with "database is locked", connections are
+#   kept open between requests
+
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    # durable at checkpoints, safe against corruption with WAL
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+    # negative: KiB instead of pages
+    'cache_size': -64 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+DATABASE_PROFILES = {
+    'development': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+    },
+    'production': {
+        'ENGINE': 'movie_site.db',
+        'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': 600,
+        'OPTIONS': {
+            'pragmas': SQLITE_PRAGMAS,
+        },
+    },
+}
+
+DATABASES = {
+    'default': DATABASE_PROFILES[os.environ.get('MOVIE_SITE_DB_PROFILE', 'development')],
+}
+
+# Read replicas of the yamod app (see yamod/routers.py): copies of the
+# default database, e.g. MOVIE_SITE_REPLICA_DB=/srv/replica.sqlite3.
+# Tests read the default database through them (MIRROR).
+if os.environ.get('MOVIE_SITE_REPLICA_DB'):
+    DATABASES['replica'] = dict(
+        DATABASES['default'],
+        NAME=os.environ['MOVIE_SITE_REPLICA_DB'],
+        TEST={'MIRROR': 'default'},
+    )
+
+DATABASE_ROUTERS = ['yamod.routers.ReplicaRouter']
+YAMOD_PRIMARY_DATABASE = 'default'
+YAMOD_REPLICA_DATABASES = [alias for alias in DATABASES if alias != 'default']
+
+# A second database for yamod.tests.ReplicaRouterTest (an in-memory
+# test database of its own), no replica outside that test: it overrides
+# YAMOD_REPLICA_DATABASES itself. Only connected to by that test.
+DATABASES['yamod_test_replica'] = dict(
+    DATABASES['default'],
+    NAME=BASE_DIR / 'yamod_test_replica.sqlite3',
+    TEST={'MIRROR': None},
+)
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# yamod caches genre API responses in the cache named by YAMOD_CACHE,
+# any other backend (e.g. memcached or redis) can be plugged in here.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
 
+YAMOD_CACHE = 'default'
+YAMOD_CACHE_TIMEOUT = 3600
+
+# Maximum number of queries per request of a view ("*": all others),
+# see yamod/instrumentation.py. Over budget requests are logged to
+# "yamod.queries", or raise with YAMOD_QUERY_BUDGET_ACTION = 'raise'.
+YAMOD_QUERY_BUDGETS = {
+    'GenreViewSet.create': 10,
+    'GenreViewSet.update': 10,
+    'GenreViewSet.destroy': 10,
+    # queries, queries per batch of YAMOD_BULK_BATCH_SIZE items (yamod/bulk.py)
+    'GenreViewSet.bulk': (10, 7),
+    # builds a missing snapshot (?snapshot=1)
+    'TVShowViewSet.retrieve': 8,
+    # compute and store the aggregates of a person (yamod/filmography.py)
+    'PersonViewSet.retrieve': 8,
+    'PersonViewSet.filmography': 9,
+    # decade bounds, movie, genre and person counts (yamod/facets.py)
+    'FacetViewSet.list': 9,
+    # session, user, cached filter counts, search index check (yamod/admin.py)
+    'ModelAdmin.changelist_view': 8,
+    '*': 6,
+}
+YAMOD_QUERY_BUDGET_ACTION = 'log'
+
+# Admin change lists of large tables (yamod/admin.py): estimated page
+# counts for unfiltered lists of YAMOD_ADMIN_EXACT_COUNT_LIMIT rows or
+# more, indexed search, cached filter counts.
+YAMOD_ADMIN_PERFORMANCE_MODE = True
+YAMOD_ADMIN_EXACT_COUNT_LIMIT = 10000
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -129,7 +230,8 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_jwt.authentication.JSONWebTokenAuthentication',
+        # JSONWebTokenAuthentication with a cache of verified tokens
+        'yamod.authentication.CachedJSONWebTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.BasicAuthentication',
     ),
@@ -17,10 +17,11 @@ from django.contrib import admin
 from django.urls import path, include
 from rest_framework_jwt.views import obtain_jwt_token
 
-from yamod.urls import router
+from yamod.urls import async_urlpatterns, router
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api-token-auth/', obtain_jwt_token),
+    path('async/',include(async_urlpatterns)),
     path('',include(router.urls))
 ]
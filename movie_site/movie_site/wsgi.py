@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'movie_site.settings')
 
 application = get_wsgi_application()
+
+# load the type-ahead index before the first query (yamod/autocomplete.py)
+from yamod import autocomplete  # noqa: E402
+
+autocomplete.index.warm()